@@ -3,5 +3,5 @@
 Copyright (C) 2023 SME intellect (<https://www.smeintellect.com>).
 This program is free software: you can redistribute it and/or modify it under the terms of the GNU Lesser General Public License as published by the Free Software Foundation, either version 3 of the License, or (at your option) any later version.
 """
-from . import models
+from . import cli, controllers, models
 from .hooks import post_load_hook, uninstall_hook
@@ -22,6 +22,8 @@ This program is free software: you can redistribute it and/or modify it under th
         #view
         "views/rabbitmq_consumer_control_view.xml",
         "views/rabbitmq_log_view.xml",
+        "views/rabbitmq_log_archive_view.xml",
+        "views/rabbitmq_broker_view.xml",
 
         #security
         "security/ir.model.access.csv"
@@ -0,0 +1,75 @@
+#pylint:disable=import-error
+"""Microbenchmark of the datetime normalization used on payload fields.
+
+Run it with the Python interpreter of an Odoo installation where this addon is
+installed (no database is needed)::
+
+    python3 benchmarks/bench_datetime_parse.py --values 100000
+
+The "before" run replays the former ``isoparse`` / ``parser.parse`` path; the
+"after" runs go through ``convert_to_odoo_datetime`` with its cache cleared and
+warm, for ISO strings, Firebase "Z" strings and epoch milliseconds.
+"""
+import argparse
+import time
+from datetime import datetime, timedelta
+
+import pytz
+from dateutil import parser
+
+from odoo.addons.rabbitmq_model_sync.models.rabbitmq_log import (
+    _parse_datetime_string, convert_to_odoo_datetime)
+
+
+def legacy_convert(value):
+    """The conversion as it was before the fast path."""
+    try:
+        dt = parser.isoparse(value)
+    except Exception:  # pylint: disable=broad-except
+        dt = parser.parse(value)
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=pytz.UTC)
+    else:
+        dt = dt.astimezone(pytz.UTC)
+    return dt.replace(tzinfo=None)
+
+
+def sample_values(count, distinct):
+    """Return ``count`` payload values cycling over ``distinct`` timestamps."""
+    start = datetime(2025, 7, 23, 8, 0)
+    stamps = [start + timedelta(seconds=17 * n) for n in range(distinct)]
+    return {
+        "iso": [f"{stamps[n % distinct]:%Y-%m-%dT%H:%M:%S}+02:00" for n in range(count)],
+        "firebase": [f"{stamps[n % distinct]:%Y-%m-%dT%H:%M:%S.%f}Z" for n in range(count)],
+        "epoch_ms": [int(stamps[n % distinct].timestamp() * 1000) for n in range(count)],
+    }
+
+
+def timed(convert, values):
+    """Return values/sec for converting every value."""
+    started = time.perf_counter()
+    for value in values:
+        convert(value)
+    return len(values) / (time.perf_counter() - started)
+
+
+def main():
+    """Parse arguments and print values/sec per format for the legacy and current paths."""
+    args_parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    args_parser.add_argument("--values", type=int, default=100000)
+    args_parser.add_argument("--distinct", type=int, default=1000,
+                             help="distinct timestamps; payloads repeat them")
+    args = args_parser.parse_args()
+
+    for name, values in sample_values(args.values, args.distinct).items():
+        before = timed(legacy_convert, values) if name != "epoch_ms" else None
+        _parse_datetime_string.cache_clear()
+        cold = timed(convert_to_odoo_datetime, values[:args.distinct])
+        warm = timed(convert_to_odoo_datetime, values)
+        legacy = f"{before:12.0f}" if before else f"{'unsupported':>12}"
+        print(f"{name:9} before: {legacy} /s  after (uncached): {cold:12.0f} /s"
+              f"  after (cached): {warm:12.0f} /s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+#pylint:disable=import-error,too-few-public-methods
+"""Benchmark of the log values validation done for every message.
+
+Run it with the Python interpreter of an Odoo installation where this addon is
+installed (no database is needed)::
+
+    python3 benchmarks/bench_log_values.py --messages 100000
+
+Compares the former ``BaseModel.model_validate(...).__dict__`` path with the
+precompiled ``TypeAdapter`` used under strict validation and with the trusted
+producer path, on typical attendance payloads.
+"""
+import argparse
+import time
+from typing import Optional
+
+from pydantic import BaseModel
+
+from odoo.addons.rabbitmq_model_sync.dataclasses.datamodels import validate_log_values
+
+
+class LegacyLogValues(BaseModel):
+    """The log values model as it was validated before the TypeAdapter."""
+
+    queue_name: str
+    data: dict
+    operation: str
+    model_name: str
+    record_id: Optional[int] = None
+    controller_id: Optional[int] = None
+    message_id: Optional[str] = None
+
+
+def attendance_values(count):
+    """Return ``count`` log values shaped like check-in/check-out deliveries."""
+    return [
+        {
+            "queue_name": "attendance",
+            "data": {
+                "employee_code": f"EMP-{n % 500}",
+                "check_in": "2025-07-23T08:00:00Z",
+                "check_out": "2025-07-23T17:00:00Z" if n % 2 else None,
+                "device": {"id": n % 20, "location": "Main entrance"},
+                "record_id": n if n % 2 else None,
+            },
+            "operation": "write" if n % 2 else "create",
+            "model_name": "hr.attendance",
+            "record_id": n if n % 2 else None,
+            "controller_id": 1,
+            "message_id": f"msg-{n}",
+        }
+        for n in range(count)
+    ]
+
+
+def timed(validate, values_list):
+    """Return messages/sec for validating every log values dict."""
+    started = time.perf_counter()
+    for values in values_list:
+        validate(values)
+    return len(values_list) / (time.perf_counter() - started)
+
+
+def main():
+    """Parse arguments and print messages/sec for each validation path."""
+    args_parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    args_parser.add_argument("--messages", type=int, default=100000)
+    args = args_parser.parse_args()
+
+    values_list = attendance_values(args.messages)
+    before = timed(lambda vals: LegacyLogValues.model_validate(vals).__dict__, values_list)
+    strict = timed(validate_log_values, values_list)
+    trusted = timed(lambda vals: validate_log_values(vals, strict=False), values_list)
+    print(f"before  (model_validate + __dict__): {before:12.0f} msg/s")
+    print(f"strict  (precompiled TypeAdapter):   {strict:12.0f} msg/s")
+    print(f"trusted (no validation):             {trusted:12.0f} msg/s")
+
+
+if __name__ == "__main__":
+    main()
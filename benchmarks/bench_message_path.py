@@ -0,0 +1,119 @@
+#pylint:disable=import-error,protected-access,too-few-public-methods
+"""Benchmark of the RabbitMQ message path against a stubbed broker.
+
+Run it with the Python interpreter of an Odoo installation where this addon is
+installed, against a scratch database (log and partner rows are committed)::
+
+    python3 benchmarks/bench_message_path.py -c /etc/odoo/odoo.conf -d scratch_db
+
+Deliveries are pushed through ``AsyncAttendanceConsumer.on_message`` by a stub
+channel, so no broker is needed. The "before" run replays the former message
+path that rebuilt the registry with ``Registry.new`` for every delivery.
+"""
+import argparse
+import json
+import time
+from collections import namedtuple
+
+import odoo
+from odoo import SUPERUSER_ID, api, modules
+
+from odoo.addons.rabbitmq_model_sync.dataclasses.datamodels import validate_log_values
+from odoo.addons.rabbitmq_model_sync.utils.asyncio_consumer import AsyncAttendanceConsumer
+
+StubMethod = namedtuple("StubMethod", "routing_key delivery_tag redelivered")
+StubProperties = namedtuple("StubProperties", "headers message_id content_type")
+
+
+class StubChannel:
+    """Channel stand-in that only records acknowledgements."""
+
+    def __init__(self):
+        self.acked = 0
+
+    def basic_ack(self, delivery_tag=0, multiple=False):  # pylint: disable=unused-argument
+        """Record an acknowledgement."""
+        self.acked += 1
+
+
+def legacy_process_message(db_name, method, properties, body, model_name):
+    """The message path as it was before the registry handle: Registry.new per message."""
+    msg = json.loads(body.decode())
+    log_vals = {
+        "queue_name": method.routing_key,
+        "data": msg,
+        "operation": properties.headers.get("operation"),
+        "model_name": model_name,
+    }
+    registry = modules.registry.Registry.new(db_name)
+    with registry.cursor() as cr:
+        env = api.Environment(cr, SUPERUSER_ID, {})
+        env["rabbitmq.log"].create(validate_log_values(log_vals)).process_odoo_operation()
+        cr.commit()
+
+
+def run(consumer, count, queue):
+    """Push ``count`` deliveries through the consumer and return messages/sec."""
+    channel = StubChannel()
+    started = time.perf_counter()
+    for tag in range(1, count + 1):
+        body = json.dumps({"name": f"Bench Partner {tag}"}).encode()
+        consumer.on_message(
+            channel,
+            StubMethod(queue, tag, False),
+            StubProperties({"operation": "create"}, f"bench-{tag}", "application/json"),
+            body,
+        )
+    elapsed = time.perf_counter() - started
+    assert channel.acked == count, "every stubbed delivery must be acknowledged"
+    return count / elapsed
+
+
+def main():
+    """Parse arguments and print messages/sec for the legacy and current paths."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("-c", "--config", help="Odoo configuration file")
+    parser.add_argument("-d", "--database", required=True)
+    parser.add_argument("--messages", type=int, default=500)
+    parser.add_argument("--legacy-messages", type=int, default=20,
+                        help="the legacy path is slow, keep this small")
+    args = parser.parse_args()
+
+    odoo.tools.config.parse_config(["-c", args.config] if args.config else [])
+    db_name = args.database
+    queue = "bench-queue"
+    registry = modules.registry.Registry(db_name)
+    with registry.cursor() as cr:
+        env = api.Environment(cr, SUPERUSER_ID, {})
+        controller = env["rabbitmq.consumer.controller"].create({
+            "queue": queue,
+            "sync_model": env["ir.model"]._get_id("res.partner"),
+        })
+        cr.commit()
+        controller_id = controller.id
+
+    try:
+        legacy = AsyncAttendanceConsumer(
+            "", "direct", queue,
+            lambda m, p, b: legacy_process_message(db_name, m, p, b, "res.partner"),
+        )
+        before = run(legacy, args.legacy_messages, queue)
+
+        with registry.cursor() as cr:
+            env = api.Environment(cr, SUPERUSER_ID, {})
+            controller = env["rabbitmq.consumer.controller"].browse(controller_id)
+            current = AsyncAttendanceConsumer("", "direct", queue, lambda m, p, b: (
+                controller._process_rabbitmq_message(m, p, b, "res.partner")))
+            after = run(current, args.messages, queue)
+    finally:
+        with registry.cursor() as cr:
+            env = api.Environment(cr, SUPERUSER_ID, {})
+            env["rabbitmq.consumer.controller"].browse(controller_id).unlink()
+
+    print(f"before (Registry.new per message): {before:10.1f} msg/s "
+          f"over {args.legacy_messages} messages")
+    print(f"after  (cached registry + lease):  {after:10.1f} msg/s over {args.messages} messages")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,2 @@
+"""Command line entry points of the RabbitMQ model sync module."""
+from . import consumer_runner
@@ -0,0 +1,250 @@
+#pylint:disable=import-error,too-few-public-methods
+"""``rabbitmq_consumers`` command: run the RabbitMQ consumers outside the HTTP server.
+
+    odoo-bin rabbitmq_consumers -c odoo.conf -d mydb [--queues-per-process 4]
+
+A supervisor loads the registry of each database once, then forks worker
+processes that inherit it, each serving at most ``--queues-per-process``
+running controllers. The supervisor polls the controller states and hands
+started or stopped controllers to the workers through a pipe, starting
+workers as needed and restarting the ones that die, so no restart is needed
+to follow the UI. Set ``rabbitmq_dedicated_runner = True`` in the server
+configuration so the HTTP workers leave the consumers to this command.
+"""
+import argparse
+import logging
+import multiprocessing
+import signal
+import sys
+import threading
+import time
+from pathlib import Path
+
+import odoo
+from odoo import SUPERUSER_ID, api
+from odoo.cli import Command
+from odoo.tools import config
+
+from ..utils import ownership
+from ..utils.ownership import OwnershipCoordinator
+from ..utils.registry_handle import RegistryHandle
+
+_logger = logging.getLogger(__name__)
+
+DEFAULT_QUEUES_PER_PROCESS = 4
+DEFAULT_POLL_INTERVAL = 10.0
+# Seconds a stopping worker gets to settle its deliveries before it is terminated
+STOP_TIMEOUT = 30
+# Seconds between two restarts of a crashing worker
+RESTART_DELAY = 5
+
+
+def _exit(*_args):
+    raise SystemExit(0)
+
+
+def _worker_main(db_name, conn):
+    """Worker process: run the consumers of the controller ids received through ``conn``.
+
+    A new list of ids replaces the assignment; None or a closed pipe stops
+    the worker, which then stops its consumers and releases its leases.
+    """
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, _exit)
+    coordinator = OwnershipCoordinator(db_name, conn.recv())
+    try:
+        while coordinator.controller_ids:
+            try:
+                interval = coordinator.tick()
+            except Exception:  # pylint: disable=broad-except
+                _logger.exception("RabbitMQ consumer worker failed to sync '%s'", db_name)
+                interval = RESTART_DELAY
+            try:
+                if conn.poll(interval):
+                    coordinator.controller_ids = conn.recv()
+            except EOFError:
+                break
+    finally:
+        coordinator.release()
+
+
+class _Worker:
+    """Supervisor side of a worker process serving some controllers of one database."""
+
+    def __init__(self, db_name, controller_ids):
+        self.db_name = db_name
+        self.controller_ids = frozenset(controller_ids)
+        self.process = None
+        self.conn = None
+        self.started_at = 0.0
+        self.stopping_since = None
+
+    def spawn(self, context):
+        """Fork the worker process and send it its controllers."""
+        # A forked child must not reuse the supervisor's database connections
+        odoo.sql_db.close_all()
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(
+            target=_worker_main, args=(self.db_name, child_conn),
+            name=f"rabbitmq-consumers-{self.db_name}",
+        )
+        self.process.start()
+        child_conn.close()
+        self.started_at = time.monotonic()
+        self._send(sorted(self.controller_ids))
+        _logger.info(
+            "Started RabbitMQ consumer worker %s for controllers %s of '%s'",
+            self.process.pid, sorted(self.controller_ids), self.db_name,
+        )
+
+    def assign(self, controller_ids):
+        """Hand the worker a new set of controllers."""
+        self.controller_ids = frozenset(controller_ids)
+        self._send(sorted(self.controller_ids))
+
+    def stop(self):
+        """Ask the worker to stop its consumers and exit."""
+        if self.stopping_since is None:
+            self.stopping_since = time.monotonic()
+            self._send(None)
+
+    def _send(self, message):
+        try:
+            self.conn.send(message)
+        except OSError:
+            # The worker died; the supervisor restarts it with its assignment
+            pass
+
+    def kill(self):
+        """Terminate a worker that did not stop in time."""
+        self.process.terminate()
+        self.process.join(5)
+        if self.process.is_alive():
+            self.process.kill()
+
+
+class ConsumerRunner:
+    """Supervised pool of consumer worker processes for one or more databases."""
+
+    def __init__(self, db_names, queues_per_process=DEFAULT_QUEUES_PER_PROCESS,
+                 poll_interval=DEFAULT_POLL_INTERVAL):
+        self.db_names = db_names
+        self.queues_per_process = max(queues_per_process, 1)
+        self.poll_interval = poll_interval
+        self.workers = []
+        self.stopping = []
+        self._stop = threading.Event()
+        self._context = multiprocessing.get_context("fork")
+
+    def run(self):
+        """Supervise the workers until SIGINT or SIGTERM."""
+        signal.signal(signal.SIGINT, lambda *_args: self._stop.set())
+        signal.signal(signal.SIGTERM, lambda *_args: self._stop.set())
+        while not self._stop.is_set():
+            for db_name in self.db_names:
+                try:
+                    self.rebalance(db_name, self._running_controllers(db_name))
+                except Exception:  # pylint: disable=broad-except
+                    _logger.exception("Could not read the RabbitMQ consumers of '%s'", db_name)
+            self.supervise()
+            self._stop.wait(self.poll_interval)
+        self.shutdown()
+
+    def _running_controllers(self, db_name):
+        with RegistryHandle.get(db_name).registry.cursor() as cr:
+            env = api.Environment(cr, SUPERUSER_ID, {})
+            controllers = env["rabbitmq.consumer.controller"]
+            return controllers.search([("state", "=", "running")], order="id").ids
+
+    def rebalance(self, db_name, controller_ids):
+        """Keep each running controller on exactly one worker of ``db_name``.
+
+        Workers keep their controllers while they run, so starting or stopping
+        a controller never interrupts the others; free room on existing
+        workers is filled before new workers are started.
+        """
+        running = set(controller_ids)
+        workers = [worker for worker in self.workers if worker.db_name == db_name]
+        assigned = set().union(*(worker.controller_ids for worker in workers))
+        pending = [
+            controller_id for controller_id in controller_ids if controller_id not in assigned
+        ]
+        for worker in workers:
+            wanted = set(worker.controller_ids & running)
+            while pending and len(wanted) < self.queues_per_process:
+                wanted.add(pending.pop(0))
+            if not wanted:
+                self.workers.remove(worker)
+                self.stopping.append(worker)
+                worker.stop()
+            elif wanted != worker.controller_ids:
+                worker.assign(wanted)
+        for start in range(0, len(pending), self.queues_per_process):
+            worker = _Worker(db_name, pending[start:start + self.queues_per_process])
+            worker.spawn(self._context)
+            self.workers.append(worker)
+
+    def supervise(self):
+        """Restart dead workers and reap the stopped ones."""
+        now = time.monotonic()
+        for worker in self.workers:
+            if not worker.process.is_alive() and now - worker.started_at >= RESTART_DELAY:
+                _logger.warning(
+                    "RabbitMQ consumer worker %s exited with code %s, restarting it",
+                    worker.process.pid, worker.process.exitcode,
+                )
+                worker.spawn(self._context)
+        for worker in list(self.stopping):
+            if worker.process.is_alive() and now - worker.stopping_since >= STOP_TIMEOUT:
+                worker.kill()
+            if not worker.process.is_alive():
+                worker.process.join()
+                self.stopping.remove(worker)
+
+    def shutdown(self):
+        """Stop every worker, giving them STOP_TIMEOUT to settle their deliveries."""
+        _logger.info("Stopping %d RabbitMQ consumer worker(s)...", len(self.workers))
+        self.stopping.extend(self.workers)
+        self.workers = []
+        for worker in self.stopping:
+            worker.stop()
+        deadline = time.monotonic() + STOP_TIMEOUT
+        for worker in self.stopping:
+            worker.process.join(max(deadline - time.monotonic(), 0))
+            if worker.process.is_alive():
+                worker.kill()
+        self.stopping = []
+
+
+class RabbitmqConsumers(Command):
+    """Run the RabbitMQ consumers in a supervised process pool"""
+    name = "rabbitmq_consumers"
+
+    def run(self, cmdargs):
+        """Parse the command line, load the registries and run the supervisor."""
+        parser = argparse.ArgumentParser(
+            prog=f"{Path(sys.argv[0]).name} {self.name}",
+            description=self.__doc__,
+            epilog="Any other argument is read as an Odoo server option.",
+        )
+        parser.add_argument(
+            "--queues-per-process", type=int, default=DEFAULT_QUEUES_PER_PROCESS,
+            help="Running controllers served by each worker process (default: %(default)s).",
+        )
+        parser.add_argument(
+            "--poll-interval", type=float, default=DEFAULT_POLL_INTERVAL,
+            help="Seconds between two reads of the controller states (default: %(default)s).",
+        )
+        options, odoo_args = parser.parse_known_args(cmdargs)
+        config.parse_config(odoo_args, setup_logging=True)
+        db_names = [db_name for db_name in (config["db_name"] or "").split(",") if db_name]
+        if not db_names:
+            parser.error("a database is required (-d/--database)")
+
+        # Keeps post_load and the controller actions from starting consumers in the supervisor
+        ownership.RUNNER_PROCESS = True
+        odoo.service.server.load_server_wide_modules()
+        for db_name in db_names:
+            # Load each registry once; the forked workers inherit it
+            RegistryHandle.get(db_name).registry  # pylint: disable=expression-not-assigned
+        ConsumerRunner(db_names, options.queues_per_process, options.poll_interval).run()
@@ -0,0 +1,2 @@
+"""HTTP controllers of the RabbitMQ model sync module."""
+from . import main
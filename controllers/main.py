@@ -0,0 +1,21 @@
+#pylint:disable=import-error,protected-access,too-few-public-methods
+"""JSON endpoint exposing the metrics of the RabbitMQ consumers of every server process."""
+from werkzeug.exceptions import Forbidden
+
+from odoo import http
+from odoo.http import request
+
+
+class RabbitMqMetricsController(http.Controller):
+    """Serve consumer metrics to monitoring tools."""
+
+    @http.route("/rabbitmq_model_sync/metrics", type="http", auth="user", methods=["GET"])
+    def metrics(self, queue=None):
+        """Return the counters and latency histograms of every controller, or of one queue."""
+        if not request.env.user.has_group("base.group_system"):
+            raise Forbidden()
+        domain = [("queue", "=", queue)] if queue else []
+        controllers = request.env["rabbitmq.consumer.controller"].search(domain)
+        return request.make_json_response(
+            {"queues": [controller._metrics_snapshot() for controller in controllers]}
+        )
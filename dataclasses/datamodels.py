@@ -4,9 +4,11 @@ Copyright (C) 2023 SME intellect (<https://www.smeintellect.com>).
 This program is free software: you can redistribute it and/or modify it under the terms of the GNU Lesser General Public License as published by the Free Software Foundation, either version 3 of the License, or (at your option) any later version.
 """
 # *- coding: utf-8 -*-
+import itertools
 from typing import Optional
 
-from pydantic import BaseModel
+from pydantic import BaseModel, PrivateAttr, TypeAdapter
+from typing_extensions import NotRequired, TypedDict
 
 from .enum_ext import EnumExt
 
@@ -24,6 +26,7 @@ class OperationType(EnumExt):
 
     CREATE = ("create", "Create")
     WRITE = ("write", "Write")
+    UPSERT = ("upsert", "Upsert")
 
 
 class RabbitMQConfig(BaseModel):
@@ -37,14 +40,27 @@ class RabbitMQConfig(BaseModel):
     virtual_host: Optional[str] = "/"
 
 
-class LogValues(BaseModel):
-    """Data model for RabbitMQ log values."""
+class LogValues(TypedDict):
+    """Values of a rabbitmq.log record built from a delivery."""
 
     queue_name: str
     data: dict
     operation: str
     model_name: str
-    record_id: Optional[int] = None
+    record_id: NotRequired[Optional[int]]
+    controller_id: NotRequired[Optional[int]]
+    message_id: NotRequired[Optional[str]]
+
+
+# Compiled once; validates into a plain dict that can be passed to create()
+LOG_VALUES_ADAPTER = TypeAdapter(LogValues)
+
+
+def validate_log_values(vals, strict=True):
+    """Return ``vals`` validated as LogValues, or as is for trusted producers."""
+    if not strict:
+        return vals
+    return LOG_VALUES_ADAPTER.validate_python(vals)
 
 
 class ExchangeType(EnumExt):
@@ -62,3 +78,47 @@ class RabbitMQConsumerState(EnumExt):
     DRAFT = ("draft", "Draft")
     STOP = ("stop", "Stop")
     RUNNING = ("running", "Running")
+
+
+class ConsumerHealth(EnumExt):
+    """Enum for the connection health of a consumer slot."""
+
+    HEALTHY = ("healthy", "Healthy")
+    DEGRADED = ("degraded", "Degraded")
+
+
+class LogPolicy(EnumExt):
+    """Enum for which messages get a persisted log record."""
+
+    ALL = ("all", "All Messages")
+    FAILURES = ("failures", "Failures Only")
+    SAMPLED = ("sampled", "Sampled")
+
+
+class MappingMode(EnumExt):
+    """Enum for what a field mapping rule does with a payload key."""
+
+    RENAME = ("rename", "Rename")
+    LOOKUP = ("lookup", "Resolve Reference")
+    DROP = ("drop", "Drop")
+
+
+class ProcessingOptions(BaseModel):
+    """Controller settings captured when its consumers start."""
+
+    controller_id: Optional[int] = None
+    model_name: str
+    log_policy: str = "all"
+    log_sample_rate: int = 1
+    deduplicate: bool = False
+    dedup_header: Optional[str] = None
+    strict_validation: bool = False
+    _counter: itertools.count = PrivateAttr(default_factory=itertools.count)
+
+    def should_log(self) -> bool:
+        """Return True when the next message must persist its log record up front."""
+        if self.log_policy == "all":
+            return True
+        if self.log_policy == "sampled":
+            return next(self._counter) % max(self.log_sample_rate, 1) == 0
+        return False
@@ -3,25 +3,33 @@
 Copyright (C) 2023 SME intellect (<https://www.smeintellect.com>)
 This program is free software: you can redistribute it and/or modify it under the terms of the GNU Lesser General Public License as published by the Free Software Foundation, either version 3 of the License, or (at your option) any later version.
 """
-from odoo import api, modules, SUPERUSER_ID
+import threading
+
 import odoo
 
+from .utils.ownership import dedicated_runner, start_when_ready
+
 def post_load_hook():
-    """ Get the database name from config"""
-    db_name = odoo.tools.config.get('db_name')
-    if not db_name:
+    """Start the consumers of the configured databases once the server has loaded them.
+
+    Runs while the server is still loading, so nothing is started here: a
+    daemon thread waits for each registry of ``db_name`` (a comma-separated
+    list) to be ready. The ownership coordinator then staggers the consumer
+    startups with jitter. Databases not listed are started by the
+    ensure-consumers cron.
+
+    With ``workers`` set, post_load runs in the prefork master: consumers and
+    slot leases started there would be inherited, stale, by every forked
+    worker. Startup is then left to the cron, which runs in a worker, or to
+    the dedicated runner.
+    """
+    config = odoo.tools.config
+    db_names = [db_name.strip() for db_name in (config.get('db_name') or '').split(',') if db_name.strip()]
+    if not db_names or dedicated_runner() or config.get('workers') or config.get('stop_after_init') or config.get('test_enable'):
         return
-    registry = modules.registry.Registry.new(db_name)
-    with registry.cursor() as cr:
-        env = api.Environment(cr, SUPERUSER_ID, {})
-        # Check if model is loaded
-        if 'rabbitmq.consumer.controller' in env.registry.models:
-            controllers = env['rabbitmq.consumer.controller'].sudo().search([('state', '=', 'running')])
-            for controller in controllers:
-                controller.action_start_consumer()
-        else:
-            # Model not loaded yet, skip
-            pass
+    threading.Thread(
+        target=start_when_ready, args=(db_names,), daemon=True, name="rabbitmq-consumers-startup"
+    ).start()
 
 def uninstall_hook(env):
     """Stop all running consumers """
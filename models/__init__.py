@@ -1,4 +1,5 @@
 """This file is part of SME intellect Odoo Apps.
 Copyright (C) 2023 SME intellect (<https://www.smeintellect.com>)
 """
-from . import rabbitmq_consumer_controller, rabbitmq_log
+from . import (rabbitmq_broker, rabbitmq_consumer_controller, rabbitmq_consumer_lease,
+               rabbitmq_field_mapping, rabbitmq_log, rabbitmq_log_archive)
@@ -0,0 +1,153 @@
+#pylint:disable=import-error,protected-access,too-few-public-methods
+"""RabbitMQ broker connection settings.
+
+A broker is one RabbitMQ node or cluster: a list of hosts tried in order for
+failover, sharing a vhost, credentials and connection tuning. The pika
+connection parameters, one per host, are built once per broker and cached
+until the broker changes. Controllers of different brokers get separate
+connections, so heavy queues can be moved to a node of their own.
+"""
+import pika
+
+from odoo import _, api, fields, models, tools
+from odoo.exceptions import ValidationError
+
+DEFAULT_PORT = 5672
+# AMQP 0-9-1 frame size bounds accepted by pika
+FRAME_MIN_SIZE = 4096
+FRAME_MAX_SIZE = 131072
+# Fields the pika connection parameters are built from
+CONNECTION_FIELDS = frozenset({
+    "hosts", "port", "virtual_host", "username", "password", "heartbeat", "frame_max",
+    "socket_timeout", "blocked_connection_timeout", "tcp_keepalive", "tcp_keepidle",
+    "tcp_keepintvl", "tcp_keepcnt",
+})
+
+
+def parse_hosts(hosts, default_port=DEFAULT_PORT):
+    """Return the ``[(host, port)]`` of a comma or newline separated ``host[:port]`` list.
+
+    Raises ValueError on an empty list or a bad port.
+    """
+    endpoints = []
+    for entry in (hosts or "").replace("\n", ",").split(","):
+        entry = entry.strip()
+        if not entry:
+            continue
+        host, _sep, port = entry.partition(":")
+        if port and not port.isdigit():
+            raise ValueError(f"Invalid port in broker host {entry!r}.")
+        endpoints.append((host.strip(), int(port) if port else default_port))
+    if not endpoints:
+        raise ValueError("A broker needs at least one host.")
+    return endpoints
+
+
+class RabbitMqBroker(models.Model):
+    """RabbitMQ node or cluster the consumers connect to."""
+    _name = "rabbitmq.broker"
+    _description = "RabbitMQ Broker"
+    _order = "name"
+
+    name = fields.Char(string="Name", required=True)
+    active = fields.Boolean(default=True)
+    hosts = fields.Char(
+        string="Hosts",
+        required=True,
+        default="localhost",
+        help="Comma-separated 'host[:port]' list of the cluster nodes. Connections go to the "
+             "first reachable host; when a host is down the next one is tried right away.",
+    )
+    port = fields.Integer(string="Default Port", default=DEFAULT_PORT)
+    virtual_host = fields.Char(string="Virtual Host", required=True, default="/")
+    username = fields.Char(string="Username", required=True, default="guest")
+    password = fields.Char(string="Password", groups="base.group_system")
+    heartbeat = fields.Integer(
+        string="Heartbeat (s)",
+        default=30,
+        help="AMQP heartbeat timeout negotiated with the broker; 0 disables heartbeats.",
+    )
+    frame_max = fields.Integer(
+        string="Max Frame Size",
+        default=FRAME_MAX_SIZE,
+        help="Largest AMQP frame in bytes; larger bodies are split over several frames.",
+    )
+    socket_timeout = fields.Float(
+        string="Connect Timeout (s)",
+        default=10.0,
+        help="Time to wait for a host to accept the connection before failing over to the next.",
+    )
+    blocked_connection_timeout = fields.Integer(
+        string="Blocked Timeout (s)",
+        default=300,
+        help="Close a connection the broker keeps blocked (e.g. on a memory alarm) this long.",
+    )
+    tcp_keepalive = fields.Boolean(
+        string="TCP Keepalive",
+        default=True,
+        help="Probe idle connections so that dead peers behind NAT or load balancers are detected.",
+    )
+    tcp_keepidle = fields.Integer(string="Keepalive Idle (s)", default=60)
+    tcp_keepintvl = fields.Integer(string="Keepalive Interval (s)", default=10)
+    tcp_keepcnt = fields.Integer(string="Keepalive Probes", default=3)
+    controller_ids = fields.One2many(
+        "rabbitmq.consumer.controller", "broker_id", string="Consumers"
+    )
+
+    @api.constrains("hosts", "port", "heartbeat", "frame_max", "socket_timeout")
+    def _check_connection_settings(self):
+        """Ensure the host list parses and the tuning values are accepted by pika."""
+        for broker in self:
+            try:
+                parse_hosts(broker.hosts, broker.port)
+            except ValueError as e:
+                raise ValidationError(str(e)) from e
+            if broker.heartbeat < 0:
+                raise ValidationError(_("The heartbeat cannot be negative."))
+            if not FRAME_MIN_SIZE <= broker.frame_max <= FRAME_MAX_SIZE:
+                raise ValidationError(
+                    _("The max frame size must be between %(min)s and %(max)s bytes.",
+                      min=FRAME_MIN_SIZE, max=FRAME_MAX_SIZE)
+                )
+            if broker.socket_timeout <= 0:
+                raise ValidationError(_("The connect timeout must be positive."))
+
+    def write(self, vals):
+        """Drop the cached connection parameters when a connection setting changes."""
+        result = super().write(vals)
+        if CONNECTION_FIELDS & vals.keys():
+            self.env.registry.clear_cache()
+        return result
+
+    def _connection_parameters(self):
+        """Return the pika connection parameters of each host, in failover order."""
+        self.ensure_one()
+        return self.env["rabbitmq.broker"].sudo()._compiled_connection_parameters(self.id)
+
+    @api.model
+    @tools.ormcache("broker_id")
+    def _compiled_connection_parameters(self, broker_id):
+        """Build the parameters once per registry; broker changes clear them."""
+        broker = self.browse(broker_id)
+        credentials = pika.PlainCredentials(broker.username, broker.password or "")
+        tcp_options = None
+        if broker.tcp_keepalive:
+            tcp_options = {
+                "TCP_KEEPIDLE": broker.tcp_keepidle,
+                "TCP_KEEPINTVL": broker.tcp_keepintvl,
+                "TCP_KEEPCNT": broker.tcp_keepcnt,
+            }
+        return tuple(
+            pika.ConnectionParameters(
+                host=host,
+                port=port,
+                virtual_host=broker.virtual_host,
+                credentials=credentials,
+                heartbeat=broker.heartbeat,
+                frame_max=broker.frame_max,
+                socket_timeout=broker.socket_timeout,
+                blocked_connection_timeout=broker.blocked_connection_timeout,
+                tcp_options=tcp_options,
+            )
+            for host, port in parse_hosts(broker.hosts, broker.port)
+        )
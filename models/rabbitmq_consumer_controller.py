@@ -1,26 +1,98 @@
-#pylint:disable=import-error
+#pylint:disable=import-error,protected-access,too-many-locals
 """Manages RabbitMQ consumers, processes messages, and syncs data to Odoo models."""
-import json
 import logging
+import random
 import threading
+from collections import defaultdict
+from functools import partial
 
-from psycopg2 import DatabaseError
+from psycopg2 import DatabaseError, InterfaceError, OperationalError
+from psycopg2.errors import UniqueViolation
 
-from odoo import SUPERUSER_ID, _, api, fields, models, modules
+from odoo import _, api, fields, models
+from odoo.exceptions import ValidationError
+from odoo.service.model import PG_CONCURRENCY_ERRORS_TO_RETRY
 
-from ..dataclasses.datamodels import (ExchangeType, LogValues,
-                                      RabbitMQConsumerState)
-from ..utils.asyncio_consumer import ReconnectingAsyncAttendanceConsumer
+from ..dataclasses.datamodels import (ConsumerHealth, ExchangeType, LogPolicy,
+                                      ProcessingOptions, RabbitMQConsumerState,
+                                      validate_log_values)
+from ..utils.asyncio_consumer import (ACK, ATTEMPTS_HEADER, DETERMINISTIC_ERRORS, REJECT,
+                                      RETRY, AsyncAttendanceConsumer,
+                                      ReconnectingAsyncAttendanceConsumer,
+                                      default_connection_parameters)
+from ..utils.connection_manager import ConnectionManager
+from ..utils.decoders import BodyPreview, decode_body
+from ..utils.lru_cache import LRUCache
+from ..utils.metrics import QueueMetrics, merge_snapshots
+from ..utils.ownership import OwnershipCoordinator, dedicated_runner
+from ..utils.registry_handle import RegistryHandle
+from .rabbitmq_consumer_lease import current_owner
+from .rabbitmq_field_mapping import MAPPING_PLANS, compile_mapping_plan
 
 _logger = logging.getLogger(__name__)
 
 
 RMQ_LOG = "rabbitmq.log"
 
+# Message ids processed recently in this process: (db, queue, message id) -> True
+SEEN_MESSAGES = LRUCache(maxsize=100000)
+
+# Consumers started by the ownership coordinator (at boot or on takeover) connect
+# at a random point within this many seconds, so queues do not reconnect to the
+# broker at once; override with the rabbitmq_model_sync.startup_jitter parameter.
+STARTUP_JITTER = 10
+
+
+def _is_transient(error):
+    """Return True for database errors worth retrying.
+
+    These are concurrency conflicts and lost connections.
+    """
+    return (
+        getattr(error, "pgcode", None) in PG_CONCURRENCY_ERRORS_TO_RETRY
+        or isinstance(error, (OperationalError, InterfaceError))
+    )
+
+
+def _outcome_of(error):
+    """Map a database error that aborted processing to the delivery outcome.
+
+    A unique violation means the message id already has a successful log,
+    written by another consumer: the duplicate is acked.
+    """
+    if isinstance(error, UniqueViolation):
+        return ACK
+    return RETRY if _is_transient(error) else REJECT
+
+
+def _run_consumer(consumer, db_name, start_delay=0):
+    """Thread target: run the consumer and release the thread's cursor lease on exit."""
+    try:
+        consumer.run(start_delay=start_delay)
+    finally:
+        RegistryHandle.get(db_name).release()
+
+
+def _report_health(db_name, controller_id, consumer, health):
+    """Circuit breaker callback: record the health of a consumer slot on its lease."""
+    try:
+        with RegistryHandle.get(db_name).registry.cursor() as cr:
+            cr.execute(
+                "UPDATE rabbitmq_consumer_lease SET health = %s "
+                "WHERE controller_id = %s AND slot = %s AND owner = %s",
+                (health, controller_id, consumer.slot, current_owner()),
+            )
+    except Exception:  # pylint: disable=broad-except
+        _logger.exception("Could not record the health of consumer slot %s", consumer.slot)
+
+
 class RabbitMqConsumerController(models.Model):
     """Controller for managing RabbitMQ consumers in Odoo."""
+    # Consumers and their threads in this process, by (db_name, controller_id)
     CONSUMERS = {}
     THREADS = {}
+    # Serializes changes to CONSUMERS/THREADS by request and coordinator threads
+    _OWNERSHIP_LOCK = threading.RLock()
     _name = "rabbitmq.consumer.controller"
     _description = "RabbitMQ Consumer Controller"
 
@@ -30,6 +102,13 @@ class RabbitMqConsumerController(models.Model):
         selection=ExchangeType.get_selection(), string="Exchange Type", default="direct"
     )
     exchange = fields.Char(string="Exchange")
+    broker_id = fields.Many2one(
+        "rabbitmq.broker",
+        string="Broker",
+        ondelete="restrict",
+        help="Broker the queue lives on. Leave empty to use the settings of the module's "
+             ".env file.",
+    )
     state = fields.Selection(
         selection=RabbitMQConsumerState.get_selection(), string="State", default="draft"
     )
@@ -40,6 +119,305 @@ class RabbitMqConsumerController(models.Model):
         required=True,
         ondelete="SET NULL",
     )
+    external_key_field_id = fields.Many2one(
+        "ir.model.fields",
+        string="External Key Field",
+        domain="[('model_id', '=', sync_model), ('ttype', 'in', ('char', 'integer')), "
+               "('store', '=', True)]",
+        ondelete="set null",
+        help="Field of the sync model that upsert messages are matched on, e.g. a code known "
+             "to the producer, so redelivered or replayed messages update instead of duplicating.",
+    )
+    datetime_fields = fields.Char(
+        string="Datetime Fields",
+        default="check_in,check_out",
+        help="Comma-separated payload fields converted to UTC datetimes. Accepts ISO 8601 "
+             "strings, epoch seconds/milliseconds/microseconds/nanoseconds and Firebase "
+             "timestamps.",
+    )
+    field_mapping_ids = fields.One2many(
+        "rabbitmq.field.mapping",
+        "controller_id",
+        string="Field Mapping",
+        help="Rename or drop payload keys. Other keys are matched to the sync model's fields by "
+             "name and coerced to their type; keys matching no field are dropped.",
+    )
+    batch_size = fields.Integer(
+        string="Batch Size",
+        default=1,
+        help="Number of messages committed and acknowledged together. 1 disables batching.",
+    )
+    batch_linger_ms = fields.Integer(
+        string="Batch Linger (ms)",
+        default=200,
+        help="Maximum time a partial batch waits for more messages before it is flushed.",
+    )
+
+    prefetch_count = fields.Integer(
+        string="Prefetch Count",
+        default=100,
+        help="Maximum number of unacknowledged messages the broker pushes to this consumer. "
+             "0 means unlimited.",
+    )
+    prefetch_size = fields.Integer(
+        string="Prefetch Size",
+        default=0,
+        help="Maximum size in bytes of unacknowledged messages pushed by the broker. "
+             "RabbitMQ does not implement it and only accepts 0 (unlimited).",
+    )
+    max_in_flight = fields.Integer(
+        string="In-flight Window",
+        default=0,
+        help="Pause consumption when this many messages are received but not yet acknowledged, "
+             "and resume once half of them are settled. 0 relies on the prefetch count alone.",
+    )
+    worker_count = fields.Integer(
+        string="Worker Threads",
+        default=0,
+        help="Process messages on this many worker threads so database work never blocks the "
+             "connection's I/O loop. Messages with the same 'record_id' header, or the same "
+             "partitioning routing key, always share a worker. "
+             "0 processes messages on the I/O loop.",
+    )
+    concurrency = fields.Integer(
+        string="Concurrency",
+        default=1,
+        help="Number of consumers started together on this queue, each with its own connection "
+             "or, with a shared connection, its own channel.",
+    )
+    shared_connection = fields.Boolean(
+        string="Shared Connection",
+        default=False,
+        help="Open this controller's channels on the connection shared by all controllers of the "
+             "same broker instead of a dedicated connection and thread. Use worker threads with "
+             "it, so one slow queue does not hold up the shared I/O loop.",
+    )
+    log_policy = fields.Selection(
+        selection=LogPolicy.get_selection(),
+        string="Logging Policy",
+        default="all",
+        required=True,
+        help="All Messages: persist a log record for every message. Failures Only: apply the "
+             "message directly and persist a log record only when it fails. Sampled: like "
+             "Failures Only, but also keep one successful message out of every N.",
+    )
+    log_sample_rate = fields.Integer(
+        string="Sample 1 in N",
+        default=100,
+        help="With the Sampled policy, persist the log record of one message out of this many.",
+    )
+    deduplicate = fields.Boolean(
+        string="Deduplicate Redeliveries",
+        default=False,
+        help="Record each message's id and skip redelivered messages that were already "
+             "processed. Redeliveries are checked against recently seen ids in memory, then "
+             "against the logs. With a lighter logging policy only the in-memory check applies "
+             "to successful messages.",
+    )
+    dedup_header = fields.Char(
+        string="Message ID Header",
+        help="Header carrying the message id. Leave empty to use the AMQP message_id property.",
+    )
+    strict_validation = fields.Boolean(
+        string="Strict Validation",
+        default=False,
+        help="Validate the log values of every message against their schema. Leave off for "
+             "trusted producers: payloads are then checked only when they are synced.",
+    )
+    max_attempts = fields.Integer(
+        string="Max Attempts",
+        default=5,
+        help="Messages failing with a transient database error (lock timeout, serialization "
+             "failure, lost connection) are retried with exponential backoff until this many "
+             "attempts, then dead-lettered. Messages whose sync fails are acknowledged, since "
+             "their failed log record can be retried from Odoo.",
+    )
+    retry_delay_ms = fields.Integer(
+        string="Retry Delay (ms)",
+        default=1000,
+        help="Delay before the first retry; it doubles on each further attempt. Retries wait in "
+             "'<queue>.retry.<delay>' queues declared next to the work queue.",
+    )
+    dead_letter_exchange = fields.Char(
+        string="Dead-letter Exchange",
+        help="Exchange receiving messages that failed permanently or exhausted their attempts. "
+             "Leave empty to reject them, which applies the queue's own dead-letter policy.",
+    )
+    dead_letter_routing_key = fields.Char(
+        string="Dead-letter Routing Key",
+        help="Routing key for dead-lettered messages. Defaults to the queue name.",
+    )
+    reconnect_base_delay = fields.Float(
+        string="Reconnect Delay (s)",
+        default=1.0,
+        help="Smallest wait before reconnecting after a lost connection. Further waits grow "
+             "exponentially with random jitter, so queues do not reconnect in lockstep.",
+    )
+    reconnect_max_delay = fields.Float(
+        string="Max Reconnect Delay (s)",
+        default=60.0,
+        help="Longest wait between reconnects, also used while the consumer is degraded.",
+    )
+    failure_threshold = fields.Integer(
+        string="Failures Before Degraded",
+        default=5,
+        help="Failed or short-lived connections in a row after which the consumer reports "
+             "degraded and only probes the broker every max reconnect delay.",
+    )
+    health = fields.Selection(
+        selection=ConsumerHealth.get_selection(),
+        string="Health",
+        compute="_compute_health",
+        help="Degraded when a consumer slot cannot keep a broker connection up.",
+    )
+    running_consumers = fields.Integer(
+        string="Running Consumers",
+        compute="_compute_running_consumers",
+        help="Consumers of this controller running across all server processes, as of their "
+             "last lease heartbeat.",
+    )
+    lease_ids = fields.One2many(
+        "rabbitmq.consumer.lease",
+        "controller_id",
+        string="Slot Owners",
+        help="Server process running each consumer slot, across the whole cluster.",
+    )
+
+    messages_received = fields.Integer(string="Received", compute="_compute_metrics")
+    messages_acked = fields.Integer(string="Acknowledged", compute="_compute_metrics")
+    messages_failed = fields.Integer(
+        string="Failed", compute="_compute_metrics",
+        help="Deliveries sent for retry or dead-lettered.",
+    )
+    messages_in_flight = fields.Integer(
+        string="In Flight", compute="_compute_metrics",
+        help="Deliveries received and not yet settled.",
+    )
+    throughput = fields.Float(
+        string="Throughput (msg/s)", compute="_compute_metrics", digits=(16, 2),
+        help="Messages acknowledged per second over the last minute.",
+    )
+    decode_latency_p95 = fields.Float(
+        string="Decode p95 (ms)", compute="_compute_metrics",
+        help="95th percentile time spent decoding a message body.",
+    )
+    db_latency_p95 = fields.Float(
+        string="Database p95 (ms)", compute="_compute_metrics",
+        help="95th percentile time spent creating and syncing the logs of a message or batch.",
+    )
+    commit_latency_p95 = fields.Float(
+        string="Commit p95 (ms)", compute="_compute_metrics",
+        help="95th percentile time spent committing a message or batch.",
+    )
+
+    @api.depends("lease_ids.health")
+    def _compute_health(self):
+        """Report degraded when any slot of the controller is degraded."""
+        for controller in self:
+            degraded = "degraded" in controller.lease_ids.mapped("health")
+            controller.health = "degraded" if degraded else "healthy"
+
+    def _compute_running_consumers(self):
+        """Count the consumers of each controller in every process.
+
+        This process's consumers are counted live, those of other processes
+        (e.g. the dedicated runner) from their leases.
+        """
+        for controller in self:
+            controller.running_consumers = len(
+                self.CONSUMERS.get(controller._local_key(), [])
+            ) + len(controller._remote_leases().filtered("running"))
+
+    def _compute_metrics(self):
+        """Read the metrics of each controller, summed over every server process."""
+        for controller in self:
+            snapshot = controller._metrics_snapshot()
+            latency = snapshot["latency"]
+            controller.messages_received = snapshot["received"]
+            controller.messages_acked = snapshot["acked"]
+            controller.messages_failed = snapshot["retried"] + snapshot["rejected"]
+            controller.messages_in_flight = snapshot["in_flight"]
+            controller.throughput = snapshot["throughput_per_s"]
+            controller.decode_latency_p95 = latency["decode"]["p95_ms"]
+            controller.db_latency_p95 = latency["db"]["p95_ms"]
+            controller.commit_latency_p95 = latency["commit"]["p95_ms"]
+
+    def _metrics_snapshot(self):
+        """Return the metrics of this controller, with its consumers' in-flight count.
+
+        This process's metrics are read live and added to the snapshots the
+        other processes published on their leases at their last heartbeat.
+        """
+        self.ensure_one()
+        remote = self._remote_leases()
+        published = {lease.owner: lease.metrics for lease in remote if lease.metrics}
+        snapshot = merge_snapshots(
+            self.queue, [self._queue_metrics().snapshot(), *published.values()]
+        )
+        snapshot["controller_id"] = self.id
+        snapshot["state"] = self.state
+        snapshot["in_flight"] = sum(
+            consumer.in_flight for consumer in self.CONSUMERS.get(self._local_key(), [])
+        ) + sum(remote.mapped("in_flight"))
+        return snapshot
+
+    def _remote_leases(self):
+        """Return the leases of this controller held by other server processes."""
+        self.ensure_one()
+        owner = current_owner()
+        return self.lease_ids.filtered(lambda lease: lease.owner != owner)
+
+    def _local_key(self):
+        """Return the key of this controller's consumers and metrics in this process.
+
+        One process may serve several databases, whose controllers can use
+        the same queue name, so the key is the database and controller id.
+        """
+        self.ensure_one()
+        return (self.env.cr.dbname, self.id)
+
+    def _queue_metrics(self):
+        """Return the in-process metrics of this controller's consumers."""
+        return QueueMetrics.get(self._local_key(), self.queue)
+
+    @api.constrains("batch_size", "batch_linger_ms")
+    def _check_batch_settings(self):
+        """Ensure the batch size and linger time are usable."""
+        for controller in self:
+            if controller.batch_size < 1:
+                raise ValidationError(_("Batch size must be at least 1."))
+            if controller.batch_linger_ms < 0:
+                raise ValidationError(_("Batch linger time cannot be negative."))
+
+    @api.constrains(
+        "prefetch_count", "prefetch_size", "max_in_flight", "worker_count", "concurrency",
+        "log_sample_rate", "max_attempts", "retry_delay_ms", "reconnect_base_delay",
+        "reconnect_max_delay", "failure_threshold",
+    )
+    def _check_flow_control(self):
+        """Ensure the flow control, concurrency, sampling and retry settings are usable."""
+        for controller in self:
+            if min(controller.prefetch_count, controller.max_in_flight) < 0:
+                raise ValidationError(_("Prefetch count and in-flight window cannot be negative."))
+            if controller.prefetch_size:
+                # RabbitMQ closes the channel on a basic.qos with a non-zero prefetch size
+                raise ValidationError(_("RabbitMQ only supports a prefetch size of 0."))
+            if controller.worker_count < 0:
+                raise ValidationError(_("Worker threads cannot be negative."))
+            if controller.concurrency < 1:
+                raise ValidationError(_("Concurrency must be at least 1."))
+            if controller.log_sample_rate < 1:
+                raise ValidationError(_("The log sample rate must be at least 1."))
+            if controller.max_attempts < 1 or controller.retry_delay_ms < 0:
+                raise ValidationError(
+                    _("Max attempts must be at least 1 and the retry delay cannot be negative.")
+                )
+            if not 0 < controller.reconnect_base_delay <= controller.reconnect_max_delay:
+                raise ValidationError(
+                    _("The reconnect delay must be positive and at most the max reconnect delay.")
+                )
+            if controller.failure_threshold < 1:
+                raise ValidationError(_("Failures before degraded must be at least 1."))
 
     @api.model_create_multi
     def create(self, vals):
@@ -52,13 +430,57 @@ class RabbitMqConsumerController(models.Model):
                 )
         return super().create(vals)
 
-    def _process_rabbitmq_message(self, method, properties, body, model_name):
-        _logger.info("Processing RabbitMQ message in Odoo")
-        try:
-            msg = json.loads(body.decode() if isinstance(body, bytes) else str(body))
-        except UnicodeDecodeError as e:
-            _logger.error("Error decoding RabbitMQ message: %s", e)
-            msg = {}
+    def write(self, vals):
+        """Drop the compiled mapping plans when the settings they are built from change."""
+        result = super().write(vals)
+        if {"sync_model", "datetime_fields"} & vals.keys():
+            self._forget_mapping_plan()
+        return result
+
+    def _mapping_plan(self):
+        """Return the compiled payload mapping plan of this controller, or None.
+
+        Plans are cached per process and stamped with the registry sequence and
+        the controller's write date, which rule changes bump: a plan compiled
+        before another process changed the rules or reloaded the registry is
+        rebuilt on its next use.
+        """
+        self.ensure_one()
+        controller = self.sudo()
+        key = (self.env.cr.dbname, controller.id)
+        stamp = (self.env.registry.registry_sequence, controller.write_date)
+        cached = MAPPING_PLANS.get(key)
+        if cached is not None and cached[0] == stamp:
+            return cached[1]
+        plan = compile_mapping_plan(controller)
+        MAPPING_PLANS.set(key, (stamp, plan))
+        return plan
+
+    def _touch_mapping_plan(self):
+        """Mark the mapping plans of these controllers as changed in every process."""
+        if self:
+            # An empty write bumps write_date, the stamp other processes compare
+            self.sudo().write({})
+            self._forget_mapping_plan()
+
+    def _forget_mapping_plan(self):
+        """Drop the cached mapping plans of these controllers in this process.
+
+        Needed within the transaction making the change, whose write date
+        may not differ from the one the plan was stamped with.
+        """
+        db_name = self.env.cr.dbname
+        for controller_id in self.ids:
+            MAPPING_PLANS.pop((db_name, controller_id))
+
+    def _prepare_rabbitmq_log_vals(self, method, properties, body, model_name, options=None):
+        """Decode a delivery and build the values of its rabbitmq.log record.
+
+        Raises ValueError when the body cannot be decoded, so the delivery is
+        recorded as invalid with a preview of its raw body.
+        """
+        with self._queue_metrics().timed("decode"):
+            msg = decode_body(body, getattr(properties, "content_type", None))
 
         log_vals = {
             "queue_name": getattr(method, "routing_key", None),
@@ -67,70 +489,478 @@ class RabbitMqConsumerController(models.Model):
                 (properties.headers.get("operation")) if properties.headers else None
             ),
             "model_name": model_name,
+            "controller_id": self.id,
         }
+        if options and options.deduplicate:
+            headers = properties.headers or {}
+            message_id = (
+                headers.get(options.dedup_header) if options.dedup_header else properties.message_id
+            )
+            log_vals["message_id"] = str(message_id) if message_id else None
         log_vals.update(self.env[RMQ_LOG].prepare_log_vals(msg))
+        return validate_log_values(log_vals, strict=options is None or options.strict_validation)
+
+    def _invalid_log_vals(self, method, properties, body, model_name, error):
+        """Return the values of the failed log recording a delivery that cannot be prepared."""
+        _logger.error("Invalid RabbitMQ message: %s", error)
+        try:
+            data = decode_body(body, getattr(properties, "content_type", None))
+        except (ValueError, TypeError):
+            data = {"body": str(BodyPreview(body))}
+        return {
+            "queue_name": getattr(method, "routing_key", None),
+            "data": data,
+            "model_name": model_name,
+            "controller_id": self.id,
+            "state": "fail",
+            "error": f"Invalid message: {str(error)}",
+        }
+
+    @staticmethod
+    def _log_invalid(env, log_vals):
+        """Create the failed log of an invalid delivery and return the delivery's outcome.
+
+        The delivery is acked once its failure is recorded, and rejected when
+        even the failed log cannot be created.
+        """
+        try:
+            with env.cr.savepoint():
+                env[RMQ_LOG].create(log_vals)
+        except Exception as e:  # pylint: disable=broad-except
+            if _is_transient(e):
+                raise
+            _logger.error("Error recording invalid RabbitMQ message: %s", e)
+            return REJECT
+        return ACK
+
+    def _processing_options(self, model_name):
+        """Snapshot the settings the message path needs, read once when consumers start."""
+        return ProcessingOptions(
+            controller_id=self.id,
+            model_name=model_name,
+            log_policy=self.log_policy or "all",
+            log_sample_rate=self.log_sample_rate or 1,
+            deduplicate=self.deduplicate,
+            dedup_header=self.dedup_header or None,
+            strict_validation=self.strict_validation,
+        )
+
+    @staticmethod
+    def _is_replay(method, properties):
+        """Whether a delivery may have been processed before.
+
+        That is a redelivery by the broker, or a copy republished by the retry
+        path, which arrives with ``redelivered`` unset but an attempt count.
+        """
+        headers = getattr(properties, "headers", None) or {}
+        return bool(getattr(method, "redelivered", False) or headers.get(ATTEMPTS_HEADER))
+
+    @staticmethod
+    def _drop_duplicates(env, vals_list, redelivered, options):
+        """Drop replayed messages whose id was already processed successfully.
+
+        First deliveries are never checked. Replays are looked up in the
+        in-memory seen-set first and the remaining ones in one indexed query
+        on successful logs, so a message whose earlier attempt failed is
+        processed again.
+        """
+        if not options.deduplicate or not any(redelivered):
+            return vals_list
+        db_name = env.cr.dbname
+        suspects = [
+            (log_vals["queue_name"], log_vals["message_id"])
+            for log_vals, again in zip(vals_list, redelivered)
+            if again and log_vals.get("message_id")
+        ]
+        known = {key for key in suspects if (db_name,) + key in SEEN_MESSAGES}
+        unknown = [key for key in suspects if key not in known]
+        if unknown:
+            rows = env[RMQ_LOG].search_read(
+                [
+                    ("queue_name", "in", list({queue for queue, _mid in unknown})),
+                    ("message_id", "in", [mid for _queue, mid in unknown]),
+                    ("state", "=", "success"),
+                ],
+                ["queue_name", "message_id"],
+            )
+            known.update((row["queue_name"], row["message_id"]) for row in rows)
+        kept = []
+        for log_vals, again in zip(vals_list, redelivered):
+            if again and (log_vals["queue_name"], log_vals.get("message_id")) in known:
+                _logger.info(
+                    "Skipping already processed RabbitMQ message %s", log_vals["message_id"]
+                )
+                continue
+            kept.append(log_vals)
+        return kept
+
+    @staticmethod
+    def _successful_ids(logs):
+        """Return the (queue, message id) pairs of the successfully processed logs.
+
+        Read before the commit: it clears the cache, and the in-memory logs of
+        a lighter logging policy cannot be read back afterwards.
+        """
+        return [
+            (log.queue_name, log.message_id)
+            for log in logs
+            if log.message_id and log.state == "success"
+        ]
+
+    @staticmethod
+    def _mark_seen(db_name, seen):
+        """Remember the ids of committed, successful messages for the replay check."""
+        for queue_name, message_id in seen:
+            SEEN_MESSAGES.set((db_name, queue_name, message_id), True)
+
+    @staticmethod
+    def _ingest_log_vals(env, vals_list, options):
+        """Create and process the log records of a batch of messages.
+
+        Under a lighter logging policy the messages that are not sampled are
+        processed as in-memory log records, and only the failed ones are
+        persisted afterwards. Returns the processed log records.
+        """
+        log_model = env[RMQ_LOG]
+        if options.log_policy == "all":
+            logs = log_model.create(vals_list)
+            logs.process_odoo_operation()
+            return logs
+        persisted, transient = [], []
+        for log_vals in vals_list:
+            (persisted if options.should_log() else transient).append(log_vals)
+        logs = log_model.create(persisted)
+        transient_logs = log_model.concat(*(log_model.new(log_vals) for log_vals in transient))
+        (logs | transient_logs).process_odoo_operation()
+        failed = [
+            dict(log_vals, state=log.state, error=log.error, record_id=log.record_id)
+            for log_vals, log in zip(transient, transient_logs)
+            if log.state == "fail"
+        ]
+        if failed:
+            log_model.create(failed)
+        return logs | transient_logs
+
+    def _process_rabbitmq_message(self, method, properties, body, model_name, options=None):
+        """Process one delivery and return its outcome for the consumer to settle.
+
+        A delivery whose log values cannot be prepared is recorded as a failed
+        log, and a duplicate of a message another consumer already processed
+        is acked.
+        """
+        _logger.info("Processing RabbitMQ message in Odoo")
+        options = options or self._processing_options(model_name)
+        log_vals = invalid_vals = None
+        try:
+            log_vals = self._prepare_rabbitmq_log_vals(
+                method, properties, body, model_name, options
+            )
+        except DETERMINISTIC_ERRORS as e:
+            invalid_vals = self._invalid_log_vals(method, properties, body, model_name, e)
 
-        # Always create a new log record for every message
-        registry = modules.registry.Registry.new(self.env.cr.dbname)
-        with registry.cursor() as cr:
-            env = api.Environment(cr, SUPERUSER_ID, {})
+        # Create the log record for the message (or only its failure, per the
+        # logging policy) on the cursor leased to this consumer thread
+        metrics = self._queue_metrics()
+        outcome, vals_list, seen = ACK, [], []
+        try:
+            with RegistryHandle.get(self.env.cr.dbname).lease() as env:
+                with metrics.timed("db"):
+                    if invalid_vals:
+                        outcome = self._log_invalid(env, invalid_vals)
+                    else:
+                        vals_list = self._drop_duplicates(
+                            env, [log_vals], [self._is_replay(method, properties)], options
+                        )
+                    if vals_list:
+                        logs = self._ingest_log_vals(env, vals_list, options)
+                        seen = self._successful_ids(logs)
+                if vals_list or invalid_vals:
+                    with metrics.timed("commit"):
+                        env.cr.commit()
+                self._mark_seen(env.cr.dbname, seen)
+
+        except UniqueViolation:
+            _logger.info(
+                "Skipping duplicate RabbitMQ message %s", (log_vals or {}).get("message_id")
+            )
+            return ACK
+        except DatabaseError as e:
+            _logger.error("Error creating RabbitMQ log record: %s", e)
+            return _outcome_of(e)
+        return outcome
+
+    def _process_rabbitmq_batch(self, deliveries, model_name, options=None):
+        """Process a batch of deliveries in one transaction and return their outcomes.
+
+        Log rows are created with one multi-create and processed in bulk. If
+        that fails, each message is replayed in its own savepoint so a failing
+        message is rolled back and logged as failed while the rest commits.
+        A delivery whose log values cannot be prepared only fails its own log
+        (or is rejected if even that cannot be recorded), and duplicates of
+        already processed messages are acked. Transient errors abort the whole
+        batch so it is retried as a unit.
+        """
+        _logger.info("Processing RabbitMQ batch of %d messages in Odoo", len(deliveries))
+        options = options or self._processing_options(model_name)
+        outcomes = [ACK] * len(deliveries)
+        vals_list, replays, invalid = [], [], []
+        for index, (method, properties, body) in enumerate(deliveries):
             try:
-                log_record = env[RMQ_LOG].create(
-                    LogValues.model_validate(log_vals).__dict__
+                vals_list.append(self._prepare_rabbitmq_log_vals(
+                    method, properties, body, model_name, options
+                ))
+            except DETERMINISTIC_ERRORS as e:
+                invalid.append(
+                    (index, self._invalid_log_vals(method, properties, body, model_name, e))
                 )
+                continue
+            replays.append(self._is_replay(method, properties))
+        metrics = self._queue_metrics()
+        try:
+            with RegistryHandle.get(self.env.cr.dbname).lease() as env:
+                with metrics.timed("db"):
+                    for index, invalid_vals in invalid:
+                        outcomes[index] = self._log_invalid(env, invalid_vals)
+                    vals_list = self._drop_duplicates(env, vals_list, replays, options)
+                    try:
+                        with env.cr.savepoint():
+                            logs = self._ingest_log_vals(env, vals_list, options)
+                    except Exception as e:  # pylint: disable=broad-except
+                        if _is_transient(e):
+                            raise
+                        _logger.warning(
+                            "Bulk processing of RabbitMQ batch failed, retrying per message: %s", e
+                        )
+                        logs = env[RMQ_LOG].concat(*(
+                            self._process_in_savepoint(env, log_vals, options)
+                            for log_vals in vals_list
+                        ))
+                    seen = self._successful_ids(logs)
+                with metrics.timed("commit"):
+                    env.cr.commit()
+                self._mark_seen(env.cr.dbname, seen)
 
-                # Call the process_attendance_operation method if it exists
-                log_record.process_odoo_operation()
-                cr.commit()
+        except DatabaseError as e:
+            _logger.error(
+                "Error committing RabbitMQ batch of %d messages: %s", len(deliveries), e
+            )
+            outcome = _outcome_of(e)
+            return [outcome if previous == ACK else previous for previous in outcomes]
+        return outcomes
 
-            except DatabaseError as e:
-                cr.rollback()
-                _logger.error("Error creating RabbitMQ log record: %s", e)
-            finally:
-                cr.close()
+    @classmethod
+    def _process_in_savepoint(cls, env, log_vals, options):
+        """Create and process one log record in a savepoint, so failures stay isolated.
 
-    def action_start_consumer(self):
-        """Start the RabbitMQ consumer for this controller."""
-        queue_name = self.queue
-        model_name = self.sync_model.model
-
-        # If already running for this queue, don't start again
-        if queue_name in self.CONSUMERS:
-            _logger.info("RabbitMQ consumer for queue '%s' already running.", queue_name)
-            self.state = "running"
-            return False
-
-        _logger.info("Starting RabbitMQ consumer for queue '%s'...", queue_name)
-
-        consumer = ReconnectingAsyncAttendanceConsumer(
-            exchange_name=self.exchange,
-            exchange_type=self.exchange_type,
-            queue_name=queue_name,
-            message_callback=lambda method, properties, body: self._process_rabbitmq_message(
-                method, properties, body, model_name
+        Returns the processed log record, which is empty for a duplicate.
+        """
+        try:
+            with env.cr.savepoint():
+                return cls._ingest_log_vals(env, [log_vals], options)
+        except UniqueViolation:
+            _logger.info("Skipping duplicate RabbitMQ message %s", log_vals.get("message_id"))
+            return env[RMQ_LOG]
+        except Exception as e:  # pylint: disable=broad-except
+            if _is_transient(e):
+                raise
+            _logger.error("Error processing RabbitMQ message in batch: %s", e)
+            with env.cr.savepoint():
+                return env[RMQ_LOG].create(
+                    dict(log_vals, state="fail", error=f"Sync Error: {str(e)}")
+                )
+
+    def _build_consumer(self, model_name, connection_manager=None):
+        """Build one consumer configured from this controller.
+
+        With a connection manager the consumer is a channel on the shared
+        connection, which reconnects centrally; otherwise it is a reconnecting
+        consumer with its own connection.
+        """
+        processing = self._processing_options(model_name)
+        options = {
+            "exchange_name": self.exchange,
+            "exchange_type": self.exchange_type,
+            "queue_name": self.queue,
+            "message_callback": lambda method, properties, body: self._process_rabbitmq_message(
+                method, properties, body, model_name, processing
             ),
+            "batch_callback": (
+                (lambda deliveries: self._process_rabbitmq_batch(
+                    deliveries, model_name, processing))
+                if self.batch_size > 1 else None
+            ),
+            "batch_size": self.batch_size,
+            "batch_linger_ms": self.batch_linger_ms,
+            "prefetch_count": self.prefetch_count,
+            "prefetch_size": self.prefetch_size,
+            "max_in_flight": self.max_in_flight,
+            "worker_count": self.worker_count,
+            "worker_finalizer": RegistryHandle.get(self.env.cr.dbname).release,
+            "metrics": self._queue_metrics(),
+            "max_attempts": self.max_attempts,
+            "retry_delay_ms": self.retry_delay_ms,
+            "dead_letter_exchange": self.dead_letter_exchange or None,
+            "dead_letter_routing_key": self.dead_letter_routing_key or None,
+            "connection_parameters": self._connection_parameters(),
+        }
+        if connection_manager:
+            return AsyncAttendanceConsumer(connection_manager=connection_manager, **options)
+        return ReconnectingAsyncAttendanceConsumer(
+            reconnect_base_delay=self.reconnect_base_delay,
+            reconnect_max_delay=self.reconnect_max_delay,
+            failure_threshold=self.failure_threshold,
+            health_callback=partial(_report_health, self.env.cr.dbname, self.id),
+            **options,
         )
 
-        thread = threading.Thread(target=consumer.run, daemon=True)
-        thread.start()
+    def _connection_parameters(self):
+        """Return the cached connection parameters of the controller's broker hosts."""
+        self.ensure_one()
+        if self.broker_id:
+            return self.broker_id._connection_parameters()
+        return default_connection_parameters()
 
-        # Store consumer and thread
-        self.CONSUMERS[queue_name] = consumer
-        self.THREADS[queue_name] = thread
+    def action_start_consumer(self):
+        """Mark the controller running and start the consumer slots this process can claim.
 
+        Slots are leased cluster-wide, so across all server processes the
+        controller runs exactly ``concurrency`` consumers; the ownership
+        coordinator balances them and takes over slots of dead processes.
+        """
         self.state = "running"
+        self._sync_local_consumers()
         return True
 
     def action_stop_consumer(self):
-        """Stop the RabbitMQ consumer for this controller."""
-        queue_name = self.queue
-        consumer = self.CONSUMERS.get(queue_name)
-        if consumer:
-            _logger.info("Stopping RabbitMQ consumer for queue '%s'...", queue_name)
-            consumer.stop()
-            self.CONSUMERS.pop(queue_name, None)
-            self.THREADS.pop(queue_name, None)
-            self.state = "stop"
+        """Stop the controller; other processes stop their slots at their next heartbeat."""
+        self.state = "stop"
+        if self._sync_local_consumers():
             return True
-        _logger.warning("No consumer running for queue '%s'", queue_name)
+        _logger.warning("No consumer running for queue '%s' in this process", self.queue)
         return False
+
+    def _sync_local_consumers(self):
+        """Sync slot ownership now and make sure the coordinator keeps it up to date."""
+        if dedicated_runner():
+            # The consumer runner picks the new state up at its next poll
+            return True
+        owned = self.env["rabbitmq.consumer.lease"]._sync_ownership()
+        changed = self._apply_ownership(owned)
+        if not getattr(threading.current_thread(), "testing", False):
+            OwnershipCoordinator.ensure(self.env.cr.dbname)
+        return changed
+
+    @api.model
+    def cron_ensure_consumers(self):
+        """Start the ownership coordinator of this database in the cron's process.
+
+        Covers the databases post_load does not know about, and coordinators
+        that died with their process; it is a no-op when one already runs.
+        """
+        if dedicated_runner() or getattr(threading.current_thread(), "testing", False):
+            return
+        OwnershipCoordinator.ensure(self.env.cr.dbname)
+
+    @api.model
+    def _startup_jitter(self):
+        return float(
+            self.env["ir.config_parameter"].sudo().get_param(
+                "rabbitmq_model_sync.startup_jitter", STARTUP_JITTER
+            )
+        )
+
+    @api.model
+    def _apply_ownership(self, owned, jitter=False):
+        """Run exactly the ``{(controller_id, slot)}`` in ``owned`` in this process.
+
+        With ``jitter``, the consumers started are staggered over the startup
+        jitter. Returns the number of consumers started or stopped.
+        """
+        with self._OWNERSHIP_LOCK:
+            slots = defaultdict(set)
+            for controller_id, slot in owned:
+                slots[controller_id].add(slot)
+            controllers = self.browse(list(slots)).exists()
+            changed = 0
+            # CONSUMERS is shared by every database served by this process
+            db_name = self.env.cr.dbname
+
+            for key, consumers in list(self.CONSUMERS.items()):
+                if key[0] != db_name:
+                    continue
+                wanted = slots.get(key[1], set())
+                released = [consumer for consumer in consumers if consumer.slot not in wanted]
+                if released:
+                    _logger.info(
+                        "Stopping %d RabbitMQ consumer(s) of controller %s...",
+                        len(released), key[1],
+                    )
+                for consumer in released:
+                    consumer.stop()
+                    consumers.remove(consumer)
+                    changed += 1
+                self.THREADS[key] = [
+                    thread for thread in self.THREADS.get(key, []) if thread.is_alive()
+                ]
+                if not consumers:
+                    self.CONSUMERS.pop(key, None)
+                    self.THREADS.pop(key, None)
+
+            spread = self._startup_jitter() if jitter else 0
+            for controller in controllers:
+                running = {
+                    consumer.slot for consumer in self.CONSUMERS.get(controller._local_key(), [])
+                }
+                missing = sorted(slots[controller.id] - running)
+                if missing:
+                    controller._start_slots(missing, spread)
+                    changed += len(missing)
+            return changed
+
+    @classmethod
+    def _stop_local_consumers(cls, keys):
+        """Stop this process's consumers of the ``(db_name, controller_id)`` in ``keys``.
+
+        Nothing is read from the database.
+        """
+        with cls._OWNERSHIP_LOCK:
+            for key in keys:
+                for consumer in cls.CONSUMERS.pop(key, []):
+                    consumer.stop()
+                cls.THREADS.pop(key, None)
+
+    def _start_slots(self, slots, spread=0):
+        """Start one consumer per slot of this controller in this process.
+
+        Threaded consumers connect after a random delay of up to ``spread``
+        seconds; shared-connection consumers only open a channel and start at once.
+        """
+        self.ensure_one()
+        queue_name = self.queue
+        _logger.info(
+            "Starting %d RabbitMQ consumer(s) for queue '%s' (slots %s)...",
+            len(slots), queue_name, ", ".join(map(str, slots)),
+        )
+        # Compile the payload mapping up front rather than on the first message
+        self._mapping_plan()
+        consumers = self.CONSUMERS.setdefault(self._local_key(), [])
+        threads = self.THREADS.setdefault(self._local_key(), [])
+        manager = (
+            ConnectionManager.get(self._connection_parameters())
+            if self.shared_connection else None
+        )
+        for slot in slots:
+            consumer = self._build_consumer(self.sync_model.model, connection_manager=manager)
+            consumer.slot = slot
+            if manager:
+                # Registers a channel on the shared connection's I/O thread
+                consumer.start()
+            else:
+                thread = threading.Thread(
+                    target=_run_consumer,
+                    args=(consumer, self.env.cr.dbname, random.uniform(0, spread) if spread else 0),
+                    daemon=True,
+                )
+                thread.start()
+                threads.append(thread)
+            consumers.append(consumer)
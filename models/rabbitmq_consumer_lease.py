@@ -0,0 +1,226 @@
+#pylint:disable=import-error,protected-access,too-few-public-methods
+"""Cluster-wide ownership of consumer slots.
+
+Every running controller has ``concurrency`` consumer slots. A slot is run by
+the server process holding its lease row; leases and the process's node row
+are heartbeated by the ownership coordinator. A process claims at most its
+fair share of slots (slots / live nodes), sheds the excess when nodes join,
+and takes over slots whose owner stopped heartbeating for the lease timeout.
+
+At each heartbeat the owner also publishes the state of its consumers and its
+metrics on its leases, so any process (an HTTP worker, or a server whose
+consumers run in the dedicated runner) can report them.
+"""
+import logging
+import math
+import os
+import socket
+
+from odoo import api, fields, models
+
+from ..dataclasses.datamodels import ConsumerHealth
+
+_logger = logging.getLogger(__name__)
+
+# Seconds without heartbeat after which a node is dead and its slots are free;
+# override with the rabbitmq_model_sync.lease_timeout system parameter.
+LEASE_TIMEOUT = 30
+
+_NOW = "(now() AT TIME ZONE 'UTC')"
+
+
+def current_owner():
+    """Identify this server process; computed on call so forked workers differ."""
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+class RabbitMqConsumerNode(models.Model):
+    """Server process taking part in consumer ownership."""
+    _name = "rabbitmq.consumer.node"
+    _description = "RabbitMQ Consumer Node"
+    _order = "name"
+
+    name = fields.Char(string="Process", required=True, readonly=True)
+    heartbeat = fields.Datetime(string="Last Heartbeat", readonly=True)
+
+    _sql_constraints = [
+        ("name_uniq", "unique(name)", "A process can only be registered once."),
+    ]
+
+
+class RabbitMqConsumerLease(models.Model):
+    """Lease of one consumer slot of a controller by a server process."""
+    _name = "rabbitmq.consumer.lease"
+    _description = "RabbitMQ Consumer Slot Lease"
+    _order = "controller_id, slot"
+
+    controller_id = fields.Many2one(
+        "rabbitmq.consumer.controller", string="Consumer", required=True, ondelete="cascade",
+        readonly=True,
+    )
+    slot = fields.Integer(string="Slot", required=True, readonly=True)
+    owner = fields.Char(string="Owner", required=True, readonly=True)
+    heartbeat = fields.Datetime(string="Last Heartbeat", readonly=True)
+    health = fields.Selection(
+        selection=ConsumerHealth.get_selection(), string="Health", default="healthy", readonly=True,
+        help="Degraded while the slot's consumer cannot keep a broker connection up.",
+    )
+    running = fields.Boolean(
+        string="Running", readonly=True,
+        help="Whether the owner ran a consumer for the slot at its last heartbeat.",
+    )
+    in_flight = fields.Integer(
+        string="In Flight", readonly=True,
+        help="Deliveries of the slot's consumer not yet settled at the last heartbeat.",
+    )
+    metrics = fields.Json(
+        string="Metrics", readonly=True,
+        help="Snapshot of the owner's metrics of the controller at the last heartbeat.",
+    )
+
+    _sql_constraints = [
+        ("slot_uniq", "unique(controller_id, slot)", "A consumer slot can only have one owner."),
+    ]
+
+    @api.model
+    def _lease_timeout(self):
+        return int(
+            self.env["ir.config_parameter"].sudo().get_param(
+                "rabbitmq_model_sync.lease_timeout", LEASE_TIMEOUT
+            )
+        )
+
+    @api.model
+    def _sync_ownership(self, owner=None, controller_ids=None):
+        """Heartbeat, shed and claim slots for ``owner``.
+
+        All steps are single SQL statements on the current transaction; the
+        unique (controller_id, slot) constraint arbitrates concurrent claims.
+        With ``controller_ids``, the owner is a worker of the consumer runner
+        assigned those controllers: it claims every free slot of them instead
+        of a fair share, and releases the slots of any other controller.
+        Returns the ``{(controller_id, slot)}`` the owner holds.
+        """
+        owner = owner or current_owner()
+        cr = self.env.cr
+        cutoff = f"{_NOW} - %s * interval '1 second'"
+        timeout = self._lease_timeout()
+        self.env.flush_all()
+
+        cr.execute(
+            f"""
+            INSERT INTO rabbitmq_consumer_node (name, heartbeat, create_date, write_date)
+            VALUES (%s, {_NOW}, {_NOW}, {_NOW})
+            ON CONFLICT (name) DO UPDATE SET heartbeat = EXCLUDED.heartbeat
+            """,
+            (owner,),
+        )
+        # Forget dead nodes and free the slots they held
+        cr.execute(
+            f"DELETE FROM rabbitmq_consumer_node WHERE heartbeat < {cutoff}", (timeout * 10,)
+        )
+        cr.execute(
+            f"DELETE FROM rabbitmq_consumer_lease WHERE heartbeat < {cutoff} AND owner != %s",
+            (timeout, owner),
+        )
+
+        if controller_ids is None:
+            cr.execute(
+                "SELECT id, concurrency FROM rabbitmq_consumer_controller WHERE state = 'running'"
+            )
+        else:
+            cr.execute(
+                "SELECT id, concurrency FROM rabbitmq_consumer_controller "
+                "WHERE state = 'running' AND id = ANY(%s)",
+                (list(controller_ids),),
+            )
+        desired = {
+            (controller_id, slot)
+            for controller_id, concurrency in cr.fetchall()
+            for slot in range(max(concurrency or 1, 1))
+        }
+        cr.execute(
+            f"UPDATE rabbitmq_consumer_lease SET heartbeat = {_NOW} WHERE owner = %s "
+            "RETURNING controller_id, slot",
+            (owner,),
+        )
+        owned = {tuple(row) for row in cr.fetchall()}
+
+        if controller_ids is None:
+            cr.execute(
+                f"SELECT count(*) FROM rabbitmq_consumer_node WHERE heartbeat >= {cutoff}",
+                (timeout,),
+            )
+            share = math.ceil(len(desired) / max(cr.fetchone()[0], 1))
+        else:
+            share = len(desired)
+        # Keep low slots so every controller stays served while nodes rebalance
+        keep = sorted(owned & desired, key=lambda lease: (lease[1], lease[0]))[:share]
+        release = owned - set(keep)
+        if release:
+            cr.execute(
+                "DELETE FROM rabbitmq_consumer_lease "
+                "WHERE owner = %s AND (controller_id, slot) IN %s",
+                (owner, tuple(release)),
+            )
+        owned = set(keep)
+
+        if len(owned) < share:
+            cr.execute("SELECT controller_id, slot FROM rabbitmq_consumer_lease")
+            free = desired - {tuple(row) for row in cr.fetchall()}
+            for controller_id, slot in sorted(free, key=lambda lease: (lease[1], lease[0])):
+                if len(owned) >= share:
+                    break
+                cr.execute(
+                    f"""
+                    INSERT INTO rabbitmq_consumer_lease
+                           (controller_id, slot, owner, heartbeat, create_date, write_date)
+                    VALUES (%s, %s, %s, {_NOW}, {_NOW}, {_NOW})
+                    ON CONFLICT (controller_id, slot) DO NOTHING
+                    RETURNING controller_id, slot
+                    """,
+                    (controller_id, slot, owner),
+                )
+                owned.update(tuple(row) for row in cr.fetchall())
+
+        if release:
+            _logger.info("Released %d RabbitMQ consumer slot(s) for rebalancing", len(release))
+        self.invalidate_model()
+        self.env["rabbitmq.consumer.node"].invalidate_model()
+        return owned
+
+    @api.model
+    def _publish_local_state(self, owner=None):
+        """Write this process's consumers and metrics on the leases of ``owner``.
+
+        Every lease of a controller carries the same metrics snapshot of the
+        owner, so readers take one per owner.
+        """
+        owner = owner or current_owner()
+        controllers = self.env["rabbitmq.consumer.controller"]
+        for controller, leases in self.search([("owner", "=", owner)]).grouped(
+            "controller_id"
+        ).items():
+            consumers = {
+                consumer.slot: consumer
+                for consumer in controllers.CONSUMERS.get(controller._local_key(), [])
+            }
+            metrics = controller._queue_metrics().snapshot()
+            for lease in leases:
+                consumer = consumers.get(lease.slot)
+                lease.write({
+                    "running": consumer is not None,
+                    "in_flight": consumer.in_flight if consumer else 0,
+                    "metrics": metrics,
+                })
+
+    @api.model
+    def _release_ownership(self, owner=None):
+        """Give up every slot of ``owner`` so other nodes take them over at once."""
+        self.env.cr.execute(
+            "DELETE FROM rabbitmq_consumer_lease WHERE owner = %s", (owner or current_owner(),)
+        )
+        self.env.cr.execute(
+            "DELETE FROM rabbitmq_consumer_node WHERE name = %s", (owner or current_owner(),)
+        )
+        self.invalidate_model()
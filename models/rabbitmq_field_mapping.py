@@ -0,0 +1,363 @@
+#pylint:disable=import-error,protected-access,too-few-public-methods
+"""Field mapping rules of a consumer controller and the plan compiled from them.
+
+The plan is built once per controller from the sync model's ``fields_get``
+and the controller's rename/lookup/drop rules, then applied to every payload
+in a single pass: keys are renamed, dropped, resolved to a record id or
+coerced to the target field type. Keys that match no field of the sync model
+are dropped before they reach the ORM.
+
+References (``employee_code`` -> ``hr.employee`` via ``barcode``, or a
+many2one given by name) are resolved through a process-wide cache that is
+prefetched for a whole batch with one query per referenced model. The same
+query re-reads the cached ids, so a referenced record that was written or
+deleted since is looked up again.
+"""
+import logging
+from collections import defaultdict
+from functools import partial
+
+from odoo import _, api, fields, models
+from odoo.exceptions import ValidationError
+
+from ..dataclasses.datamodels import MappingMode
+from ..utils.lru_cache import LRUCache
+from .rabbitmq_log import convert_to_odoo_datetime, datetime_field_names
+
+_logger = logging.getLogger(__name__)
+
+# Payload keys that are not model fields but are read by the log itself
+PASSTHROUGH_KEYS = frozenset({"record_id"})
+TRUE_STRINGS = frozenset({"1", "true", "yes", "y", "on"})
+
+# Resolved references: (db, model, field, value) -> record id. Ids are only
+# cached once the transaction that found them commits, are re-validated by
+# every batch prefetch, and rule changes drop all.
+REFERENCE_CACHE = LRUCache(maxsize=100000, ttl=300)
+# Key of the references resolved by the current transaction in cr.postcommit.data
+PENDING_REFERENCES = "rabbitmq_model_sync.references"
+# Compiled plans: (db, controller id) -> (stamp, plan), see _mapping_plan
+MAPPING_PLANS = LRUCache(maxsize=1000)
+
+
+def _is_empty(value):
+    return value is None or value is False or value == ""
+
+
+def _cached_reference(env, key):
+    """Return the cached id of a reference, including those found by this transaction."""
+    record_id = REFERENCE_CACHE.get(key)
+    if record_id is None:
+        record_id = env.cr.postcommit.data.get(PENDING_REFERENCES, {}).get(key)
+    return record_id
+
+
+def _remember_reference(env, key, record_id):
+    """Cache a resolved reference once the current transaction commits.
+
+    The record may have been created by this very transaction and vanish on
+    rollback, so until the commit only this transaction sees the id.
+    """
+    postcommit = env.cr.postcommit
+    pending = postcommit.data.get(PENDING_REFERENCES)
+    if pending is None:
+        pending = postcommit.data[PENDING_REFERENCES] = {}
+        postcommit.add(partial(_publish_references, pending))
+    pending[key] = record_id
+
+
+def _forget_reference(env, key):
+    """Drop a reference whose record no longer matches, from the process and this transaction."""
+    REFERENCE_CACHE.pop(key)
+    env.cr.postcommit.data.get(PENDING_REFERENCES, {}).pop(key, None)
+
+
+def _publish_references(pending):
+    """Post-commit hook: share the references resolved by the committed transaction."""
+    for key, record_id in pending.items():
+        REFERENCE_CACHE.set(key, record_id)
+
+
+def prefetch_references(env, model_name, field_name, values):
+    """Resolve the ``values`` of ``model_name.field_name`` for a batch.
+
+    One search_read finds the uncached values and re-reads the cached ids: a
+    cached record whose field no longer holds the value, or that was deleted,
+    is forgotten and its value searched again.
+    """
+    db_name = env.cr.dbname
+    cached, missing = {}, []
+    for value in set(values):
+        if _is_empty(value):
+            continue
+        record_id = _cached_reference(env, (db_name, model_name, field_name, value))
+        if record_id is None:
+            missing.append(value)
+        else:
+            cached[record_id] = value
+    if not cached and not missing:
+        return
+    domain = [(field_name, "in", missing)]
+    if cached:
+        domain = ["|", ("id", "in", list(cached))] + domain
+    rows = env[model_name].search_read(domain, [field_name])
+    found = {row["id"]: row[field_name] for row in rows}
+    stale = [value for record_id, value in cached.items() if found.get(record_id) != value]
+    for value in stale:
+        _forget_reference(env, (db_name, model_name, field_name, value))
+    if stale:
+        rows += env[model_name].search_read([(field_name, "in", stale)], [field_name])
+    missing = set(missing).union(stale)
+    for row in rows:
+        if row[field_name] in missing:
+            _remember_reference(env, (db_name, model_name, field_name, row[field_name]), row["id"])
+
+
+def resolve_reference(env, model_name, field_name, value):
+    """Return the id of the ``model_name`` record whose ``field_name`` is ``value``."""
+    key = (env.cr.dbname, model_name, field_name, value)
+    record_id = _cached_reference(env, key)
+    if record_id is None:
+        record_id = env[model_name].search([(field_name, "=", value)], limit=1).id
+        if not record_id:
+            raise ValueError(f"No {model_name} record with {field_name} {value!r}.")
+        _remember_reference(env, key, record_id)
+    return record_id
+
+
+def _to_char(_env, value):
+    return value if isinstance(value, str) else str(value)
+
+
+def _to_integer(_env, value):
+    return int(value)
+
+
+def _to_float(_env, value):
+    return float(value)
+
+
+def _to_boolean(_env, value):
+    if isinstance(value, str):
+        return value.strip().lower() in TRUE_STRINGS
+    return bool(value)
+
+
+def _to_datetime(_env, value):
+    return convert_to_odoo_datetime(value)
+
+
+def _to_date(_env, value):
+    return convert_to_odoo_datetime(value).date()
+
+
+def _many2one_coercer(comodel_name, rec_name):
+    """Return a coercer resolving an id, ``[id, name]``, ``{"id": ..}`` or a name to an id."""
+    def coerce(env, value):
+        if isinstance(value, (list, tuple)):
+            value = value[0] if value else False
+        elif isinstance(value, dict):
+            value = value.get("id", False)
+        if isinstance(value, str) and value.isdigit():
+            value = int(value)
+        if isinstance(value, int) or not value:
+            return value
+        return resolve_reference(env, comodel_name, rec_name, value)
+    return coerce
+
+
+def _lookup_coercer(comodel_name, field_name, field_type):
+    """Return a coercer resolving a payload value to the record whose ``field_name`` equals it."""
+    normalize = COERCERS.get(field_type)
+
+    def coerce(env, value):
+        if normalize:
+            value = normalize(env, value)
+        return resolve_reference(env, comodel_name, field_name, value)
+    coerce.reference = (comodel_name, field_name, normalize)
+    return coerce
+
+
+COERCERS = {
+    "char": _to_char,
+    "text": _to_char,
+    "integer": _to_integer,
+    "float": _to_float,
+    "monetary": _to_float,
+    "boolean": _to_boolean,
+    "date": _to_date,
+    "datetime": _to_datetime,
+}
+
+
+class MappingPlan:
+    """Compiled payload mapping for one controller: renames, lookups, drops and coercers.
+
+    Only plain data is kept, so the plan can be cached across environments.
+    """
+
+    def __init__(self, model, renames=None, drops=(), datetime_fields=(), lookups=None):
+        self.renames = dict(renames or {})
+        self.drops = frozenset(drops)
+        # payload key -> (target field, coercer resolving the reference)
+        self.lookups = {}
+        # field name -> (comodel, rec_name) for many2one values given by name
+        self.references = {}
+        # field name -> coercer, or None when the value is passed as is
+        self.coercers = {}
+        for name, description in model.fields_get(attributes=["type", "relation"]).items():
+            if description["type"] == "many2one":
+                comodel = model.env[description["relation"]]
+                self.references[name] = (comodel._name, comodel._rec_name or "id")
+                coercer = _many2one_coercer(*self.references[name])
+            else:
+                coercer = COERCERS.get(description["type"])
+            if name in datetime_fields:
+                coercer = _to_datetime
+            self.coercers[name] = coercer
+        for key, (target, comodel_name, field_name) in (lookups or {}).items():
+            field_type = model.env[comodel_name]._fields[field_name].type
+            self.lookups[key] = (target, _lookup_coercer(comodel_name, field_name, field_type))
+
+    def prefetch(self, env, payloads):
+        """Resolve the references of a whole batch of payloads with one query per field."""
+        wanted = defaultdict(set)
+        for vals in payloads:
+            for key, value in vals.items():
+                if _is_empty(value) or key in self.drops:
+                    continue
+                if key in self.lookups:
+                    comodel_name, field_name, normalize = self.lookups[key][1].reference
+                    try:
+                        if normalize:
+                            value = normalize(env, value)
+                        wanted[(comodel_name, field_name)].add(value)
+                    except (TypeError, ValueError):
+                        continue
+                    continue
+                reference = self.references.get(self.renames.get(key, key))
+                if reference and isinstance(value, str) and not value.isdigit():
+                    wanted[reference].add(value)
+        for (comodel_name, field_name), values in wanted.items():
+            prefetch_references(env, comodel_name, field_name, values)
+
+    def apply(self, env, vals):
+        """Return ``vals`` renamed, resolved, filtered and coerced for the sync model."""
+        result = {}
+        for key, value in vals.items():
+            if key in self.drops:
+                continue
+            if key in self.lookups:
+                target, coercer = self.lookups[key]
+                result[target] = False if _is_empty(value) else coercer(env, value)
+                continue
+            name = self.renames.get(key, key)
+            if name in PASSTHROUGH_KEYS:
+                result[name] = value
+                continue
+            if name not in self.coercers:
+                _logger.debug("Dropping payload key %r: no such field on the sync model", key)
+                continue
+            coercer = self.coercers[name]
+            if coercer and not _is_empty(value):
+                value = coercer(env, value)
+            result[name] = value
+        return result
+
+
+class RabbitMqFieldMapping(models.Model):
+    """Rename or drop rule for a payload key of a consumer controller."""
+    _name = "rabbitmq.field.mapping"
+    _description = "RabbitMQ Payload Field Mapping"
+    _order = "sequence, id"
+
+    sequence = fields.Integer(default=10)
+    controller_id = fields.Many2one(
+        "rabbitmq.consumer.controller", string="Consumer", required=True, ondelete="cascade"
+    )
+    model_id = fields.Many2one(related="controller_id.sync_model")
+    source_key = fields.Char(string="Payload Key", required=True)
+    mode = fields.Selection(
+        selection=MappingMode.get_selection(), string="Action", default="rename", required=True
+    )
+    field_id = fields.Many2one(
+        "ir.model.fields",
+        string="Target Field",
+        domain="[('model_id', '=', model_id), ('store', '=', True)]",
+        ondelete="cascade",
+        help="Field of the sync model the payload key is written to.",
+    )
+    lookup_model = fields.Char(related="field_id.relation")
+    lookup_field_id = fields.Many2one(
+        "ir.model.fields",
+        string="Match On",
+        domain="[('model', '=', lookup_model), ('ttype', 'in', ('char', 'integer')), "
+               "('store', '=', True)]",
+        ondelete="cascade",
+        help="Field of the referenced model the payload value is matched on, e.g. the barcode "
+             "of an employee for an 'employee_code' key written to 'employee_id'.",
+    )
+
+    @api.constrains("mode", "field_id", "lookup_field_id")
+    def _check_target_field(self):
+        """Ensure rename rules have a target field and lookups a many2one and a match field."""
+        for mapping in self:
+            if mapping.mode != "drop" and not mapping.field_id:
+                raise ValidationError(
+                    _("The mapping of '%s' needs a target field.", mapping.source_key)
+                )
+            if mapping.mode == "lookup" and (
+                mapping.field_id.ttype != "many2one" or not mapping.lookup_field_id
+            ):
+                raise ValidationError(
+                    _("The lookup of '%s' needs a many2one target field and a field to match on.",
+                      mapping.source_key)
+                )
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        """Recompile the plans of the controllers that got rules."""
+        mappings = super().create(vals_list)
+        self._rules_changed(mappings.controller_id)
+        return mappings
+
+    def write(self, vals):
+        """Recompile the plans of the controllers whose rules changed."""
+        controllers = self.controller_id
+        result = super().write(vals)
+        self._rules_changed(controllers | self.controller_id)
+        return result
+
+    def unlink(self):
+        """Recompile the plans of the controllers that lost rules."""
+        controllers = self.controller_id
+        result = super().unlink()
+        self._rules_changed(controllers.exists())
+        return result
+
+    @api.model
+    def _rules_changed(self, controllers):
+        """Recompile the plans of ``controllers`` and drop the references resolved so far."""
+        controllers._touch_mapping_plan()
+        REFERENCE_CACHE.clear()
+
+
+def compile_mapping_plan(controller):
+    """Build the mapping plan of ``controller`` from its sync model and rules."""
+    model_name = controller.sync_model.model
+    if model_name not in controller.env:
+        return None
+    renames, drops, lookups = {}, [], {}
+    for mapping in controller.field_mapping_ids:
+        if mapping.mode == "drop":
+            drops.append(mapping.source_key)
+        elif mapping.mode == "lookup":
+            lookups[mapping.source_key] = (
+                mapping.field_id.name, mapping.field_id.relation, mapping.lookup_field_id.name
+            )
+        else:
+            renames[mapping.source_key] = mapping.field_id.name
+    return MappingPlan(
+        controller.env[model_name], renames, drops,
+        datetime_field_names(controller.datetime_fields), lookups,
+    )
@@ -1,55 +1,150 @@
-#pylint:disable=import-error
+#pylint:disable=import-error,protected-access
 """RabbitMQ Log Model for Odoo
 This model handles RabbitMQ log messages, processes them, and manages the state of operations.
 It includes methods for converting datetime formats, preparing log values, and executing operations.
 """
-from datetime import datetime, timezone
+import json
+import logging
+import threading
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
 
-import pytz
 from dateutil import parser
-from odoo import fields, models
+from odoo import _, api, fields, models, tools
 
 from ..dataclasses.datamodels import OperationType, RecordStatus
+from ..utils.lru_cache import LRUCache
 
+_logger = logging.getLogger(__name__)
+
+# Payload fields converted to datetimes when the controller does not list its own
 date_list = ["check_in", "check_out"]
+EPOCH = datetime(1970, 1, 1)
+
+# Days a log is kept per state by the cleanup cron; 0 keeps them forever.
+# Override with the rabbitmq_model_sync.retention_<state>_days system parameters.
+RETENTION_DAYS = {"success": 2, "fail": 30}
+RETENTION_CHUNK_SIZE = 5000
+# With rabbitmq_model_sync.log_storage set to "archive", successful logs are
+# moved to the partitioned archive after this many days (system parameter
+# rabbitmq_model_sync.archive_after_days) and their retention drops whole
+# archive months instead of deleting rows.
+ARCHIVE_AFTER_DAYS = 0
+
+# Failed logs replayed per committed chunk by the retry engine; override with
+# the rabbitmq_model_sync.retry_chunk_size system parameter.
+RETRY_CHUNK_SIZE = 1000
+
+# Resolved upsert keys: (db, model, key field, key) -> record id
+EXTERNAL_KEY_CACHE = LRUCache(maxsize=50000)
+
+
+def execute_in_chunks(cr, query, params, chunk_size):
+    """Run a statement limited to ``chunk_size`` rows until a chunk comes up short.
+
+    Each chunk is committed on its own, except in tests. Returns the number of
+    rows affected over all chunks.
+    """
+    auto_commit = not getattr(threading.current_thread(), "testing", False)
+    total = 0
+    while True:
+        cr.execute(query, params)
+        affected = cr.rowcount
+        total += affected
+        if auto_commit:
+            cr.commit()
+        if affected < chunk_size:
+            return total
+
+
+def firebase_iso_to_datetime(iso_str):
+    """Parse a Firebase/ISO 8601 string into a naive UTC datetime."""
+    dt = datetime.fromisoformat(iso_str.replace("Z", "+00:00"))
+    if dt.tzinfo is not None:
+        dt = dt.astimezone(timezone.utc).replace(tzinfo=None)
+    return dt
+
+
+def firebase_timestamp_to_datetime(seconds, nanoseconds=0):
+    """Convert a Firebase timestamp into a naive UTC datetime."""
+    dt = EPOCH + timedelta(seconds=seconds, microseconds=nanoseconds // 1000)
+    return dt
 
 
 def firebase_iso_to_odoo_datetime(iso_str):
     """Convert Firebase ISO datetime string to Odoo datetime string."""
-    dt = datetime.fromisoformat(iso_str.replace("Z", "+00:00"))
-    # Convert to Odoo string format
-    return fields.Datetime.to_string(dt)
+    return fields.Datetime.to_string(firebase_iso_to_datetime(iso_str))
 
 
 def firebase_timestamp_to_odoo_datetime(seconds, nanoseconds=0):
     """Convert Firebase timestamp to Odoo datetime string."""
-    dt = datetime.fromtimestamp(seconds + nanoseconds / 1e9, tz=timezone.utc)
-    # Convert to Odoo-compatible UTC string
-    return fields.Datetime.to_string(dt)
+    return fields.Datetime.to_string(firebase_timestamp_to_datetime(seconds, nanoseconds))
+
+
+def epoch_to_datetime(value):
+    """Convert an epoch in seconds, milliseconds, microseconds or nanoseconds to naive UTC.
+
+    The unit is inferred from the magnitude, which is unambiguous for any
+    date between 1973 and 5138.
+    """
+    value = int(value) if isinstance(value, str) else value
+    magnitude = abs(value)
+    if magnitude < 1e11:
+        return firebase_timestamp_to_datetime(value)
+    if magnitude < 1e14:
+        nanoseconds = int(value * 1_000_000)
+    elif magnitude < 1e17:
+        nanoseconds = int(value * 1_000)
+    else:
+        nanoseconds = int(value)
+    seconds, nanoseconds = divmod(nanoseconds, 1_000_000_000)
+    return firebase_timestamp_to_datetime(seconds, nanoseconds)
+
+
+@lru_cache(maxsize=4096)
+def _parse_datetime_string(value):
+    """Parse a datetime string to naive UTC; cached since payloads repeat timestamps."""
+    try:
+        return firebase_iso_to_datetime(value)
+    except ValueError:
+        pass
+    if value.lstrip("-").replace(".", "", 1).isdigit():
+        return epoch_to_datetime(float(value) if "." in value else int(value))
+    _logger.debug("Falling back to dateutil for datetime %r", value)
+    dt = parser.parse(value)
+    if dt.tzinfo is not None:
+        dt = dt.astimezone(timezone.utc).replace(tzinfo=None)
+    return dt
 
 
 def convert_to_odoo_datetime(input_datetime):
     """
-    Convert various datetime formats (ISO 8601, string, datetime) into UTC datetime without tzinfo,
-    which is the format Odoo expects.
+    Convert various datetime formats (ISO 8601, string, datetime, epoch number or
+    Firebase timestamp dict) into UTC datetime without tzinfo, which is the format Odoo expects.
     """
-    if isinstance(input_datetime,str):
-        try:
-            dt = parser.isoparse(input_datetime)
-        except Exception as e:# pylint: disable=broad-except
-            print(e)
-            dt = parser.parse(input_datetime)
-    elif isinstance(input_datetime, datetime):
-        dt = input_datetime
-    else:
-        raise ValueError("Unsupported datetime format")
+    if isinstance(input_datetime, str):
+        return _parse_datetime_string(input_datetime.strip())
+    if isinstance(input_datetime, datetime):
+        if input_datetime.tzinfo is None:
+            return input_datetime
+        return input_datetime.astimezone(timezone.utc).replace(tzinfo=None)
+    if isinstance(input_datetime, (int, float)) and not isinstance(input_datetime, bool):
+        return epoch_to_datetime(input_datetime)
+    if isinstance(input_datetime, dict):
+        # Serialized Firebase Timestamp: {"seconds", "nanoseconds"} or "_"-prefixed
+        seconds = input_datetime.get("seconds", input_datetime.get("_seconds"))
+        if seconds is not None:
+            return firebase_timestamp_to_datetime(
+                seconds, input_datetime.get("nanoseconds", input_datetime.get("_nanoseconds", 0))
+            )
+    raise ValueError("Unsupported datetime format")
 
-    if dt.tzinfo is None:
-        dt = dt.replace(tzinfo=pytz.UTC)
-    else:
-        dt = dt.astimezone(pytz.UTC)
 
-    return dt.replace(tzinfo=None)
+@lru_cache(maxsize=256)
+def datetime_field_names(spec):
+    """Split a comma-separated list of datetime field names."""
+    return frozenset(name.strip() for name in (spec or "").split(",") if name.strip())
 
 
 class RabibitLog(models.Model):
@@ -76,6 +171,33 @@ class RabibitLog(models.Model):
         help="Reference to the record in the model",
     )
     error=fields.Char(string="Error")
+    controller_id = fields.Many2one(
+        "rabbitmq.consumer.controller",
+        string="Consumer",
+        ondelete="set null",
+        help="Consumer controller that received this message",
+    )
+    message_id = fields.Char(
+        string="Message ID",
+        readonly=True,
+        help="Broker message id (or configured header) used to detect redeliveries",
+    )
+
+    def init(self):
+        """Index the columns the retention cron and the redelivery check filter on."""
+        tools.create_index(
+            self._cr, "rabbitmq_log_state_create_date_index", self._table, ["state", "create_date"]
+        )
+        # Only one successful log per message: a failed attempt must not block
+        # the replay of the same message id.
+        self._cr.execute("DROP INDEX IF EXISTS rabbitmq_log_queue_message_id_uniq")
+        self._cr.execute(
+            f"""
+            CREATE UNIQUE INDEX IF NOT EXISTS rabbitmq_log_queue_message_id_success_uniq
+                ON {self._table} (queue_name, message_id)
+             WHERE message_id IS NOT NULL AND state = 'success'
+            """
+        )
 
     def prepare_log_vals(self, msg):
         """Prepare log values from message dict."""
@@ -84,25 +206,159 @@ class RabibitLog(models.Model):
             vals["record_id"] = msg["record_id"]
         return vals
 
+    @api.model
+    def cron_clean_successful_logs(self):
+        """Delete or archive logs older than the retention of their state, in committed chunks."""
+        params = self.env["ir.config_parameter"].sudo()
+        chunk_size = int(
+            params.get_param("rabbitmq_model_sync.retention_chunk_size", RETENTION_CHUNK_SIZE)
+        )
+        archive = params.get_param("rabbitmq_model_sync.log_storage", "delete") == "archive"
+        if archive:
+            days = int(
+                params.get_param("rabbitmq_model_sync.archive_after_days", ARCHIVE_AFTER_DAYS)
+            )
+            cutoff = fields.Datetime.now() - timedelta(days=days)
+            moved = self.env["rabbitmq.log.archive"]._archive_logs_before(cutoff, chunk_size)
+            _logger.info("Archived %d successful RabbitMQ logs older than %s", moved, cutoff)
+        for state, default_days in RETENTION_DAYS.items():
+            days = int(
+                params.get_param(f"rabbitmq_model_sync.retention_{state}_days", default_days)
+            )
+            if days <= 0:
+                continue
+            cutoff = fields.Datetime.now() - timedelta(days=days)
+            if archive and state == "success":
+                self.env["rabbitmq.log.archive"]._drop_partitions_before(cutoff)
+                continue
+            deleted = self._delete_logs_before(state, cutoff, chunk_size)
+            _logger.info("Deleted %d '%s' RabbitMQ logs older than %s", deleted, state, cutoff)
+
+    def _delete_logs_before(self, state, cutoff, chunk_size):
+        """Delete logs of ``state`` created before ``cutoff`` in chunks of ``chunk_size`` rows.
+
+        Each chunk is a short SQL delete on the (state, create_date) index and
+        is committed on its own, so the table is never locked for long.
+        """
+        total = execute_in_chunks(
+            self.env.cr,
+            f"""
+            DELETE FROM {self._table}
+             WHERE id IN (
+                SELECT id FROM {self._table}
+                 WHERE state = %s AND create_date < %s
+                 ORDER BY create_date
+                 LIMIT %s
+             )
+            """,
+            (state, cutoff, chunk_size),
+            chunk_size,
+        )
+        self.invalidate_model()
+        return total
+
     def action_retry_sync(self):
-        """Retry the sync operation for this log entry."""
-        self.state = "success"
+        """Re-run the operation of the selected logs that did not succeed and report the result."""
+        succeeded, failed = self._retry_in_chunks(
+            self.filtered(lambda log: log.state != "success").ids, self._retry_chunk_size()
+        )
+        return {
+            "type": "ir.actions.client",
+            "tag": "display_notification",
+            "params": {
+                "title": _("Retry finished"),
+                "message": _("%(succeeded)s log(s) synced, %(failed)s still failing.",
+                             succeeded=succeeded, failed=failed),
+                "type": "warning" if failed else "success",
+                "next": {"type": "ir.actions.act_window_close"},
+            },
+        }
+
+    @api.model
+    def cron_retry_failed_logs(self, domain=None, limit=None):
+        """Replay failed logs (optionally narrowed by ``domain``) in committed chunks."""
+        ids = self._search(
+            [("state", "=", "fail")] + list(domain or []), order="id", limit=limit
+        )
+        succeeded, failed = self._retry_in_chunks(list(ids), self._retry_chunk_size())
+        _logger.info("Retried RabbitMQ logs: %d synced, %d still failing", succeeded, failed)
+        return succeeded, failed
+
+    def _retry_chunk_size(self):
+        return int(
+            self.env["ir.config_parameter"].sudo().get_param(
+                "rabbitmq_model_sync.retry_chunk_size", RETRY_CHUNK_SIZE
+            )
+        )
+
+    def _retry_in_chunks(self, ids, chunk_size):
+        """Re-run ``process_odoo_operation`` over the logs ``ids`` in chunks of ``chunk_size``.
+
+        Logs are replayed in id order, so in message order, through the same
+        grouped bulk path as live traffic. Each chunk is committed and the
+        cache is emptied afterwards so memory stays flat on large backlogs;
+        progress is logged and reported to the running cron, if any.
+        Returns ``(succeeded, failed)``.
+        """
+        auto_commit = not getattr(threading.current_thread(), "testing", False)
+        succeeded = failed = 0
+        for start in range(0, len(ids), chunk_size):
+            logs = self.browse(ids[start:start + chunk_size]).exists()
+            logs.process_odoo_operation()
+            chunk_succeeded = len(logs.filtered(lambda log: log.state == "success"))
+            succeeded += chunk_succeeded
+            failed += len(logs) - chunk_succeeded
+            if auto_commit:
+                self.env.cr.commit()
+            else:
+                self.env.flush_all()
+            self.env.invalidate_all()
+            done = min(start + chunk_size, len(ids))
+            _logger.info("Retried %d/%d RabbitMQ logs", done, len(ids))
+            self.env["ir.cron"]._notify_progress(done=done, remaining=len(ids) - done)
+        return succeeded, failed
 
     def _prepare_vals(self, vals):
-        """Convert datetime for check_in/check_out if present."""
+        """Map a payload through the controller's compiled plan.
+
+        Without a plan (no controller, or a sync model that is not loaded),
+        only the datetime fields (check_in/check_out by default) are converted.
+        """
+        plan = self.controller_id._mapping_plan() if self.controller_id else None
+        if plan is not None:
+            return plan.apply(self.env, vals)
+        spec = self.controller_id.datetime_fields
+        datetime_fields = datetime_field_names(spec) if spec else date_list
         return {
-            k: convert_to_odoo_datetime(v) if k in date_list else v
+            k: convert_to_odoo_datetime(v) if k in datetime_fields and v else v
             for k, v in vals.items()
         }
 
     def _execute_operation(self, operation, vals):
-        """Handle create/write operation generically, catch errors."""
+        """Handle create/write/upsert operation generically, catch errors."""
         vals = self._prepare_vals(vals)
         record_id = vals.pop("record_id", None)
 
         try:
+            if operation == "upsert":
+                key_field = self.controller_id.external_key_field_id.name
+                if not key_field or vals.get(key_field) in (None, False, ""):
+                    self.state = "fail"
+                    self.error = "Missing external key for upsert."
+                    return False
+                model = self.env[self.model_name]
+                key = self._normalize_external_key(model, key_field, vals[key_field])
+                record_id = self._resolve_external_keys(model, key_field, [key]).get(key)
+                if record_id and not model.browse(record_id).exists():
+                    EXTERNAL_KEY_CACHE.pop((self.env.cr.dbname, model._name, key_field, key))
+                    record_id = self._resolve_external_keys(model, key_field, [key]).get(key)
+                operation = "write" if record_id else "create"
+
+            # The savepoint keeps the transaction usable when the target
+            # model raises, so the failure is still recorded on this log.
             if operation == "create":
-                rec = self.env[self.model_name].create(vals)
+                with self.env.cr.savepoint():
+                    rec = self.env[self.model_name].create(vals)
                 self.record_id = rec.id
                 self.state = "success"
                 self.error = False  # Clear previous error
@@ -111,7 +367,8 @@ class RabibitLog(models.Model):
             if record_id:
                 record = self.env[self.model_name].browse(record_id)
                 if record.exists():
-                    record.write(vals)
+                    with self.env.cr.savepoint():
+                        record.write(vals)
                     self.record_id = record.id
                     self.state = "success"
                     self.error = False
@@ -127,8 +384,220 @@ class RabibitLog(models.Model):
             return False
 
     def process_odoo_operation(self):
-        """Process attendance operation based on log record's operation type."""
-        if self.operation in ["create", "write"]:
-            return self._execute_operation(self.operation, self.data)
-        self.state = "fail"
-        return False
+        """Process the operations of these logs in bulk.
+
+        Logs are grouped by target model and operation: each group of creates
+        is issued as one multi-create and each group of writes with identical
+        values as one write. A group that fails falls back to processing its
+        logs one by one, so a single bad payload only fails its own log.
+        Returns True when every log succeeded.
+        """
+        groups = defaultdict(self.browse)
+        for log in self:
+            if log.operation in OperationType.values_key():
+                # Upserts also split by controller, which defines the key field
+                controller = log.controller_id.id if log.operation == "upsert" else False
+                groups[(log.model_name, log.operation, controller)] |= log
+            else:
+                log.state = "fail"
+        for (_model_name, operation, _controller), logs in groups.items():
+            if operation == "create":
+                logs._bulk_create()
+            elif operation == "upsert":
+                logs._bulk_upsert()
+            else:
+                logs._bulk_write()
+        return all(log.state == "success" for log in self)
+
+    def _prepare_bulk_vals(self):
+        """Return ``[(log, vals, record_id)]`` for logs whose payload can be prepared."""
+        for controller in self.controller_id:
+            plan = controller._mapping_plan()
+            if plan is not None:
+                plan.prefetch(
+                    self.env, [log.data or {} for log in self if log.controller_id == controller]
+                )
+        prepared = []
+        for log in self:
+            try:
+                vals = log._prepare_vals(log.data or {})
+            except Exception as e:  # pylint: disable=broad-except
+                log.state = "fail"
+                log.error = f"Sync Error: {str(e)}"
+                continue
+            prepared.append((log, vals, vals.pop("record_id", None)))
+        return prepared
+
+    def _mark_success(self, records):
+        """Link each log to its target record and mark the logs successful."""
+        self.state = "success"
+        self.error = False
+        for log, record in zip(self, records):
+            log.record_id = record.id
+
+    def _bulk_create(self):
+        """Create the target records of these logs with one multi-create."""
+        prepared = self._prepare_bulk_vals()
+        if not prepared:
+            return
+        logs = self.browse([log.id for log, _vals, _rid in prepared])
+        try:
+            with self.env.cr.savepoint():
+                records = self.env[logs[0].model_name].create(
+                    [vals for _log, vals, _rid in prepared]
+                )
+        except Exception:  # pylint: disable=broad-except
+            for log in logs:
+                log._execute_operation("create", log.data)
+            return
+        logs._mark_success(records)
+
+    def _bulk_write(self):
+        """Write the target records of these logs, one write per group of identical values."""
+        prepared = self._prepare_bulk_vals()
+        if prepared:
+            self._write_prepared(self.env[prepared[0][0].model_name], prepared)
+
+    def _write_prepared(self, model, prepared):
+        """Write ``[(log, vals, record_id)]``, one write per group of identical values.
+
+        A log only joins an earlier group when no later group writes the same
+        record, so the final values still follow message order.
+        """
+        existing = set(
+            model.browse({rid for _log, _vals, rid in prepared if rid}).exists().ids
+        )
+        groups, index, last_touch = [], {}, {}
+        for log, vals, record_id in prepared:
+            if record_id not in existing:
+                log.state = "fail"
+                log.error = "Record not found for update."
+                continue
+            key = json.dumps(vals, sort_keys=True, default=str)
+            pos = index.get(key)
+            if pos is None or last_touch.get(record_id, -1) > pos:
+                pos = index[key] = len(groups)
+                groups.append((vals, [], []))
+            groups[pos][1].append(log)
+            groups[pos][2].append(record_id)
+            last_touch[record_id] = pos
+
+        for vals, group_logs, record_ids in groups:
+            logs = self.browse([log.id for log in group_logs])
+            try:
+                with self.env.cr.savepoint():
+                    model.browse(record_ids).write(vals)
+            except Exception:  # pylint: disable=broad-except
+                for log in logs:
+                    log._execute_operation("write", log.data)
+                continue
+            logs._mark_success(model.browse(record_ids))
+
+    @staticmethod
+    def _normalize_external_key(model, key_field, key):
+        """Coerce a payload key to the type of the key field (e.g. 42 -> "42" for a char).
+
+        Raises ValueError for a key an integer field cannot hold, such as "EMP-1".
+        """
+        field_type = model._fields[key_field].type
+        if field_type in ("char", "text"):
+            return str(key)
+        if field_type == "integer":
+            if isinstance(key, bool) or (isinstance(key, float) and not key.is_integer()):
+                raise ValueError(f"Invalid external key {key!r} for integer field '{key_field}'.")
+            try:
+                return int(key)
+            except (TypeError, ValueError) as e:
+                raise ValueError(
+                    f"Invalid external key {key!r} for integer field '{key_field}'."
+                ) from e
+        return key
+
+    def _resolve_external_keys(self, model, key_field, keys):
+        """Map external keys to record ids, with one search_read for the keys not cached."""
+        db_name = self.env.cr.dbname
+        resolved, missing = {}, []
+        for key in set(keys):
+            record_id = EXTERNAL_KEY_CACHE.get((db_name, model._name, key_field, key))
+            if record_id:
+                resolved[key] = record_id
+            else:
+                missing.append(key)
+        if missing:
+            rows = model.with_context(active_test=False).search_read(
+                [(key_field, "in", missing)], ["id", key_field]
+            )
+            for row in rows:
+                resolved[row[key_field]] = row["id"]
+                EXTERNAL_KEY_CACHE.set((db_name, model._name, key_field, row[key_field]), row["id"])
+        return resolved
+
+    def _bulk_upsert(self):
+        """Create or update the target records of these logs, matched on the external key.
+
+        Keys are resolved in one batch through the cache and a single
+        search_read. Records for unknown keys are created with one
+        multi-create (several messages for the same new key are merged in
+        message order); the others go through the grouped write path.
+        """
+        key_field = self[:1].controller_id.external_key_field_id.name
+        if not key_field:
+            self.state = "fail"
+            self.error = "No external key field configured for upsert."
+            return
+        prepared = self._prepare_bulk_vals()
+        if not prepared:
+            return
+        model = self.env[prepared[0][0].model_name]
+        keyed = []
+        for log, vals, _record_id in prepared:
+            if vals.get(key_field) in (None, False, ""):
+                log.state = "fail"
+                log.error = f"Missing external key '{key_field}' for upsert."
+                continue
+            try:
+                key = self._normalize_external_key(model, key_field, vals[key_field])
+            except ValueError as e:
+                log.state = "fail"
+                log.error = str(e)
+                continue
+            vals[key_field] = key
+            keyed.append((log, vals, key))
+
+        resolved = self._resolve_external_keys(
+            model, key_field, [key for _log, _vals, key in keyed]
+        )
+        alive = set(model.browse(set(resolved.values())).exists().ids)
+        for key, record_id in list(resolved.items()):
+            if record_id not in alive:
+                # Deleted since it was cached: treat the key as new
+                EXTERNAL_KEY_CACHE.pop((self.env.cr.dbname, model._name, key_field, key))
+                del resolved[key]
+
+        to_write, new_keys = [], {}
+        for log, vals, key in keyed:
+            if key in resolved:
+                to_write.append((log, vals, resolved[key]))
+            else:
+                new_keys.setdefault(key, ([], {}))
+                new_keys[key][0].append(log)
+                new_keys[key][1].update(vals)
+        if new_keys:
+            self._create_upserted(model, key_field, new_keys)
+        if to_write:
+            self._write_prepared(model, to_write)
+
+    def _create_upserted(self, model, key_field, new_keys):
+        """Create one record per new external key and link every log of that key to it."""
+        try:
+            with self.env.cr.savepoint():
+                records = model.create([vals for _logs, vals in new_keys.values()])
+        except Exception:  # pylint: disable=broad-except
+            for logs, _vals in new_keys.values():
+                for log in logs:
+                    log._execute_operation("upsert", log.data)
+            return
+        for (key, (logs, _vals)), record in zip(new_keys.items(), records):
+            EXTERNAL_KEY_CACHE.set((self.env.cr.dbname, model._name, key_field, key), record.id)
+            logs = self.browse([log.id for log in logs])
+            logs._mark_success(record.browse([record.id] * len(logs)))
@@ -0,0 +1,159 @@
+#pylint:disable=import-error,protected-access,too-few-public-methods
+"""Archive storage for successful RabbitMQ logs.
+
+Successful logs are moved in bulk from ``rabbitmq_log`` into a table natively
+partitioned by month of ``create_date``, so the hot table only keeps new and
+failed rows and expired archive months are dropped instead of deleted row by row.
+"""
+import logging
+from datetime import date
+
+from odoo import api, fields, models
+
+from ..dataclasses.datamodels import OperationType, RecordStatus
+from .rabbitmq_log import execute_in_chunks
+
+_logger = logging.getLogger(__name__)
+
+PARTITION_PREFIX = "rabbitmq_log_archive_p"
+
+
+def _month_start(value):
+    """Return the first day of the month of a date or datetime."""
+    return date(value.year, value.month, 1)
+
+
+def _next_month(value):
+    """Return the first day of the month following ``value``."""
+    return date(value.year + value.month // 12, value.month % 12 + 1, 1)
+
+
+class RabbitLogArchive(models.Model):
+    """Read-only archive of successful RabbitMQ logs."""
+    _name = "rabbitmq.log.archive"
+    _description = "Archived RabbitMQ log messages."
+    _auto = False
+    _order = "create_date desc"
+
+    queue_name = fields.Char(string="Queue Name", readonly=True)
+    data = fields.Json(string="Data", readonly=True)
+    state = fields.Selection(
+        selection=RecordStatus.get_selection(), string="Status", readonly=True
+    )
+    operation = fields.Selection(
+        selection=OperationType.get_selection(), string="Operation", readonly=True
+    )
+    model_name = fields.Char(string="Model Name", readonly=True)
+    record_id = fields.Many2oneReference(
+        model_field="model_name", string="Record ID", readonly=True
+    )
+    error = fields.Char(string="Error", readonly=True)
+    message_id = fields.Char(string="Message ID", readonly=True)
+    create_date = fields.Datetime(string="Created on", readonly=True)
+
+    def init(self):
+        """Create the partitioned archive table and add columns for new fields."""
+        self.env.cr.execute(
+            f"""
+            CREATE TABLE IF NOT EXISTS {self._table} (
+                id integer NOT NULL,
+                create_date timestamp NOT NULL,
+                PRIMARY KEY (id, create_date)
+            ) PARTITION BY RANGE (create_date)
+            """
+        )
+        for name, column_type in self._archive_columns().items():
+            self.env.cr.execute(
+                f'ALTER TABLE {self._table} ADD COLUMN IF NOT EXISTS "{name}" {column_type}'
+            )
+
+    def _archive_columns(self):
+        """Return ``{column: sql type}`` of the stored fields of the archive."""
+        return {
+            name: field.column_type[1]
+            for name, field in self._fields.items()
+            if field.store and field.column_type
+        }
+
+    def _ensure_partitions(self, start, end):
+        """Create the monthly partitions covering ``start`` up to and including ``end``."""
+        month, last = _month_start(start), _month_start(end)
+        while month <= last:
+            upper = _next_month(month)
+            self.env.cr.execute(
+                f"""
+                CREATE TABLE IF NOT EXISTS {PARTITION_PREFIX}{month:%Y%m}
+                PARTITION OF {self._table} FOR VALUES FROM (%s) TO (%s)
+                """,
+                (month, upper),
+            )
+            month = upper
+
+    @api.model
+    def _archive_logs_before(self, cutoff, chunk_size):
+        """Move successful logs created before ``cutoff`` into the archive.
+
+        Rows are moved in chunks with one ``DELETE ... RETURNING`` feeding an
+        ``INSERT`` each, and every chunk is committed on its own.
+        """
+        log_table = self.env["rabbitmq.log"]._table
+        self.env.cr.execute(
+            f"SELECT min(create_date) FROM {log_table} "
+            "WHERE state = 'success' AND create_date < %s",
+            (cutoff,),
+        )
+        oldest = self.env.cr.fetchone()[0]
+        if oldest is None:
+            return 0
+        self._ensure_partitions(oldest, cutoff)
+
+        log_columns = self.env["rabbitmq.log"]._fields
+        columns = ", ".join(
+            f'"{name}"' for name in self._archive_columns() if name in log_columns
+        )
+        total = execute_in_chunks(
+            self.env.cr,
+            f"""
+            WITH moved AS (
+                DELETE FROM {log_table}
+                 WHERE id IN (
+                    SELECT id FROM {log_table}
+                     WHERE state = 'success' AND create_date < %s
+                     ORDER BY create_date
+                     LIMIT %s
+                 )
+             RETURNING {columns}
+            )
+            INSERT INTO {self._table} ({columns}) SELECT {columns} FROM moved
+            """,
+            (cutoff, chunk_size),
+            chunk_size,
+        )
+        self.env["rabbitmq.log"].invalidate_model()
+        return total
+
+    @api.model
+    def _drop_partitions_before(self, cutoff):
+        """Drop the archive months that ended before ``cutoff``."""
+        self.env.cr.execute(
+            """
+            SELECT c.relname
+              FROM pg_inherits i
+              JOIN pg_class c ON c.oid = i.inhrelid
+             WHERE i.inhparent = %s::regclass
+            """,
+            (self._table,),
+        )
+        dropped = []
+        for (name,) in self.env.cr.fetchall():
+            suffix = name[len(PARTITION_PREFIX):]
+            if not name.startswith(PARTITION_PREFIX) or not suffix.isdigit():
+                continue
+            month = date(int(suffix[:4]), int(suffix[4:]), 1)
+            if _next_month(month) <= cutoff.date():
+                self.env.cr.execute(f"DROP TABLE {name}")
+                dropped.append(name)
+        if dropped:
+            _logger.info("Dropped RabbitMQ log archive partitions: %s", ", ".join(dropped))
+        self.invalidate_model()
+        return dropped
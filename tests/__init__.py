@@ -1,3 +1,10 @@
 """This module initializes the tests package for the RabbitMQ Consumer Controller."""
 
+from . import test_asyncio_consumer
 from . import test_rabbitmq_consumer_controller
+from . import test_rabbitmq_log
+from . import test_registry_handle
+from . import test_connection_manager
+from . import test_decoders
+from . import test_metrics
+from . import test_consumer_runner
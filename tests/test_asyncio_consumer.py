@@ -1,18 +1,21 @@
 # pylint: disable=protected-access,line-too-long,import-error
 """Test cases for the AsyncAttendanceConsumer and ReconnectingAsyncAttendanceConsumer classes."""
-import unittest
 from unittest.mock import MagicMock, patch
 
+from odoo.tests.common import BaseCase
+
 from odoo.addons.rabbitmq_model_sync.utils.asyncio_consumer import (
     AsyncAttendanceConsumer,
+    Delivery,
     ReconnectingAsyncAttendanceConsumer,
 )
 
 
-class TestAsyncAttendanceConsumer(unittest.TestCase):
+class TestAsyncAttendanceConsumer(BaseCase):
     """Test cases for AsyncAttendanceConsumer."""
 
-    def setUp(self):
+    def setUp(self):  # pylint: disable=invalid-name
+        """Set up the test environment."""
         self.exchange_name = ""
         self.exchange_type = "direct"
         self.queue_name = "test_queue"
@@ -40,7 +43,7 @@ class TestAsyncAttendanceConsumer(unittest.TestCase):
         with self.assertRaises(Exception) as context:
             consumer.connect()
 
-        self.assertIn("success", str(context.exception))
+        self.assertIn("Simulated connection failure", str(context.exception))
 
     def test_on_message_ack(self):
         """Test message acknowledgment."""
@@ -59,7 +62,7 @@ class TestAsyncAttendanceConsumer(unittest.TestCase):
         self.callback.assert_called_once()
 
     def test_on_message_callback_failure(self):
-        """Test message acknowledgment on callback failure."""
+        """Test a crashed callback parks the message for retry and acks the original."""
         consumer = AsyncAttendanceConsumer(
             self.exchange_name, self.exchange_type, self.queue_name, self.callback
         )
@@ -71,19 +74,198 @@ class TestAsyncAttendanceConsumer(unittest.TestCase):
         method = MagicMock()
         method.delivery_tag = 456
         props = MagicMock()
+        props.headers = {}
         body = b'{"data": "fail"}'
 
-        # Should still acknowledge the message even if callback crashes
+        # The original is acknowledged once its retry copy is published
         consumer.on_message(channel, method, props, body)
 
         channel.basic_ack.assert_called_once_with(456)
         self.callback.assert_called_once()
+        publish = channel.basic_publish.call_args.kwargs
+        self.assertEqual(publish["routing_key"], "test_queue.retry.1000")
+        self.assertEqual(publish["properties"].headers["x-attempts"], 1)
+
+    def test_deterministic_error_is_rejected(self):
+        """Test a callback failing on a bad message rejects it instead of retrying."""
+        consumer = AsyncAttendanceConsumer(
+            self.exchange_name, self.exchange_type, self.queue_name,
+            MagicMock(side_effect=ValueError("bad payload")),
+        )
+        channel = MagicMock()
+        method = MagicMock()
+        method.delivery_tag = 11
+        consumer.on_message(channel, method, MagicMock(headers={}), b"{}")
+        channel.basic_nack.assert_called_once_with(11, requeue=False)
+        channel.basic_publish.assert_not_called()
+
+    def test_outcomes_retry_then_dead_letter(self):
+        """Test transient failures back off per attempt and dead-letter after the last one."""
+        consumer = AsyncAttendanceConsumer(
+            self.exchange_name, self.exchange_type, self.queue_name,
+            MagicMock(return_value="retry"), max_attempts=3, retry_delay_ms=500,
+            dead_letter_exchange="dlx",
+        )
+        self.assertEqual(consumer.retry_queue(1), "test_queue.retry.500")
+        self.assertEqual(consumer.retry_queue(2), "test_queue.retry.1000")
+
+        channel = MagicMock()
+        method = MagicMock()
+        method.delivery_tag = 9
+        props = MagicMock()
+        props.headers = {"x-attempts": 2}
+        consumer.on_message(channel, method, props, b"{}")
+
+        publish = channel.basic_publish.call_args.kwargs
+        self.assertEqual(publish["exchange"], "dlx")
+        self.assertEqual(publish["routing_key"], "test_queue")
+        channel.basic_ack.assert_called_once_with(9)
+
+    def test_reject_without_dead_letter_exchange_nacks(self):
+        """Test a rejected message without a dead-letter exchange is nacked without requeue."""
+        consumer = AsyncAttendanceConsumer(
+            self.exchange_name, self.exchange_type, self.queue_name, MagicMock(return_value="reject"),
+        )
+        channel = MagicMock()
+        method = MagicMock()
+        method.delivery_tag = 10
+        consumer.on_message(channel, method, MagicMock(headers={}), b"{}")
+        channel.basic_nack.assert_called_once_with(10, requeue=False)
+        channel.basic_ack.assert_not_called()
+
+    def test_on_message_batch_ack_multiple(self):
+        """Test a full batch is handed over once and acked with multiple=True."""
+        batch_callback = MagicMock()
+        consumer = AsyncAttendanceConsumer(
+            self.exchange_name,
+            self.exchange_type,
+            self.queue_name,
+            self.callback,
+            batch_callback=batch_callback,
+            batch_size=3,
+        )
+        channel = MagicMock()
+        for tag in (1, 2, 3):
+            method = MagicMock()
+            method.delivery_tag = tag
+            consumer.on_message(channel, method, MagicMock(), b'{"n": 1}')
+
+        batch_callback.assert_called_once()
+        self.assertEqual(len(batch_callback.call_args[0][0]), 3)
+        channel.basic_ack.assert_called_once_with(3, multiple=True)
+        self.callback.assert_not_called()
+
+    def test_partial_batch_flushed_after_linger(self):
+        """Test a partial batch waits for the linger timer before flushing."""
+        batch_callback = MagicMock()
+        consumer = AsyncAttendanceConsumer(
+            self.exchange_name,
+            self.exchange_type,
+            self.queue_name,
+            batch_callback=batch_callback,
+            batch_size=10,
+            batch_linger_ms=50,
+        )
+        consumer._loop = MagicMock()
+        channel = MagicMock()
+        method = MagicMock()
+        method.delivery_tag = 7
+        consumer.on_message(channel, method, MagicMock(), b"{}")
+
+        batch_callback.assert_not_called()
+        consumer._loop.call_later.assert_called_once_with(0.05, consumer.flush_batch)
+        consumer.flush_batch()
+        batch_callback.assert_called_once()
+        channel.basic_ack.assert_called_once_with(7)
+
+    def test_prefetch_applied_before_consuming(self):
+        """Test basic_qos is set from the prefetch settings before consuming."""
+        consumer = AsyncAttendanceConsumer(
+            self.exchange_name, self.exchange_type, self.queue_name, self.callback,
+            prefetch_count=50, prefetch_size=0,
+        )
+        consumer._channel = MagicMock()
+        consumer.on_queue_declareok(MagicMock())
+        self.assertEqual(consumer._channel.queue_declare.call_count, 4)
+        consumer.on_retry_queues_declareok(MagicMock())
+        consumer._channel.basic_qos.assert_called_once_with(
+            prefetch_size=0, prefetch_count=50, callback=consumer.on_basic_qos_ok
+        )
+        consumer._channel.basic_consume.assert_not_called()
 
+        consumer.on_basic_qos_ok(MagicMock())
+        consumer._channel.basic_consume.assert_called_once()
 
-class TestReconnectingAsyncConsumer(unittest.TestCase):
+    def test_in_flight_window_pauses_and_resumes(self):
+        """Test consumption is paused when the window is full and resumed when drained."""
+        batch_callback = MagicMock()
+        consumer = AsyncAttendanceConsumer(
+            self.exchange_name, self.exchange_type, self.queue_name,
+            batch_callback=batch_callback, batch_size=4, max_in_flight=2,
+        )
+        consumer._channel = channel = MagicMock()
+        consumer.start_consuming()
+        for tag in (1, 2):
+            method = MagicMock()
+            method.delivery_tag = tag
+            consumer.on_message(channel, method, MagicMock(), b"{}")
+
+        channel.basic_cancel.assert_called_once()
+        self.assertTrue(consumer._paused)
+
+        consumer.flush_batch()
+        self.assertFalse(consumer._paused)
+        self.assertEqual(consumer._in_flight, 0)
+        self.assertEqual(channel.basic_consume.call_count, 2)
+
+    def test_worker_pool_preserves_key_order_and_acks_on_loop(self):
+        """Test deliveries are processed on worker lanes and acked via the I/O loop."""
+        consumer = AsyncAttendanceConsumer(
+            self.exchange_name, self.exchange_type, self.queue_name, self.callback,
+            worker_count=3,
+        )
+        consumer._loop = MagicMock()
+        channel = MagicMock()
+        lanes = set()
+        for tag in (1, 2, 3):
+            method = MagicMock()
+            method.delivery_tag = tag
+            props = MagicMock()
+            props.headers = {"record_id": 42}
+            delivery_body = b'{"record_id": 42}'
+            lanes.add(consumer._lane_index(Delivery(method, props, delivery_body)))
+            consumer.on_message(channel, method, props, delivery_body)
+        self.assertEqual(len(lanes), 1)
+
+        # Without a header, a partitioning routing key orders deliveries and the
+        # queue's own routing key spreads them round-robin
+        unkeyed = [
+            consumer._lane_index(Delivery(MagicMock(routing_key=key), MagicMock(headers={}), b"{}"))
+            for key in ("attendance.7", "attendance.7", "test_queue", "test_queue")
+        ]
+        self.assertEqual(unkeyed[0], unkeyed[1])
+        self.assertNotEqual(unkeyed[2], unkeyed[3])
+
+        for lane in consumer._lanes:
+            lane.shutdown(wait=True)
+        self.assertEqual(self.callback.call_count, 3)
+        tags = [call[0][0].delivery_tag for call in self.callback.call_args_list]
+        self.assertEqual(tags, [1, 2, 3])
+        channel.basic_ack.assert_not_called()
+        self.assertEqual(consumer._loop.call_soon_threadsafe.call_count, 3)
+
+        # Running the posted callbacks on the loop acks each delivery
+        for call in consumer._loop.call_soon_threadsafe.call_args_list:
+            call[0][0](*call[0][1:])
+        self.assertEqual(channel.basic_ack.call_count, 3)
+        self.assertEqual(consumer._in_flight, 0)
+
+
+class TestReconnectingAsyncConsumer(BaseCase):
     """Test cases for ReconnectingAsyncAttendanceConsumer."""
 
-    def setUp(self):
+    def setUp(self):  # pylint: disable=invalid-name
+        """Set up the test environment."""
         self.exchange_name = ""
         self.exchange_type = "direct"
         self.queue_name = "test_queue"
@@ -96,24 +278,53 @@ class TestReconnectingAsyncConsumer(unittest.TestCase):
         "odoo.addons.rabbitmq_model_sync.utils.asyncio_consumer.AsyncAttendanceConsumer.stop"
     )
     def test_reconnect_logic(self, mock_stop, _):
-        """Test reconnect logic of ReconnectingAsyncAttendanceConsumer."""
+        """Test a reconnect waits for the backoff and keeps the same consumer."""
         reconnecting_consumer = ReconnectingAsyncAttendanceConsumer(
             self.exchange_name, self.exchange_type, self.queue_name, self.callback
         )
-        reconnecting_consumer._consumer.should_reconnect = True
-        reconnecting_consumer._consumer.was_consuming = False
-        reconnecting_consumer._running = False
+        consumer = reconnecting_consumer._consumer
+        consumer.should_reconnect = True
+        reconnecting_consumer._stop_requested.wait = MagicMock()
 
         reconnecting_consumer._maybe_reconnect()
-        mock_stop.assert_called_once()
+        reconnecting_consumer._stop_requested.wait.assert_called_once()
+        mock_stop.assert_not_called()
+        self.assertIs(reconnecting_consumer._consumer, consumer)
 
-    def test_reconnect_delay(self):
-        """Test the reconnect delay logic."""
+    @patch("odoo.addons.rabbitmq_model_sync.utils.backoff.random.uniform", side_effect=lambda low, high: high)
+    def test_reconnect_delay(self, _):
+        """Test the delay grows exponentially up to the cap and resets once a connection is stable."""
         consumer = ReconnectingAsyncAttendanceConsumer(
-            self.exchange_name, self.exchange_type, self.queue_name, self.callback
+            self.exchange_name, self.exchange_type, self.queue_name, self.callback,
+            reconnect_base_delay=1, reconnect_max_delay=20, failure_threshold=10,
+        )
+        self.assertEqual([consumer._get_reconnect_delay() for _ in range(4)], [3, 9, 20, 20])
+
+        # A connection dropped right after it started consuming keeps backing off
+        consumer._consumer.was_consuming = True
+        consumer._consumer.consuming_since = 1.0
+        consumer._on_stable(0.5)
+        self.assertEqual(consumer._get_reconnect_delay(), 20)
+
+        consumer._on_stable(1.0)
+        self.assertEqual(consumer._get_reconnect_delay(), 3)
+
+    def test_circuit_breaker_reports_degraded(self):
+        """Test the consumer reports degraded after repeated failures and healthy on recovery."""
+        health_callback = MagicMock()
+        consumer = ReconnectingAsyncAttendanceConsumer(
+            self.exchange_name, self.exchange_type, self.queue_name, self.callback,
+            reconnect_max_delay=45, failure_threshold=3, health_callback=health_callback,
         )
-        self.assertEqual(consumer._get_reconnect_delay(), 1)
-        self.assertEqual(consumer._get_reconnect_delay(), 2)
+        for _ in range(2):
+            consumer._get_reconnect_delay()
+        health_callback.assert_not_called()
+        self.assertEqual(consumer._get_reconnect_delay(), 45)
+        self.assertEqual(consumer.health, "degraded")
+        health_callback.assert_called_once_with(consumer, "degraded")
 
         consumer._consumer.was_consuming = True
-        self.assertEqual(consumer._get_reconnect_delay(), 0)
+        consumer._consumer.consuming_since = 2.0
+        consumer._on_stable(2.0)
+        self.assertEqual(consumer.health, "healthy")
+        health_callback.assert_called_with(consumer, "healthy")
@@ -0,0 +1,105 @@
+# pylint: disable=protected-access,line-too-long,import-error
+"""Test cases for the shared ConnectionManager."""
+from unittest.mock import MagicMock, patch
+
+from odoo.tests.common import BaseCase
+
+from odoo.addons.rabbitmq_model_sync.utils.connection_manager import ConnectionManager
+
+
+class TestConnectionManager(BaseCase):
+    """Test cases for ConnectionManager channel multiplexing."""
+
+    def setUp(self):  # pylint: disable=invalid-name
+        """Set up the test environment."""
+        node = MagicMock(host="broker", port=5672, virtual_host="/", heartbeat=30, tcp_options=None)
+        node.credentials.username = "guest"
+        node.credentials.password = "guest"
+        self.parameters = (node,)
+        self.manager = ConnectionManager(ConnectionManager.key_for(self.parameters), self.parameters)
+        self.manager._loop = MagicMock()
+        self.addCleanup(ConnectionManager.MANAGERS.clear)
+
+    def test_get_shares_manager_per_broker(self):
+        """The same broker/vhost/user maps to one manager and one I/O thread."""
+        with patch.object(ConnectionManager, "_run"):
+            first = ConnectionManager.get(self.parameters)
+            second = ConnectionManager.get(self.parameters)
+        self.assertIs(first, second)
+
+    def test_key_changes_with_credentials_and_tuning(self):
+        """A new password or heartbeat gets its own manager instead of the old connection."""
+        key = ConnectionManager.key_for(self.parameters)
+        self.assertNotIn("guest", key[3])
+        self.parameters[0].credentials.password = "rotated"
+        rotated = ConnectionManager.key_for(self.parameters)
+        self.assertNotEqual(rotated, key)
+        self.parameters[0].heartbeat = 10
+        self.assertNotEqual(ConnectionManager.key_for(self.parameters), rotated)
+
+    def test_consumers_attached_when_connection_opens(self):
+        """Consumers registered before the connection opens get a channel on open."""
+        consumers = [MagicMock(), MagicMock()]
+        for consumer in consumers:
+            self.manager._attach(consumer)
+            consumer.attach.assert_not_called()
+
+        connection = MagicMock(is_open=True)
+        self.manager._connection = connection
+        self.manager._on_connection_open(connection)
+        for consumer in consumers:
+            consumer.attach.assert_called_once_with(connection)
+
+    def test_connection_lost_detaches_and_reconnects(self):
+        """A lost connection detaches every channel and schedules one reconnect."""
+        consumer = MagicMock()
+        self.manager._consumers.add(consumer)
+        self.manager._on_connection_closed(MagicMock(), "broker went away")
+        consumer.detach.assert_called_once()
+        self.manager._loop.call_later.assert_called_once()
+        delay, callback = self.manager._loop.call_later.call_args.args
+        self.assertTrue(1 <= delay <= 3)
+        self.assertEqual(callback, self.manager._connect)
+
+    def test_open_error_fails_over_to_next_host(self):
+        """An unreachable host is skipped at once; the backoff starts after every host failed."""
+        second = MagicMock(host="broker-2", port=5672, virtual_host="/")
+        manager = ConnectionManager(ConnectionManager.key_for(self.parameters + (second,)), self.parameters + (second,))
+        manager._loop = MagicMock()
+
+        manager._on_connection_open_error(MagicMock(), "connection refused")
+        manager._loop.call_soon.assert_called_once_with(manager._connect)
+        self.assertIs(manager._hosts.current, second)
+
+        manager._on_connection_open_error(MagicMock(), "connection refused")
+        manager._loop.call_later.assert_called_once()
+        self.assertIs(manager._hosts.current, self.parameters[0])
+
+    def test_last_consumer_closes_connection(self):
+        """Detaching the last consumer closes the shared connection."""
+        consumer = MagicMock()
+        connection = self.manager._connection = MagicMock(is_open=True)
+        ConnectionManager.MANAGERS[self.manager.key] = self.manager
+        self.assertIs(self.manager.register(consumer), self.manager)
+        self.manager._attach(consumer)
+
+        self.manager.unregister(consumer)
+        self.assertNotIn(self.manager.key, ConnectionManager.MANAGERS)
+        self.manager._detach(consumer)
+        consumer.stop_consuming.assert_called_once()
+        connection.close.assert_called_once()
+
+    def test_register_on_closing_manager_uses_fresh_one(self):
+        """A consumer registering while the last one leaves gets a new manager, not the closing one."""
+        leaving, arriving = MagicMock(), MagicMock()
+        ConnectionManager.MANAGERS[self.manager.key] = self.manager
+        self.manager.register(leaving)
+        self.manager.unregister(leaving)
+        self.assertTrue(self.manager._closing)
+
+        with patch.object(ConnectionManager, "_run"):
+            manager = self.manager.register(arriving)
+        self.assertIsNot(manager, self.manager)
+        self.assertIs(ConnectionManager.MANAGERS[self.manager.key], manager)
+        self.assertEqual(manager._registered, {arriving})
+        self.assertFalse(self.manager._registered)
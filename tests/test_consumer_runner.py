@@ -0,0 +1,67 @@
+# pylint: disable=import-error,protected-access
+"""Test cases for the assignment of controllers to consumer runner workers and server startup."""
+from unittest.mock import patch
+
+from odoo.tools import config
+from odoo.tests.common import BaseCase
+
+from odoo.addons.rabbitmq_model_sync.cli.consumer_runner import ConsumerRunner, _Worker
+from odoo.addons.rabbitmq_model_sync.hooks import post_load_hook
+
+
+@patch.object(_Worker, "_send")
+@patch.object(_Worker, "spawn")
+class TestConsumerRunner(BaseCase):
+    """Test cases for ConsumerRunner.rebalance."""
+
+    def assignments(self, runner):
+        """Return the sorted controller ids of each worker."""
+        return [sorted(worker.controller_ids) for worker in runner.workers]
+
+    def test_controllers_are_split_per_worker(self, mock_spawn, _mock_send):
+        """Test running controllers are served by one worker per N of them."""
+        runner = ConsumerRunner(["db"], queues_per_process=2)
+        runner.rebalance("db", [1, 2, 3])
+        self.assertEqual(self.assignments(runner), [[1, 2], [3]])
+        self.assertEqual(mock_spawn.call_count, 2)
+
+    def test_state_changes_reassign_without_restart(self, mock_spawn, mock_send):
+        """Test started and stopped controllers are handed to the running workers."""
+        runner = ConsumerRunner(["db"], queues_per_process=2)
+        runner.rebalance("db", [1, 2, 3])
+        mock_spawn.reset_mock()
+
+        # 2 stops and 4 starts: the first worker takes 4, the second keeps 3
+        runner.rebalance("db", [1, 3, 4])
+        self.assertEqual(self.assignments(runner), [[1, 4], [3]])
+        mock_spawn.assert_not_called()
+        mock_send.assert_called_with([1, 4])
+
+        # 3 stops: its worker is asked to exit
+        runner.rebalance("db", [1, 4])
+        self.assertEqual(self.assignments(runner), [[1, 4]])
+        self.assertEqual(len(runner.stopping), 1)
+        mock_send.assert_called_with(None)
+
+
+SERVER_OPTIONS = {
+    "rabbitmq_dedicated_runner": False, "stop_after_init": False, "test_enable": False,
+}
+
+
+@patch("odoo.addons.rabbitmq_model_sync.hooks.threading.Thread")
+class TestStartupHook(BaseCase):
+    """Test cases for the consumer startup of post_load_hook."""
+
+    def test_threaded_server_starts_consumers(self, mock_thread):
+        """Test a threaded server waits for its databases and starts their consumers."""
+        with patch.dict(config.options, SERVER_OPTIONS, db_name="db1, db2", workers=0):
+            post_load_hook()
+        self.assertEqual(mock_thread.call_args.kwargs["args"], (["db1", "db2"],))
+        mock_thread.return_value.start.assert_called_once()
+
+    def test_prefork_master_leaves_startup_to_workers(self, mock_thread):
+        """Test the prefork master starts nothing its forked workers would inherit."""
+        with patch.dict(config.options, SERVER_OPTIONS, db_name="db1", workers=4):
+            post_load_hook()
+        mock_thread.assert_not_called()
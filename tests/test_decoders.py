@@ -0,0 +1,45 @@
+# pylint: disable=import-error
+"""Test cases for the message body decoders."""
+from unittest.mock import patch
+
+from odoo.tests.common import BaseCase
+
+from odoo.addons.rabbitmq_model_sync.utils import decoders
+from odoo.addons.rabbitmq_model_sync.utils.decoders import BodyPreview, decode_body
+
+
+class TestDecoders(BaseCase):
+    """Test cases for decode_body and BodyPreview."""
+
+    def test_decode_json_from_bytes(self):
+        """Test JSON is decoded straight from bytes, with or without a content type."""
+        body = '{"name": "Zoë"}'.encode()
+        self.assertEqual(decode_body(body), {"name": "Zoë"})
+        self.assertEqual(decode_body(body, "application/json; charset=utf-8"), {"name": "Zoë"})
+        self.assertEqual(decode_body(body, "application/unknown"), {"name": "Zoë"})
+
+    def test_decode_stdlib_fallback(self):
+        """Test the stdlib decoder is used when orjson is not installed."""
+        with patch.object(decoders, "orjson", None):
+            self.assertEqual(decode_body(b'{"a": 1}'), {"a": 1})
+            with self.assertRaises(ValueError):
+                decode_body(b"{not json")
+
+    def test_decode_msgpack_requires_package(self):
+        """Test a msgpack body without the msgpack package is a decoding error."""
+        with patch.object(decoders, "msgpack", None):
+            with self.assertRaises(ValueError):
+                decode_body(b"\x81\xa1a\x01", "application/msgpack")
+
+    def test_register_decoder(self):
+        """Test custom content types can be plugged in."""
+        decoders.register_decoder("text/csv", lambda body: body.decode().split(","))
+        self.addCleanup(decoders.DECODERS.pop, "text/csv")
+        self.assertEqual(decode_body(b"a,b", "TEXT/CSV"), ["a", "b"])
+
+    def test_body_preview_truncates(self):
+        """Test the log preview of a large body is truncated."""
+        preview = str(BodyPreview(b"x" * 1000))
+        self.assertTrue(preview.endswith("... (1000 bytes)"))
+        self.assertEqual(len(preview), decoders.PREVIEW_BYTES + len("... (1000 bytes)"))
+        self.assertEqual(str(BodyPreview(b"short")), "short")
@@ -0,0 +1,60 @@
+# pylint: disable=import-error
+"""Test cases for the in-process consumer metrics."""
+from unittest.mock import MagicMock
+
+from odoo.tests.common import BaseCase
+
+from odoo.addons.rabbitmq_model_sync.utils.asyncio_consumer import AsyncAttendanceConsumer
+from odoo.addons.rabbitmq_model_sync.utils.metrics import (LatencyHistogram, QueueMetrics,
+                                                            merge_snapshots)
+
+
+class TestQueueMetrics(BaseCase):
+    """Test cases for QueueMetrics and LatencyHistogram."""
+
+    def test_histogram_percentiles(self):
+        """Test percentiles report the upper bound of the bucket holding the rank."""
+        histogram = LatencyHistogram()
+        for duration in [0.5] * 90 + [40] * 9 + [20000]:
+            histogram.observe(duration)
+        snapshot = histogram.snapshot()
+        self.assertEqual(snapshot["count"], 100)
+        self.assertEqual(snapshot["p50_ms"], 1.0)
+        self.assertEqual(snapshot["p95_ms"], 50.0)
+        self.assertEqual(snapshot["buckets"]["inf"], 1)
+
+    def test_consumer_records_counters_and_throughput(self):
+        """Test the consumer counts received and settled deliveries."""
+        metrics = QueueMetrics("metrics_queue")
+        outcomes = iter(["ack", "retry", "reject"])
+        consumer = AsyncAttendanceConsumer(
+            "", "direct", "metrics_queue", MagicMock(side_effect=lambda *args: next(outcomes)),
+            metrics=metrics,
+        )
+        channel = MagicMock()
+        for tag in (1, 2, 3):
+            consumer.on_message(channel, MagicMock(delivery_tag=tag), MagicMock(headers={}), b"{}")
+
+        snapshot = metrics.snapshot()
+        self.assertEqual(
+            (snapshot["received"], snapshot["acked"], snapshot["retried"], snapshot["rejected"]),
+            (3, 1, 1, 1),
+        )
+        self.assertAlmostEqual(snapshot["throughput_per_s"], 1 / 60)
+        self.assertEqual(consumer.in_flight, 0)
+
+    def test_snapshots_of_processes_are_merged(self):
+        """Test counters add up and percentiles are computed from the summed buckets."""
+        fast, slow = QueueMetrics("merged_queue"), QueueMetrics("merged_queue")
+        fast.record_received(9)
+        slow.record_received(1)
+        for _n in range(9):
+            fast.observe("db", 2)
+        slow.observe("db", 900)
+
+        merged = merge_snapshots("merged_queue", [fast.snapshot(), slow.snapshot()])
+        self.assertEqual(merged["received"], 10)
+        self.assertEqual(merged["latency"]["db"]["count"], 10)
+        self.assertEqual(merged["latency"]["db"]["p50_ms"], 2.0)
+        self.assertEqual(merged["latency"]["db"]["p99_ms"], 1000.0)
+        self.assertAlmostEqual(merged["latency"]["db"]["mean_ms"], 91.8)
@@ -1,9 +1,17 @@
-# pylint: disable=line-too-long,invalid-name,import-error,wrong-import-order,protected-access
+# pylint: disable=line-too-long,invalid-name,import-error,wrong-import-order,protected-access,too-many-public-methods
 """Test cases for RabbitMQ Consumer Controller in Odoo"""
+import json
 from unittest.mock import MagicMock, patch
 
+from psycopg2 import DatabaseError, errors
+
+from odoo.exceptions import ValidationError
 from odoo.tests.common import TransactionCase
 
+from odoo.addons.rabbitmq_model_sync.models.rabbitmq_consumer_controller import SEEN_MESSAGES
+from odoo.addons.rabbitmq_model_sync.utils.asyncio_consumer import ACK, REJECT, RETRY
+from odoo.addons.rabbitmq_model_sync.utils.ownership import OwnershipCoordinator
+
 
 class TestRabbitMqConsumerController(TransactionCase):
     """Test cases for RabbitMQ Consumer Controller model."""
@@ -45,7 +53,7 @@ class TestRabbitMqConsumerController(TransactionCase):
         result = self.controller.action_start_consumer()
         self.assertTrue(result)
         self.assertEqual(self.controller.state, "running")
-        self.assertIn("test_queue", self.controller.CONSUMERS)
+        self.assertIn(self.controller._local_key(), self.controller.CONSUMERS)
 
     @patch(
         "odoo.addons.rabbitmq_model_sync.models.rabbitmq_consumer_controller.ReconnectingAsyncAttendanceConsumer"
@@ -60,33 +68,470 @@ class TestRabbitMqConsumerController(TransactionCase):
         result = self.controller.action_stop_consumer()
         self.assertTrue(result)
         self.assertEqual(self.controller.state, "stop")
-        self.assertNotIn("test_queue", self.controller.CONSUMERS)
+        self.assertNotIn(self.controller._local_key(), self.controller.CONSUMERS)
+
+    @patch(
+        "odoo.addons.rabbitmq_model_sync.models.rabbitmq_consumer_controller.ReconnectingAsyncAttendanceConsumer"
+    )
+    def test_concurrency_starts_and_stops_group(self, mock_consumer_cls):
+        """Test a controller with concurrency starts and stops its consumers as a group."""
+        mock_consumer_cls.side_effect = lambda **kwargs: MagicMock()
+        self.controller.concurrency = 3
+        self.controller.action_start_consumer()
+        consumers = self.controller.CONSUMERS[self.controller._local_key()]
+        self.assertEqual(len(consumers), 3)
+        self.assertEqual(mock_consumer_cls.call_count, 3)
+        self.controller.invalidate_recordset(["running_consumers"])
+        self.assertEqual(self.controller.running_consumers, 3)
+
+        self.controller.action_stop_consumer()
+        for consumer in consumers:
+            consumer.stop.assert_called_once()
+        self.assertNotIn(self.controller._local_key(), self.controller.CONSUMERS)
+
+    @patch(
+        "odoo.addons.rabbitmq_model_sync.models.rabbitmq_consumer_controller.AsyncAttendanceConsumer"
+    )
+    @patch(
+        "odoo.addons.rabbitmq_model_sync.models.rabbitmq_consumer_controller.ConnectionManager.get"
+    )
+    def test_shared_connection_registers_channels(self, mock_manager_get, mock_consumer_cls):
+        """Test a shared-connection controller registers channels instead of starting threads."""
+        mock_consumer_cls.side_effect = lambda **kwargs: MagicMock()
+        self.controller.write({"shared_connection": True, "concurrency": 2})
+        self.controller.action_start_consumer()
+
+        mock_manager_get.assert_called_once()
+        consumers = self.controller.CONSUMERS[self.controller._local_key()]
+        self.assertEqual(len(consumers), 2)
+        for consumer in consumers:
+            consumer.start.assert_called_once()
+        self.assertEqual(self.controller.THREADS[self.controller._local_key()], [])
+        for call in mock_consumer_cls.call_args_list:
+            self.assertIs(call.kwargs["connection_manager"], mock_manager_get.return_value)
+        self.controller.action_stop_consumer()
 
     @patch(
-        "odoo.addons.rabbitmq_model_sync.models.rabbitmq_consumer_controller.modules.registry.Registry.new"
+        "odoo.addons.rabbitmq_model_sync.models.rabbitmq_consumer_controller.RegistryHandle.get"
     )
-    def test_process_rabbitmq_message(self, mock_registry_new):
+    def test_process_rabbitmq_message(self, mock_handle_get):
         """Test processing a RabbitMQ message."""
-        # Mock registry and environment
-        mock_registry = MagicMock()
+        # Mock the registry handle and the environment it leases
+        mock_handle = MagicMock()
         mock_env = MagicMock()
         mock_log_model = MagicMock()
         mock_log_record = MagicMock()
         mock_env.__getitem__.return_value = mock_log_model
         mock_log_model.create.return_value = mock_log_record
-        mock_registry.cursor.return_value.__enter__.return_value = MagicMock()
-        mock_registry.cursor.return_value.__exit__.return_value = False
-        mock_registry_new.return_value = mock_registry
-
-        # Patch api.Environment to return our mock_env
-        with patch("odoo.api.Environment", return_value=mock_env):
-            method = MagicMock()
-            method.routing_key = "test_queue"
-            properties = MagicMock()
-            properties.headers = {"operation": "test_op"}
-            body = b'{"foo": "bar"}'
+        mock_handle.lease.return_value.__enter__.return_value = mock_env
+        mock_handle.lease.return_value.__exit__.return_value = False
+        mock_handle_get.return_value = mock_handle
+
+        method = MagicMock()
+        method.routing_key = "test_queue"
+        properties = MagicMock()
+        properties.headers = {"operation": "test_op"}
+        body = b'{"foo": "bar"}'
+        self.controller._process_rabbitmq_message(
+            method, properties, body, "test.model"
+        )
+        mock_handle_get.assert_called_once_with(self.env.cr.dbname)
+        mock_log_model.create.assert_called_once()
+        mock_log_record.process_odoo_operation.assert_called_once()
+        mock_env.cr.commit.assert_called_once()
+
+    @patch(
+        "odoo.addons.rabbitmq_model_sync.models.rabbitmq_consumer_controller.RegistryHandle.get"
+    )
+    def test_process_rabbitmq_batch_isolates_failure(self, mock_handle_get):
+        """A failing message in a batch is logged as failed and the batch still commits."""
+        mock_handle_get.return_value.lease.return_value.__enter__.return_value = self.env
+        partner_model = self.env["ir.model"]._get("res.partner")
+        deliveries = []
+        for name in ("Batch A", False, "Batch C"):
+            method = MagicMock(routing_key="test_queue")
+            properties = MagicMock(headers={"operation": "create"})
+            body = json.dumps({"name": name or None}).encode()
+            deliveries.append((method, properties, body))
+
+        with patch.object(type(self.env.cr), "commit") as mock_commit:
+            self.controller._process_rabbitmq_batch(deliveries, partner_model.model)
+            mock_commit.assert_called_once()
+
+        logs = self.env["rabbitmq.log"].search([("queue_name", "=", "test_queue")])
+        self.assertEqual(len(logs), 3)
+        self.assertEqual(sorted(logs.mapped("state")), ["fail", "success", "success"])
+        self.assertTrue(self.env["res.partner"].search([("name", "=", "Batch C")]))
+
+    @patch(
+        "odoo.addons.rabbitmq_model_sync.models.rabbitmq_consumer_controller.RegistryHandle.get"
+    )
+    def test_failures_only_policy_persists_failed_logs(self, mock_handle_get):
+        """Under the failures-only policy only failed messages get a log record."""
+        mock_handle_get.return_value.lease.return_value.__enter__.return_value = self.env
+        self.controller.log_policy = "failures"
+        options = self.controller._processing_options("res.partner")
+        deliveries = [
+            (MagicMock(routing_key="policy_queue"), MagicMock(headers={"operation": "create"}), body)
+            for body in (b'{"name": "Unlogged"}', b'{"name": null}')
+        ]
+        with patch.object(type(self.env.cr), "commit"):
+            self.controller._process_rabbitmq_batch(deliveries, "res.partner", options)
+
+        self.assertTrue(self.env["res.partner"].search([("name", "=", "Unlogged")]))
+        logs = self.env["rabbitmq.log"].search([("queue_name", "=", "policy_queue")])
+        self.assertEqual(logs.mapped("state"), ["fail"])
+
+    def test_sampled_policy_logs_one_in_n(self):
+        """The sampled policy persists one message out of every N up front."""
+        self.controller.write({"log_policy": "sampled", "log_sample_rate": 3})
+        options = self.controller._processing_options("res.partner")
+        self.assertEqual([options.should_log() for _ in range(6)], [True, False, False] * 2)
+
+    @patch(
+        "odoo.addons.rabbitmq_model_sync.models.rabbitmq_consumer_controller.RegistryHandle.get"
+    )
+    def test_redelivered_duplicate_skipped(self, mock_handle_get):
+        """A redelivered message that was already processed is skipped."""
+        mock_handle_get.return_value.lease.return_value.__enter__.return_value = self.env
+        self.controller.deduplicate = True
+        options = self.controller._processing_options("res.partner")
+
+        def deliver(redelivered, message_id="msg-1", body=b'{"name": "Once"}', attempts=None):
+            method = MagicMock(routing_key="dedup_queue", redelivered=redelivered)
+            headers = {"operation": "create"}
+            if attempts:
+                headers["x-attempts"] = attempts
+            properties = MagicMock(headers=headers, message_id=message_id)
             self.controller._process_rabbitmq_message(
-                method, properties, body, "test.model"
+                method, properties, body, "res.partner", options
+            )
+
+        with patch.object(type(self.env.cr), "commit"):
+            deliver(False)
+            deliver(True)
+            # Forget the in-memory seen-set: the indexed lookup still catches it
+            SEEN_MESSAGES.clear()
+            deliver(True)
+            # A copy republished for retry is not flagged redelivered by the broker
+            deliver(False, attempts=1)
+
+        logs = self.env["rabbitmq.log"].search([("queue_name", "=", "dedup_queue")])
+        self.assertEqual(len(logs), 1)
+        self.assertEqual(logs.message_id, "msg-1")
+        self.assertEqual(self.env["res.partner"].search_count([("name", "=", "Once")]), 1)
+
+        # A message whose earlier attempt failed is processed again
+        with patch.object(type(self.env.cr), "commit"):
+            deliver(False, "msg-2", b'{"name": null}')
+            failed = self.env["rabbitmq.log"].search([("message_id", "=", "msg-2")])
+            self.assertEqual(failed.state, "fail")
+            deliver(True, "msg-2", b'{"name": "Second Try"}')
+        self.assertEqual(self.env["res.partner"].search_count([("name", "=", "Second Try")]), 1)
+
+    @patch(
+        "odoo.addons.rabbitmq_model_sync.models.rabbitmq_consumer_controller.RegistryHandle.get"
+    )
+    def test_undecodable_body_keeps_raw_payload(self, mock_handle_get):
+        """A body that cannot be decoded gets a failed log holding a preview of the raw payload."""
+        mock_handle_get.return_value.lease.return_value.__enter__.return_value = self.env
+        options = self.controller._processing_options("res.partner")
+        method = MagicMock(routing_key="undecodable_queue", redelivered=False)
+        properties = MagicMock(headers={"operation": "create"}, content_type="application/json")
+        with patch.object(type(self.env.cr), "commit"):
+            self.assertEqual(
+                self.controller._process_rabbitmq_batch(
+                    [(method, properties, b"\xff not json")], "res.partner", options
+                ),
+                [ACK],
+            )
+            self.assertEqual(
+                self.controller._process_rabbitmq_message(
+                    method, properties, b"\xff not json", "res.partner", options
+                ),
+                ACK,
             )
-            mock_log_model.create.assert_called_once()
-            mock_log_record.process_odoo_operation.assert_called_once()
+        logs = self.env["rabbitmq.log"].search([("queue_name", "=", "undecodable_queue")])
+        self.assertEqual(logs.mapped("state"), ["fail", "fail"])
+        for log in logs:
+            self.assertIn("Invalid message", log.error)
+            self.assertEqual(log.data, {"body": "\ufffd not json"})
+
+    def test_unlogged_messages_are_marked_seen(self):
+        """Messages processed without a persisted log are still remembered once committed."""
+        self.controller.write({"deduplicate": True, "log_policy": "failures"})
+        options = self.controller._processing_options("res.partner")
+        vals_list = [
+            {
+                "queue_name": "unlogged_queue",
+                "data": {"name": "Unlogged Once"},
+                "operation": "create",
+                "model_name": "res.partner",
+                "controller_id": self.controller.id,
+                "message_id": "msg-unlogged",
+            }
+        ]
+        logs = self.controller._ingest_log_vals(self.env, vals_list, options)
+        seen = self.controller._successful_ids(logs)
+        # A commit clears the cache, which drops the in-memory logs' values
+        self.env.invalidate_all()
+        self.controller._mark_seen(self.env.cr.dbname, seen)
+
+        self.assertFalse(self.env["rabbitmq.log"].search([("queue_name", "=", "unlogged_queue")]))
+        self.assertIn((self.env.cr.dbname, "unlogged_queue", "msg-unlogged"), SEEN_MESSAGES)
+        self.assertEqual(
+            self.controller._drop_duplicates(self.env, vals_list, [True], options), []
+        )
+
+    @patch(
+        "odoo.addons.rabbitmq_model_sync.models.rabbitmq_consumer_controller.RegistryHandle.get"
+    )
+    def test_transient_error_is_retried(self, mock_handle_get):
+        """A serialization failure asks for a retry, other database errors reject the message."""
+        mock_handle_get.return_value.lease.return_value.__enter__.return_value = self.env
+        method = MagicMock(routing_key="retry_queue")
+        properties = MagicMock(headers={"operation": "create"})
+        serialization_failure = errors.SerializationFailure("could not serialize access")
+        serialization_failure.pgcode = "40001"
+        for error, outcome in ((serialization_failure, RETRY), (DatabaseError("broken"), REJECT)):
+            with patch.object(type(self.controller), "_ingest_log_vals", side_effect=error):
+                self.assertEqual(
+                    self.controller._process_rabbitmq_message(
+                        method, properties, b'{"name": "Retry"}', "res.partner"
+                    ),
+                    outcome,
+                )
+
+    @patch(
+        "odoo.addons.rabbitmq_model_sync.models.rabbitmq_consumer_controller.RegistryHandle.get"
+    )
+    def test_invalid_payload_only_fails_its_delivery(self, mock_handle_get):
+        """A delivery whose log values are invalid gets a failed log; the rest of the batch commits."""
+        mock_handle_get.return_value.lease.return_value.__enter__.return_value = self.env
+        self.controller.strict_validation = True
+        options = self.controller._processing_options("res.partner")
+        deliveries = [
+            (MagicMock(routing_key="invalid_queue", redelivered=False), MagicMock(headers=headers), body)
+            for headers, body in (
+                ({"operation": "create"}, b'{"name": "Valid A"}'),
+                ({}, b'{"name": "No Operation"}'),
+                ({"operation": "create"}, b'{"name": "Valid B"}'),
+            )
+        ]
+        with patch.object(type(self.env.cr), "commit"):
+            outcomes = self.controller._process_rabbitmq_batch(deliveries, "res.partner", options)
+        self.assertEqual(outcomes, [ACK, ACK, ACK])
+        logs = self.env["rabbitmq.log"].search([("queue_name", "=", "invalid_queue")])
+        self.assertEqual(sorted(logs.mapped("state")), ["fail", "success", "success"])
+        failed = logs.filtered(lambda log: log.state == "fail")
+        self.assertIn("Invalid message", failed.error)
+        self.assertEqual(failed.data, {"name": "No Operation"})
+
+        # The same payload on the single-message path is recorded and acked as well
+        with patch.object(type(self.env.cr), "commit"):
+            self.assertEqual(
+                self.controller._process_rabbitmq_message(*deliveries[1], "res.partner", options),
+                ACK,
+            )
+        # A delivery that cannot even be recorded is rejected
+        with patch.object(type(self.env["rabbitmq.log"]), "create", side_effect=ValueError("bad")), \
+                patch.object(type(self.env.cr), "commit"):
+            self.assertEqual(
+                self.controller._process_rabbitmq_batch(deliveries[1:2], "res.partner", options),
+                [REJECT],
+            )
+
+    @patch(
+        "odoo.addons.rabbitmq_model_sync.models.rabbitmq_consumer_controller.RegistryHandle.get"
+    )
+    def test_duplicate_message_id_is_acked(self, mock_handle_get):
+        """A message id another consumer already logged is acked on both paths."""
+        mock_handle_get.return_value.lease.return_value.__enter__.return_value = self.env
+        method = MagicMock(routing_key="dup_queue", redelivered=False)
+        properties = MagicMock(headers={"operation": "create"}, message_id="dup-1")
+        duplicate = errors.UniqueViolation("duplicate key value violates unique constraint")
+        with patch.object(type(self.controller), "_ingest_log_vals", side_effect=duplicate), \
+                patch.object(type(self.env.cr), "commit"):
+            self.assertEqual(
+                self.controller._process_rabbitmq_message(
+                    method, properties, b'{"name": "Dup"}', "res.partner"
+                ),
+                ACK,
+            )
+            self.assertEqual(
+                self.controller._process_rabbitmq_batch(
+                    [(method, properties, b'{"name": "Dup"}')] * 2, "res.partner"
+                ),
+                [ACK, ACK],
+            )
+
+    def test_strict_validation_is_opt_in(self):
+        """Log values are only validated when the controller asks for strict validation."""
+        method = MagicMock(routing_key="strict_queue")
+        properties = MagicMock(headers={}, content_type="application/json")
+        body = b'{"name": "Unchecked"}'
+
+        options = self.controller._processing_options("res.partner")
+        vals = self.controller._prepare_rabbitmq_log_vals(method, properties, body, "res.partner", options)
+        self.assertIsNone(vals["operation"])
+
+        self.controller.strict_validation = True
+        options = self.controller._processing_options("res.partner")
+        with self.assertRaises(ValueError):
+            self.controller._prepare_rabbitmq_log_vals(method, properties, body, "res.partner", options)
+
+    def test_prefetch_size_must_be_zero(self):
+        """RabbitMQ rejects a non-zero prefetch size, so the controller does too."""
+        with self.assertRaises(ValidationError):
+            self.controller.prefetch_size = 1024
+        with self.assertRaises(ValidationError):
+            self.controller.prefetch_count = -1
+
+    def test_metrics_exposed_as_fields(self):
+        """The queue's in-process metrics are readable from the controller."""
+        metrics = self.controller._queue_metrics()
+        received = metrics.received
+        metrics.record_received(2)
+        metrics.observe("db", 30)
+        self.controller.invalidate_recordset()
+        self.assertEqual(self.controller.messages_received, received + 2)
+        self.assertGreater(self.controller.db_latency_p95, 0)
+        self.assertIn("latency", self.controller._metrics_snapshot())
+
+    def test_metrics_aggregated_from_other_processes(self):
+        """Consumers and metrics published on the leases of other processes are added up."""
+        self.controller.write({"concurrency": 2, "state": "running"})
+        lease = self.env["rabbitmq.consumer.lease"]
+        self.assertEqual(len(lease._sync_ownership(owner="runner:1")), 2)
+        self.controller.invalidate_recordset()
+        received = self.controller.messages_received
+
+        # The runner process publishes its consumers and metrics at its heartbeat
+        consumer = MagicMock(slot=0, in_flight=3)
+        metrics = {"received": 5, "acked": 4, "retried": 1, "latency": {}}
+        with patch.dict(self.controller.CONSUMERS, {self.controller._local_key(): [consumer]}), \
+                patch.object(type(self.controller), "_queue_metrics") as mock_metrics:
+            mock_metrics.return_value.snapshot.return_value = metrics
+            lease._publish_local_state(owner="runner:1")
+        self.assertEqual(self.controller.lease_ids.mapped("running"), [True, False])
+
+        self.controller.invalidate_recordset()
+        self.assertEqual(self.controller.running_consumers, 1)
+        self.assertEqual(self.controller.messages_received, received + 5)
+        self.assertEqual(self.controller.messages_in_flight, 3)
+        # Every lease carries the owner's snapshot, which is only counted once
+        self.assertEqual(self.controller._metrics_snapshot()["acked"] - 4, self.controller._queue_metrics().acked)
+
+    def test_slots_are_shared_between_processes(self):
+        """Processes split the slots fairly and take over those of a dead process."""
+        lease = self.env["rabbitmq.consumer.lease"]
+        self.controller.write({"concurrency": 4, "state": "running"})
+        self.assertEqual(len(lease._sync_ownership(owner="node-a:1")), 4)
+
+        # A second process joins: it waits for the first one to shed its excess
+        self.assertFalse(lease._sync_ownership(owner="node-b:2"))
+        first = lease._sync_ownership(owner="node-a:1")
+        second = lease._sync_ownership(owner="node-b:2")
+        self.assertEqual((len(first), len(second)), (2, 2))
+        self.assertFalse(first & second)
+        self.assertEqual(len(self.controller.lease_ids), 4)
+
+        # The first process stops heartbeating and its slots are taken over
+        self.env.cr.execute(
+            "UPDATE rabbitmq_consumer_lease SET heartbeat = heartbeat - interval '1 hour' WHERE owner = 'node-a:1'"
+        )
+        self.env.cr.execute(
+            "UPDATE rabbitmq_consumer_node SET heartbeat = heartbeat - interval '1 hour' WHERE name = 'node-a:1'"
+        )
+        self.assertEqual(len(lease._sync_ownership(owner="node-b:2")), 4)
+        self.assertFalse(self.env["rabbitmq.consumer.node"].search([("name", "=", "node-a:1")]))
+
+    @patch("odoo.addons.rabbitmq_model_sync.models.rabbitmq_consumer_controller.random.uniform", return_value=4.0)
+    @patch(
+        "odoo.addons.rabbitmq_model_sync.models.rabbitmq_consumer_controller.ReconnectingAsyncAttendanceConsumer"
+    )
+    def test_coordinator_staggers_startup(self, mock_consumer_cls, mock_uniform):
+        """Consumers started by the coordinator are delayed by jitter, a manual start is not."""
+        mock_consumer_cls.side_effect = lambda **kwargs: MagicMock()
+        self.controller.write({"concurrency": 2, "state": "running"})
+        owned = self.env["rabbitmq.consumer.lease"]._sync_ownership()
+        self.controller._apply_ownership(owned, jitter=True)
+        for thread in self.controller.THREADS[self.controller._local_key()]:
+            thread.join()
+        consumers = self.controller.CONSUMERS[self.controller._local_key()]
+        self.assertEqual([consumer.run.call_args.kwargs["start_delay"] for consumer in consumers], [4.0, 4.0])
+        mock_uniform.assert_called_with(0, 10.0)
+
+        self.controller.action_stop_consumer()
+        self.controller.concurrency = 1
+        self.controller.action_start_consumer()
+        for thread in self.controller.THREADS[self.controller._local_key()]:
+            thread.join()
+        self.assertEqual(self.controller.CONSUMERS[self.controller._local_key()][0].run.call_args.kwargs["start_delay"], 0)
+        self.controller.action_stop_consumer()
+
+    def test_coordinator_stops_consumers_without_heartbeat(self):
+        """Local consumers stop once no lease heartbeat succeeded for a lease timeout."""
+        consumer = MagicMock(slot=0)
+        key = self.controller._local_key()
+        self.controller.CONSUMERS[key] = [consumer]
+        self.addCleanup(self.controller.CONSUMERS.pop, key, None)
+        coordinator = OwnershipCoordinator(self.env.cr.dbname)
+        coordinator._controller_keys, coordinator._lease_timeout = {key}, 30
+
+        coordinator._stop_if_lapsed()
+        consumer.stop.assert_not_called()
+
+        coordinator._last_heartbeat -= 31
+        coordinator._stop_if_lapsed()
+        consumer.stop.assert_called_once()
+        self.assertNotIn(self.controller._local_key(), self.controller.CONSUMERS)
+        self.assertFalse(coordinator._controller_keys)
+
+    def test_local_consumers_keyed_by_database_and_controller(self):
+        """Consumers of another database or controller on the same queue name are left alone."""
+        other_db = MagicMock(slot=0)
+        same_queue = MagicMock(slot=0)
+        twin = self.controller.copy({"name": "Twin Consumer"})
+        keys = [(f"{self.env.cr.dbname}_other", self.controller.id), twin._local_key()]
+        for key, consumer in zip(keys, (other_db, same_queue)):
+            self.controller.CONSUMERS[key] = [consumer]
+            self.addCleanup(self.controller.CONSUMERS.pop, key, None)
+
+        self.controller._apply_ownership({(twin.id, 0)})
+        other_db.stop.assert_not_called()
+        same_queue.stop.assert_not_called()
+        self.assertEqual(twin.queue, self.controller.queue)
+        self.assertNotIn(self.controller._local_key(), self.controller.CONSUMERS)
+
+        self.controller._apply_ownership(set())
+        other_db.stop.assert_not_called()
+        same_queue.stop.assert_called_once()
+        self.assertNotEqual(
+            self.controller._queue_metrics(), twin._queue_metrics()
+        )
+
+    def test_broker_connection_parameters(self):
+        """A controller connects to its broker's hosts in order, with cached parameters."""
+        broker = self.env["rabbitmq.broker"].create({
+            "name": "Cluster",
+            "hosts": "rabbit-1:5673, rabbit-2",
+            "virtual_host": "sync",
+            "username": "odoo",
+            "password": "secret",
+        })
+        self.controller.broker_id = broker
+        parameters = self.controller._connection_parameters()
+        self.assertEqual([(params.host, params.port) for params in parameters], [("rabbit-1", 5673), ("rabbit-2", 5672)])
+        self.assertEqual(parameters[0].virtual_host, "sync")
+        self.assertEqual(parameters[0].tcp_options["TCP_KEEPIDLE"], 60)
+        self.assertIs(self.controller._connection_parameters(), parameters)
+
+        broker.heartbeat = 10
+        parameters = self.controller._connection_parameters()
+        self.assertEqual(parameters[0].heartbeat, 10)
+        # Only connection settings drop the cached parameters
+        broker.name = "Renamed"
+        self.assertIs(self.controller._connection_parameters(), parameters)
+        with self.assertRaises(ValidationError):
+            broker.hosts = "rabbit-1:amqp"
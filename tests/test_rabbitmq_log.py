@@ -1,11 +1,12 @@
-# pylint: disable=import-error,protected-access,relative-beyond-top-level
+# pylint: disable=import-error,protected-access,relative-beyond-top-level,too-many-public-methods
 """Test cases for the rabbitmq.log model in Odoo."""
 
 from datetime import datetime, timedelta
 from unittest.mock import patch
 
-from odoo import fields
 from odoo.tests.common import TransactionCase
+from ..models.rabbitmq_field_mapping import (PENDING_REFERENCES, REFERENCE_CACHE,
+                                              _publish_references, prefetch_references)
 from ..models.rabbitmq_log import convert_to_odoo_datetime
 
 
@@ -39,9 +40,24 @@ class TestRabibitLog(TransactionCase):
         dt2 = convert_to_odoo_datetime(now)
         self.assertEqual(dt2.replace(tzinfo=None), now.replace(tzinfo=None))
 
+        # Test epoch numbers, whatever their unit
+        expected = datetime(2025, 7, 23, 8, 0)
+        epochs = (1753257600, 1753257600000, 1753257600000000, 1753257600000000000, "1753257600")
+        for epoch in epochs:
+            self.assertEqual(convert_to_odoo_datetime(epoch), expected)
+        self.assertEqual(convert_to_odoo_datetime(12345), datetime(1970, 1, 1, 3, 25, 45))
+
+        # Test Firebase "Z" strings, offsets and serialized timestamps
+        self.assertEqual(convert_to_odoo_datetime("2025-07-23T08:00:00Z"), expected)
+        self.assertEqual(convert_to_odoo_datetime("2025-07-23T10:00:00+02:00"), expected)
+        self.assertEqual(
+            convert_to_odoo_datetime({"_seconds": 1753257600, "_nanoseconds": 500000000}),
+            expected.replace(microsecond=500000),
+        )
+
         # Test bad input raises ValueError
         with self.assertRaises(ValueError):
-            convert_to_odoo_datetime(12345)
+            convert_to_odoo_datetime([12345])
 
     def test_prepare_vals_datetime_conversion(self):
         """Test preparing values with datetime conversion."""
@@ -56,6 +72,70 @@ class TestRabibitLog(TransactionCase):
         self.assertIsInstance(converted["check_out"], datetime)
         self.assertEqual(converted["name"], "Test")
 
+    def test_prepare_vals_controller_datetime_fields(self):
+        """Test the controller's datetime fields are converted whatever the field type."""
+        controller = self.env["rabbitmq.consumer.controller"].create({
+            "queue": "datetime_queue",
+            "sync_model": self.env["ir.model"]._get_id("res.partner"),
+            "datetime_fields": "date, comment",
+        })
+        log = self.log_model.new({"controller_id": controller.id})
+        converted = log._prepare_vals({"date": 1753257600000, "comment": False})
+        self.assertEqual(converted["date"], datetime(2025, 7, 23, 8, 0))
+        self.assertFalse(converted["comment"])
+
+    def test_prepare_vals_mapping_plan(self):
+        """Test payloads are renamed, dropped and coerced by the controller's mapping plan."""
+        controller = self.env["rabbitmq.consumer.controller"].create({
+            "queue": "mapping_queue",
+            "sync_model": self.env["ir.model"]._get_id("res.partner"),
+            "field_mapping_ids": [
+                (0, 0, {"source_key": "full_name", "mode": "rename",
+                        "field_id": self.env["ir.model.fields"]._get("res.partner", "name").id}),
+                (0, 0, {"source_key": "email", "mode": "drop"}),
+            ],
+        })
+        country = self.env.ref("base.be")
+        log = self.log_model.new({"controller_id": controller.id})
+        converted = log._prepare_vals({
+            "full_name": "Mapped",
+            "email": "dropped@example.com",
+            "unknown_key": 1,
+            "record_id": 7,
+            "color": "3",
+            "active": "false",
+            "country_id": country.name,
+            "parent_id": [False, ""],
+        })
+        self.assertEqual(converted, {
+            "name": "Mapped",
+            "record_id": 7,
+            "color": 3,
+            "active": False,
+            "country_id": country.id,
+            "parent_id": False,
+        })
+
+        # Rule changes are picked up without restarting anything, and only
+        # the plan of this controller is dropped, not the registry caches
+        plan = controller._mapping_plan()
+        self.assertIs(controller._mapping_plan(), plan)
+        with patch.object(type(self.env.registry), "clear_cache") as mock_clear_cache:
+            controller.field_mapping_ids.filtered(lambda m: m.mode == "drop").unlink()
+        mock_clear_cache.assert_not_called()
+        self.assertIsNot(controller._mapping_plan(), plan)
+        self.assertIn("email", log._prepare_vals({"email": "kept@example.com"}))
+
+        # A value that cannot be coerced fails the log instead of reaching the ORM
+        failed = self.log_model.create({
+            "controller_id": controller.id,
+            "model_name": "res.partner",
+            "operation": "create",
+            "data": {"full_name": "Bad Color", "color": "red"},
+        })
+        failed.process_odoo_operation()
+        self.assertEqual(failed.state, "fail")
+
     def test_execute_operation_create_and_write(self):
         """Test executing create and write operations."""
         log = self.log_model.create(
@@ -98,10 +178,9 @@ class TestRabibitLog(TransactionCase):
             }
         )
 
-        # Patch the actual model class method, not the recordset
-        with patch(
-            "odoo.addons.base.models.res_partner.Partner.create",
-            side_effect=Exception("Boom"),
+        # Patch the registry class method, not the recordset
+        with patch.object(
+            type(self.env["res.partner"]), "create", side_effect=Exception("Boom"),
         ):
             result = log._execute_operation("create", log.data)
             self.assertFalse(result)
@@ -133,24 +212,60 @@ class TestRabibitLog(TransactionCase):
         self.assertFalse(result)
         self.assertEqual(invalid_log.state, "fail")
 
-    def test_cron_clean_successful_logs(self):
-        """Create some logs with 'success' state older than 2 days and recent logs"""
-        old_log = self.log_model.create(
-            {
-                "state": "success",
-                "data": {"name": "Old"},
-                "create_date": (
-                    fields.Datetime.to_string(datetime.utcnow() - timedelta(days=3))
-                ),
-            }
+    def test_process_odoo_operation_bulk(self):
+        """Test grouped bulk processing of create and write logs."""
+        partners = self.env["res.partner"].create([{"name": "P1"}, {"name": "P2"}])
+        logs = self.log_model.create(
+            [
+                {"model_name": "res.partner", "operation": "create", "data": {"name": "Bulk A"}},
+                {"model_name": "res.partner", "operation": "create", "data": {"name": "Bulk B"}},
+                {"model_name": "res.partner", "operation": "write",
+                 "data": {"record_id": partners[0].id, "city": "Yangon"}},
+                {"model_name": "res.partner", "operation": "write",
+                 "data": {"record_id": partners[1].id, "city": "Yangon"}},
+                {"model_name": "res.partner", "operation": "write",
+                 "data": {"record_id": partners[0].id, "city": "Mandalay"}},
+                {"model_name": "res.partner", "operation": "write",
+                 "data": {"record_id": 9999999, "city": "Nowhere"}},
+            ]
         )
-        recent_log = self.log_model.create(
-            {
-                "state": "success",
-                "data": {"name": "Recent"},
-                "create_date": fields.Datetime.to_string(datetime.utcnow()),
-            }
+        result = logs.process_odoo_operation()
+        self.assertFalse(result)
+        self.assertEqual(logs.mapped("state"), ["success"] * 5 + ["fail"])
+        self.assertEqual(
+            sorted(self.env["res.partner"].browse(logs[:2].mapped("record_id")).mapped("name")),
+            ["Bulk A", "Bulk B"],
+        )
+        # The later write on the same partner wins
+        self.assertEqual(partners.mapped("city"), ["Mandalay", "Yangon"])
+
+    def test_process_odoo_operation_bulk_fallback(self):
+        """Test a failing multi-create falls back to per-log processing."""
+        logs = self.log_model.create(
+            [
+                {"model_name": "res.partner", "operation": "create", "data": {"name": "Good"}},
+                {"model_name": "res.partner", "operation": "create", "data": {"name": False}},
+            ]
         )
+        logs.process_odoo_operation()
+        self.assertEqual(logs.mapped("state"), ["success", "fail"])
+        self.assertIn("Sync Error", logs[1].error)
+
+    def _backdate(self, log, days):
+        """Move the create_date of a log into the past."""
+        self.env.cr.execute(
+            "UPDATE rabbitmq_log SET create_date = %s WHERE id = %s",
+            (datetime.utcnow() - timedelta(days=days), log.id),
+        )
+        log.invalidate_recordset(["create_date"])
+
+    def test_cron_clean_successful_logs(self):
+        """Create some logs with 'success' state older than 2 days and recent logs"""
+        old_log = self.log_model.create({"state": "success", "data": {"name": "Old"}})
+        recent_log = self.log_model.create({"state": "success", "data": {"name": "Recent"}})
+        old_fail_log = self.log_model.create({"state": "fail", "data": {"name": "Old Fail"}})
+        self._backdate(old_log, 3)
+        self._backdate(old_fail_log, 3)
 
         # Call cron method
         self.log_model.cron_clean_successful_logs()
@@ -159,3 +274,208 @@ class TestRabibitLog(TransactionCase):
         self.assertFalse(old_log.exists())
         # Recent log should still exist
         self.assertTrue(recent_log.exists())
+        # Failed logs have a longer retention
+        self.assertTrue(old_fail_log.exists())
+
+    def test_cron_clean_logs_in_chunks(self):
+        """Test the cleanup deletes in chunks and honours the configured retention."""
+        logs = self.log_model.create([{"state": "fail", "data": {"n": n}} for n in range(5)])
+        for log in logs:
+            self._backdate(log, 10)
+        params = self.env["ir.config_parameter"].sudo()
+        params.set_param("rabbitmq_model_sync.retention_fail_days", 7)
+        params.set_param("rabbitmq_model_sync.retention_chunk_size", 2)
+
+        with patch.object(
+            type(self.log_model), "_delete_logs_before",
+            autospec=True, side_effect=type(self.log_model)._delete_logs_before,
+        ) as mock_delete:
+            self.log_model.cron_clean_successful_logs()
+        self.assertFalse(logs.exists())
+        fail_call = [call for call in mock_delete.call_args_list if call.args[1] == "fail"][0]
+        self.assertEqual(fail_call.args[3], 2)
+
+    def test_cron_archives_successful_logs(self):
+        """Test archive storage moves successful logs out of the hot table."""
+        params = self.env["ir.config_parameter"].sudo()
+        params.set_param("rabbitmq_model_sync.log_storage", "archive")
+        success_log = self.log_model.create({"state": "success", "data": {"name": "Archived"}})
+        fail_log = self.log_model.create({"state": "fail", "data": {"name": "Kept"}})
+        self._backdate(success_log, 1)
+        self._backdate(fail_log, 1)
+        success_id = success_log.id
+
+        self.log_model.cron_clean_successful_logs()
+
+        self.assertFalse(success_log.exists())
+        self.assertTrue(fail_log.exists())
+        archived = self.env["rabbitmq.log.archive"].browse(success_id)
+        self.assertTrue(archived.exists())
+        self.assertEqual(archived.data, {"name": "Archived"})
+
+    def test_drop_expired_archive_partitions(self):
+        """Test whole archive months past their retention are dropped."""
+        archive = self.env["rabbitmq.log.archive"]
+        archive._ensure_partitions(datetime(2024, 1, 15), datetime(2024, 2, 15))
+        dropped = archive._drop_partitions_before(datetime(2024, 2, 10))
+        self.assertEqual(dropped, ["rabbitmq_log_archive_p202401"])
+
+    def test_upsert_by_external_key(self):
+        """Test upserts match records on the controller's external key field."""
+        partner_model = self.env["ir.model"]._get("res.partner")
+        controller = self.env["rabbitmq.consumer.controller"].create(
+            {
+                "queue": "upsert_queue",
+                "sync_model": partner_model.id,
+                "external_key_field_id": self.env["ir.model.fields"]._get("res.partner", "ref").id,
+            }
+        )
+        existing = self.env["res.partner"].create({"name": "Known", "ref": "EMP-1"})
+        logs = self.log_model.create(
+            [
+                {"model_name": "res.partner", "operation": "upsert", "controller_id": controller.id,
+                 "data": {"ref": "EMP-1", "name": "Known Updated"}},
+                {"model_name": "res.partner", "operation": "upsert", "controller_id": controller.id,
+                 "data": {"ref": "EMP-2", "name": "New"}},
+                {"model_name": "res.partner", "operation": "upsert", "controller_id": controller.id,
+                 "data": {"ref": "EMP-2", "city": "Yangon"}},
+                {"model_name": "res.partner", "operation": "upsert", "controller_id": controller.id,
+                 "data": {"name": "No Key"}},
+            ]
+        )
+        logs.process_odoo_operation()
+
+        self.assertEqual(logs.mapped("state"), ["success", "success", "success", "fail"])
+        self.assertEqual(logs[0].record_id, existing.id)
+        self.assertEqual(existing.name, "Known Updated")
+        created = self.env["res.partner"].search([("ref", "=", "EMP-2")])
+        self.assertEqual(len(created), 1)
+        self.assertEqual((created.name, created.city), ("New", "Yangon"))
+
+        # A replay of the same message is idempotent
+        replay = self.log_model.create(
+            {"model_name": "res.partner", "operation": "upsert", "controller_id": controller.id,
+             "data": {"ref": "EMP-2", "name": "New"}}
+        )
+        replay.process_odoo_operation()
+        self.assertEqual(replay.record_id, created.id)
+        self.assertEqual(self.env["res.partner"].search_count([("ref", "=", "EMP-2")]), 1)
+
+    def test_normalize_external_key(self):
+        """Test external keys are coerced to the key field type and bad integers rejected."""
+        partners = self.env["res.partner"]
+        self.assertEqual(self.log_model._normalize_external_key(partners, "ref", 42), "42")
+        self.assertEqual(self.log_model._normalize_external_key(partners, "color", "7"), 7)
+        self.assertEqual(self.log_model._normalize_external_key(partners, "color", 7.0), 7)
+        for key in ("EMP-1", 2.5, True, [7]):
+            with self.assertRaises(ValueError):
+                self.log_model._normalize_external_key(partners, "color", key)
+
+    def test_retry_failed_logs_in_chunks(self):
+        """Test the retry engine re-runs failed logs chunk by chunk once their payload is fixed."""
+        logs = self.log_model.create(
+            [
+                {
+                    "state": "fail",
+                    "operation": "create",
+                    "model_name": "res.partner",
+                    "queue_name": "retry_queue",
+                    "data": {"name": False},
+                }
+                for _n in range(5)
+            ]
+        )
+        logs[:4].write({"data": {"name": "Replayed"}})
+        self.env["ir.config_parameter"].sudo().set_param("rabbitmq_model_sync.retry_chunk_size", 2)
+
+        with patch.object(type(self.env["ir.cron"]), "_notify_progress") as mock_progress:
+            succeeded, failed = self.log_model.cron_retry_failed_logs(
+                [("queue_name", "=", "retry_queue")]
+            )
+
+        self.assertEqual((succeeded, failed), (4, 1))
+        self.assertEqual(mock_progress.call_count, 3)
+        mock_progress.assert_called_with(done=5, remaining=0)
+        self.assertEqual(logs.mapped("state"), ["success"] * 4 + ["fail"])
+        self.assertEqual(self.env["res.partner"].search_count([("name", "=", "Replayed")]), 4)
+
+    def test_action_retry_sync_skips_successful_logs(self):
+        """Test the retry action only replays logs that did not succeed."""
+        done = self.log_model.create({"state": "success", "operation": "create",
+                                      "model_name": "res.partner", "data": {"name": "Done"}})
+        failed = self.log_model.create({"state": "fail", "operation": "create",
+                                        "model_name": "res.partner", "data": {"name": "Again"}})
+        action = (done | failed).action_retry_sync()
+        self.assertEqual(action["params"]["type"], "success")
+        self.assertEqual(failed.state, "success")
+        self.assertFalse(self.env["res.partner"].search([("name", "=", "Done")]))
+
+    def test_lookup_references_prefetched_and_invalidated(self):
+        """Test lookup rules resolve references per batch, cached once the transaction commits."""
+        employee = self.env["hr.employee"].create({"name": "Coded", "barcode": "EMP-42"})
+        controller = self.env["rabbitmq.consumer.controller"].create({
+            "queue": "lookup_queue",
+            "sync_model": self.env["ir.model"]._get_id("hr.attendance"),
+            "field_mapping_ids": [(0, 0, {
+                "source_key": "employee_code",
+                "mode": "lookup",
+                "field_id": self.env["ir.model.fields"]._get("hr.attendance", "employee_id").id,
+                "lookup_field_id": self.env["ir.model.fields"]._get("hr.employee", "barcode").id,
+            })],
+        })
+        logs = self.log_model.create([
+            {"controller_id": controller.id, "model_name": "hr.attendance", "operation": "create",
+             "data": {"employee_code": "EMP-42", "check_in": f"2025-07-2{day}T08:00:00Z"}}
+            for day in (1, 2)
+        ])
+        key = (self.env.cr.dbname, "hr.employee", "barcode", "EMP-42")
+        REFERENCE_CACHE.pop(key)
+        self.addCleanup(self.env.cr.postcommit.data.pop, PENDING_REFERENCES, None)
+        controller._mapping_plan().prefetch(self.env, logs.mapped("data"))
+
+        # The employee is not committed: only this transaction sees its id
+        self.assertNotIn(key, REFERENCE_CACHE)
+        pending = self.env.cr.postcommit.data[PENDING_REFERENCES]
+        self.assertEqual(pending[key], employee.id)
+
+        logs.process_odoo_operation()
+        self.assertEqual(logs.mapped("state"), ["success", "success"])
+        self.assertEqual(
+            self.env["hr.attendance"].browse(logs.mapped("record_id")).employee_id, employee
+        )
+
+        # The commit shares the resolved ids with the process; a rule change drops them
+        _publish_references(pending)
+        self.assertEqual(REFERENCE_CACHE.get(key), employee.id)
+        controller.field_mapping_ids.write({"sequence": 5})
+        self.assertNotIn(key, REFERENCE_CACHE)
+
+        log = self.log_model.new({"controller_id": controller.id})
+        with self.assertRaises(ValueError):
+            log._prepare_vals({"employee_code": "EMP-404"})
+
+    def test_cached_references_revalidated_per_batch(self):
+        """Test a cached reference whose record was written or deleted is looked up again."""
+        old, new = self.env["hr.employee"].create([
+            {"name": "Previous Holder", "barcode": "EMP-77"},
+            {"name": "Next Holder"},
+        ])
+        key = (self.env.cr.dbname, "hr.employee", "barcode", "EMP-77")
+        self.addCleanup(REFERENCE_CACHE.pop, key)
+        self.addCleanup(self.env.cr.postcommit.data.pop, PENDING_REFERENCES, None)
+        REFERENCE_CACHE.set(key, old.id)
+
+        # The barcode moves to another employee: the cached id is not used
+        old.barcode = False
+        new.barcode = "EMP-77"
+        self.env.flush_all()
+        prefetch_references(self.env, "hr.employee", "barcode", ["EMP-77"])
+        self.assertNotIn(key, REFERENCE_CACHE)
+        self.assertEqual(self.env.cr.postcommit.data[PENDING_REFERENCES][key], new.id)
+
+        # A deleted record is dropped and its value no longer resolves
+        _publish_references(self.env.cr.postcommit.data.pop(PENDING_REFERENCES))
+        new.unlink()
+        prefetch_references(self.env, "hr.employee", "barcode", ["EMP-77"])
+        self.assertNotIn(key, REFERENCE_CACHE)
+        self.assertNotIn(key, self.env.cr.postcommit.data.get(PENDING_REFERENCES, {}))
@@ -0,0 +1,82 @@
+# pylint: disable=protected-access,line-too-long,import-error
+"""Test cases for the per-database RegistryHandle."""
+from unittest.mock import MagicMock, patch
+
+from odoo.tests.common import BaseCase
+
+from odoo.addons.rabbitmq_model_sync.utils.registry_handle import RegistryHandle
+
+REGISTRY_PATH = "odoo.addons.rabbitmq_model_sync.utils.registry_handle.modules.registry.Registry"
+
+
+class TestRegistryHandle(BaseCase):
+    """Test cases for RegistryHandle."""
+
+    def setUp(self):  # pylint: disable=invalid-name
+        """Set up the test environment."""
+        self.fake_registry = MagicMock()
+        self.fake_registry.check_signaling.return_value = self.fake_registry
+        self.fake_registry.cursor.side_effect = lambda: MagicMock(closed=False)
+        env_patcher = patch(
+            "odoo.addons.rabbitmq_model_sync.utils.registry_handle.api.Environment",
+            side_effect=lambda cr, uid, context: MagicMock(cr=cr),
+        )
+        env_patcher.start()
+        self.addCleanup(env_patcher.stop)
+
+    def test_get_returns_shared_handle(self):
+        """The same handle is returned for the same database."""
+        self.assertIs(RegistryHandle.get("bench_db"), RegistryHandle.get("bench_db"))
+
+    @patch(REGISTRY_PATH)
+    def test_lease_reuses_cursor(self, mock_registry_cls):
+        """Consecutive leases on one thread reuse the same cursor."""
+        mock_registry_cls.return_value = self.fake_registry
+        handle = RegistryHandle("test_db")
+        with handle.lease() as env1:
+            pass
+        with handle.lease() as env2:
+            pass
+        self.assertIs(env1.cr, env2.cr)
+        self.fake_registry.cursor.assert_called_once()
+        mock_registry_cls.assert_called_once_with("test_db")
+
+    @patch(REGISTRY_PATH)
+    def test_lease_renewed_after_max_uses(self, mock_registry_cls):
+        """A worn-out lease is closed and replaced by a fresh cursor."""
+        mock_registry_cls.return_value = self.fake_registry
+        handle = RegistryHandle("test_db", max_uses=1)
+        with handle.lease() as env1:
+            pass
+        with handle.lease() as env2:
+            pass
+        self.assertIsNot(env1.cr, env2.cr)
+        env1.cr.close.assert_called_once()
+
+    @patch(REGISTRY_PATH)
+    def test_lease_dropped_on_error(self, mock_registry_cls):
+        """An error inside the lease rolls back and discards the cursor."""
+        mock_registry_cls.return_value = self.fake_registry
+        handle = RegistryHandle("test_db")
+        with self.assertRaises(ValueError):
+            with handle.lease() as env:
+                raise ValueError("boom")
+        env.cr.rollback.assert_called_once()
+        env.cr.close.assert_called_once()
+        self.assertIsNone(handle._local.lease)
+
+    @patch(REGISTRY_PATH)
+    def test_registry_reload_invalidates_lease(self, mock_registry_cls):
+        """A reloaded registry makes the next lease open a new cursor."""
+        mock_registry_cls.return_value = self.fake_registry
+        handle = RegistryHandle("test_db", signal_interval=0)
+        with handle.lease() as env1:
+            pass
+        reloaded = MagicMock()
+        reloaded.cursor.side_effect = lambda: MagicMock(closed=False)
+        self.fake_registry.check_signaling.return_value = reloaded
+        with handle.lease() as env2:
+            pass
+        self.assertIsNot(env1.cr, env2.cr)
+        env1.cr.close.assert_called_once()
+        reloaded.cursor.assert_called_once()
@@ -1,10 +1,15 @@
-#pylint:disable=import-error
+#pylint:disable=import-error,relative-beyond-top-level,too-many-locals,too-many-public-methods
 """"Asyncio Consumer for RabbitMQ"""
 import asyncio
+import itertools
 import logging
 import os
 # import ssl
+import threading
 import time
+from collections import defaultdict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from pathlib import Path
 
 import pika
@@ -14,6 +19,10 @@ from pika.exceptions import (AMQPChannelError, AMQPConnectionError,
                              ChannelClosedByBroker)
 from pika.exchange_type import ExchangeType
 
+from .backoff import (DEFAULT_BASE_DELAY, DEFAULT_FAILURE_THRESHOLD, DEFAULT_MAX_DELAY, Backoff,
+                      CircuitBreaker, HostRotation)
+from .decoders import BodyPreview
+
 DEFAULT_FILE_NAME = ".env"
 DEFAULT_DIR = "rabbitmq_model_sync"
 
@@ -36,19 +45,109 @@ def get_rabbitmq_config(file_name=DEFAULT_FILE_NAME):
     config_path = get_file_path(file_name)
     return dotenv_values(config_path)
 
+
+@lru_cache(maxsize=1)
+def default_connection_parameters():
+    """Connection parameters from the module's .env file, for consumers without a broker record.
+
+    Read on first use and cached for the life of the process.
+    """
+    config = get_rabbitmq_config()
+    missing = [key for key in ("host", "port", "user", "password") if not config.get(key)]
+    if missing:
+        raise ValueError(
+            f"No broker set on the consumer and no {', '.join(missing)} in {get_file_path()}."
+        )
+    credentials = pika.PlainCredentials(config["user"], config["password"])
+    # context = ssl.create_default_context()
+    return (
+        pika.ConnectionParameters(
+            host=config["host"],
+            port=int(config["port"]),
+            virtual_host=config.get("virtual_host") or "/",
+            credentials=credentials,
+            # ssl_options=pika.SSLOptions(context),
+            heartbeat=30,
+            blocked_connection_timeout=300,
+        ),
+    )
+
 LOGGER = logging.getLogger(__name__)
 
-# pylint: disable=too-many-instance-attributes,too-many-arguments
+Delivery = namedtuple("Delivery", "method properties body")
+
+# Outcomes a message or batch callback returns for each delivery
+ACK = "ack"        # processed, or recorded as a failed log: remove it from the queue
+RETRY = "retry"    # transient failure: redeliver after a delay
+REJECT = "reject"  # permanent failure with nothing recorded: dead-letter it
+
+# Errors a callback raises for a bad message rather than a passing condition:
+# retrying would fail the same way, so the message is rejected at once
+DETERMINISTIC_ERRORS = (ValueError, TypeError, LookupError)
+
+ATTEMPTS_HEADER = "x-attempts"
+MAX_RETRY_DELAY_MS = 10 * 60 * 1000
+# Seconds a connection must keep consuming before it counts as recovered
+STABLE_CONNECTION_SECONDS = 30
+
+# pylint: disable=too-many-instance-attributes,too-many-arguments,too-many-positional-arguments
 class AsyncAttendanceConsumer:
     """Asyncio Consumer for RabbitMQ"""
-    RABBITMQ_CONFIG = get_rabbitmq_config()
     EXCHANGE = ""
     EXCHANGE_TYPE = ExchangeType.direct
     # QUEUE = QUEUE_NAME
-    ROUTING_KEY = RABBITMQ_CONFIG["queue"]
 
-    def __init__(self, exchange_name, exchange_type, queue_name, message_callback=None):
+    def __init__(
+        self,
+        exchange_name,
+        exchange_type,
+        queue_name,
+        message_callback=None,
+        batch_callback=None,
+        batch_size=1,
+        batch_linger_ms=0,
+        prefetch_count=0,
+        prefetch_size=0,
+        max_in_flight=0,
+        worker_count=0,
+        worker_finalizer=None,
+        connection_manager=None,
+        max_attempts=5,
+        retry_delay_ms=1000,
+        dead_letter_exchange=None,
+        dead_letter_routing_key=None,
+        metrics=None,
+        connection_parameters=None,
+    ):
         self.message_callback = message_callback
+        # Hosts of the broker in failover order; the .env broker is read on connect
+        self._hosts = HostRotation(connection_parameters) if connection_parameters else None
+        self.metrics = metrics
+        self.max_attempts = max(max_attempts, 1)
+        self.retry_delay_ms = retry_delay_ms
+        self.dead_letter_exchange = dead_letter_exchange
+        self.dead_letter_routing_key = dead_letter_routing_key
+        self._manager = connection_manager
+        # One single-threaded lane per worker keeps per-key ordering
+        self._lanes = [
+            ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"rabbitmq-{queue_name}-{index}")
+            for index in range(worker_count)
+        ]
+        self._worker_finalizer = worker_finalizer
+        self._round_robin = itertools.count()
+        self.prefetch_count = prefetch_count
+        self.prefetch_size = prefetch_size
+        self.max_in_flight = max_in_flight
+        self._in_flight = 0
+        self._paused = False
+        self._consumer_tag = None
+        self.batch_callback = batch_callback
+        self.batch_size = max(batch_size, 1)
+        self.batch_linger_ms = batch_linger_ms
+        self._batch = []
+        self._batch_channel = None
+        self._linger_handle = None
+        self._loop = None
         self._queue = queue_name
         self._exchange_name = exchange_name
         self._exchange_type = exchange_type
@@ -58,23 +157,23 @@ class AsyncAttendanceConsumer:
         self._consuming = False
         self.should_reconnect = False
         self.was_consuming = False
+        self.consuming_since = None
+        # Called on the I/O loop each time consuming starts
+        self.on_consuming = None
+        # Consumer slot of the controller run by this consumer, set by the controller
+        self.slot = None
+
+    @property
+    def in_flight(self):
+        """Deliveries received and not yet settled."""
+        return self._in_flight
 
     def connect(self):
-        """Connect to RabbitMQ server."""
-        credentials = pika.PlainCredentials(
-            self.RABBITMQ_CONFIG["user"], self.RABBITMQ_CONFIG["password"]
-        )
-        # context = ssl.create_default_context()
-        parameters = pika.ConnectionParameters(
-            host=self.RABBITMQ_CONFIG["host"],
-            port=self.RABBITMQ_CONFIG["port"],
-            virtual_host="/",
-            credentials=credentials,
-            # ssl_options=pika.SSLOptions(context),
-            heartbeat=30,
-            blocked_connection_timeout=300,
-        )
-        LOGGER.info("Connecting to RabbitMQ...")
+        """Connect to the current host of the broker."""
+        if self._hosts is None:
+            self._hosts = HostRotation(default_connection_parameters())
+        parameters = self._hosts.current
+        LOGGER.info("Connecting to RabbitMQ at %s:%s...", parameters.host, parameters.port)
         return AsyncioConnection(
             parameters=parameters,
             on_open_callback=self.on_connection_open,
@@ -85,22 +184,56 @@ class AsyncAttendanceConsumer:
     def on_connection_open(self, connection):
         """Open a channel when the connection is opened."""
         LOGGER.info("Connection opened")
+        self._hosts.connected()
         self._connection = connection
         self.open_channel()
 
     def on_connection_open_error(self, _, error):
-        """Stop the consumer if connection open fails."""
+        """Leave the loop to reconnect if connection open fails."""
         LOGGER.error("Connection open failed: %s", error)
+        if self._hosts.fail_over() and not self._closing:
+            # Another host of the cluster is untried: connect to it without backing off
+            self._loop.call_soon(self._fail_over)
+            return
         self.should_reconnect = True
-        self.stop()
+        self._halt()
+
+    def _fail_over(self):
+        if not self._closing:
+            self._connection = self.connect()
 
     def on_connection_closed(self, _, reason):
-        """Close the channel and stop consuming when the connection is closed."""
+        """Close the channel and leave the loop to reconnect when the connection is closed."""
         LOGGER.warning("Connection closed: %s", reason)
         self._channel = None
         if not self._closing:
+            # The node may be gone: reconnect to the next host after the backoff
+            self._hosts.fail_over()
             self.should_reconnect = True
-            self.stop()
+            self._halt()
+
+    def _halt(self):
+        """Leave the I/O loop after a connection failure.
+
+        The loop and the lanes are kept for the reconnect.
+        """
+        self.stop_consuming()
+        self._consuming = False
+        if self._connection:
+            self._connection.ioloop.stop()
+
+    def attach(self, connection):
+        """Open this consumer's channel on a shared connection (called on its I/O loop)."""
+        self._connection = connection
+        self._loop = connection.ioloop
+        if not self._closing:
+            self.open_channel()
+
+    def detach(self):
+        """Forget the channel after the shared connection was lost."""
+        self._channel = None
+        self._consuming = False
+        self._drop_batch()
 
     def open_channel(self):
         """Open a channel for the connection."""
@@ -111,8 +244,21 @@ class AsyncAttendanceConsumer:
         """Callback when the channel is opened."""
         LOGGER.info("Channel opened")
         self._channel = channel
+        self._channel.add_on_close_callback(self.on_channel_closed)
         self.setup_queue(self._queue)
 
+    def on_channel_closed(self, channel, reason):
+        """Recover from a channel closed by the broker."""
+        LOGGER.warning("Channel %s was closed: %s", channel, reason)
+        self.detach()
+        if self._closing:
+            return
+        if self._manager:
+            self._manager.reopen_channel(self)
+        elif self._connection and self._connection.is_open:
+            # Closing the dedicated connection triggers a reconnect
+            self._connection.close()
+
     def setup_queue(self, queue_name):
         """Declare the queue and bind it to the exchange."""
         LOGGER.info("Declaring queue: %s", queue_name)
@@ -120,79 +266,398 @@ class AsyncAttendanceConsumer:
             queue=queue_name, durable=True, callback=self.on_queue_declareok
         )
 
+    def retry_delay(self, attempt):
+        """Delay in ms before retry number ``attempt``, doubling per attempt."""
+        return min(self.retry_delay_ms * 2 ** (attempt - 1), MAX_RETRY_DELAY_MS)
+
+    def retry_queue(self, attempt):
+        """Name of the delay queue holding messages waiting for retry number ``attempt``."""
+        return f"{self._queue}.retry.{self.retry_delay(attempt)}"
+
     def on_queue_declareok(self, _):
+        """Declare the retry delay queues, then apply prefetch limits or start consuming."""
+        if self.max_attempts > 1 and self.retry_delay_ms > 0:
+            # Messages wait in a per-delay queue until their TTL expires and
+            # are then dead-lettered back onto the work queue.
+            tiers = sorted({self.retry_delay(attempt) for attempt in range(1, self.max_attempts)})
+            for index, delay in enumerate(tiers):
+                self._channel.queue_declare(
+                    queue=f"{self._queue}.retry.{delay}",
+                    durable=True,
+                    arguments={
+                        "x-message-ttl": delay,
+                        "x-dead-letter-exchange": "",
+                        "x-dead-letter-routing-key": self._queue,
+                    },
+                    callback=self.on_retry_queues_declareok if index == len(tiers) - 1 else None,
+                )
+            return
+        self.on_retry_queues_declareok(None)
+
+    def on_retry_queues_declareok(self, _):
         """Start consuming with declared queue"""
+        if self.prefetch_count or self.prefetch_size:
+            LOGGER.info(
+                "Queue declared, setting prefetch count=%s size=%s...",
+                self.prefetch_count, self.prefetch_size,
+            )
+            self._channel.basic_qos(
+                prefetch_size=self.prefetch_size,
+                prefetch_count=self.prefetch_count,
+                callback=self.on_basic_qos_ok,
+            )
+            return
         LOGGER.info("Queue declared, starting to consume...")
         self.start_consuming()
 
+    def on_basic_qos_ok(self, _):
+        """Start consuming once the prefetch limits are applied."""
+        LOGGER.info("QOS set, starting to consume...")
+        self.start_consuming()
+
     def start_consuming(self):
         """Start consuming from provided queue"""
         if not self._consuming:
-            self._channel.basic_consume(
+            self._consumer_tag = self._channel.basic_consume(
                 queue=self._queue, on_message_callback=self.on_message
             )
             self.was_consuming = True
             self._consuming = True
+            self.consuming_since = time.monotonic()
             LOGGER.info("Started consuming")
+            if self.on_consuming:
+                self.on_consuming()
 
     def stop_consuming(self):
         """Stop consuming messages from the queue."""
-        if self._consuming and self._channel:
+        self._drop_batch()
+        if self._channel and self._channel.is_open:
             LOGGER.info("Stopping consuming")
             self._channel.close()
             self._consuming = False
 
     def on_message(self, channel, method, properties, body):
         """Received queue message callback."""
-        LOGGER.info("Received message: %s", body.decode())
-        # Pass all message info to the callback
-        if self.message_callback:
-            self.message_callback(method, properties, body)
-        channel.basic_ack(method.delivery_tag)
+        LOGGER.debug("Received message %s: %s", method.delivery_tag, BodyPreview(body))
+        if self.metrics:
+            self.metrics.record_received()
+        self._in_flight += 1
+        self._maybe_pause()
+        delivery = Delivery(method, properties, body)
+        if self.batch_callback and self.batch_size > 1:
+            self._buffer_delivery(channel, delivery)
+            return
+        self._dispatch(channel, [delivery])
+
+    def _dispatch(self, channel, deliveries):
+        """Process deliveries inline, or hand them to the worker lanes by ordering key."""
+        if not self._lanes:
+            self._settle(channel, deliveries, self._process(deliveries))
+            return
+        lanes = defaultdict(list)
+        for delivery in deliveries:
+            lanes[self._lane_index(delivery)].append(delivery)
+        for index, lane_deliveries in lanes.items():
+            self._lanes[index].submit(self._process_in_worker, channel, lane_deliveries)
+
+    def _lane_index(self, delivery):
+        """Pick the worker lane of a delivery without decoding its body.
+
+        Deliveries with the same ``record_id`` header share a lane, and so do
+        deliveries with the same routing key when the publisher partitions on
+        it (a routing key other than the queue name). Other deliveries are
+        spread round-robin; the body is decoded once, by the worker.
+        """
+        key = (delivery.properties.headers or {}).get("record_id")
+        if key is None:
+            routing_key = getattr(delivery.method, "routing_key", None)
+            key = routing_key if routing_key and routing_key != self._queue else None
+        if key is None:
+            return next(self._round_robin) % len(self._lanes)
+        return hash(str(key)) % len(self._lanes)
+
+    def _process(self, deliveries):
+        """Run the batch or message callback and return one outcome per delivery.
+
+        A callback may return one outcome per delivery or a single outcome for
+        all of them; any other return value (e.g. None) means every delivery
+        succeeded. A callback that raises one of DETERMINISTIC_ERRORS has its
+        deliveries rejected; any other exception has them retried.
+        """
+        try:
+            if len(deliveries) > 1 or (self.batch_callback and self.batch_size > 1):
+                outcomes = self.batch_callback(deliveries)
+            elif self.message_callback:
+                outcomes = self.message_callback(*deliveries[0])
+            else:
+                outcomes = None
+        except DETERMINISTIC_ERRORS:
+            LOGGER.exception("Rejecting %d RabbitMQ message(s) that cannot be processed",
+                             len(deliveries))
+            outcomes = REJECT
+        except Exception:  # pylint: disable=broad-except
+            LOGGER.exception("Error processing %d RabbitMQ message(s)", len(deliveries))
+            outcomes = RETRY
+        if isinstance(outcomes, (list, tuple)):
+            return list(outcomes)
+        return [outcomes if outcomes in (ACK, RETRY, REJECT) else ACK] * len(deliveries)
+
+    def _process_in_worker(self, channel, deliveries):
+        """Worker thread: process deliveries and post their settlement back to the I/O loop."""
+        if self._closing:
+            # Left unacked, the broker redelivers them after the reconnect
+            return
+        outcomes = self._process(deliveries)
+        self._loop.call_soon_threadsafe(self._settle, channel, deliveries, outcomes)
+
+    def _settle(self, channel, deliveries, outcomes):
+        """Ack, retry or dead-letter processed deliveries on the I/O loop thread."""
+        if self._lanes and not channel.is_open:
+            return
+        if all(outcome == ACK for outcome in outcomes) and len(deliveries) > 1 and not self._lanes:
+            channel.basic_ack(deliveries[-1].method.delivery_tag, multiple=True)
+        else:
+            # Lanes finish out of order, so a multiple ack could cover
+            # deliveries another lane is still processing.
+            for delivery, outcome in zip(deliveries, outcomes):
+                if outcome == RETRY:
+                    self._retry(channel, delivery)
+                elif outcome == REJECT:
+                    self._dead_letter(channel, delivery, "rejected")
+                else:
+                    channel.basic_ack(delivery.method.delivery_tag)
+        if self.metrics:
+            self.metrics.record_outcomes(
+                acked=outcomes.count(ACK),
+                retried=outcomes.count(RETRY),
+                rejected=outcomes.count(REJECT),
+            )
+        self._on_settled(len(deliveries))
+
+    @staticmethod
+    def _republish_properties(properties, attempts):
+        """Copy a delivery's properties for republishing, with the attempt count header."""
+        headers = dict(properties.headers or {})
+        headers[ATTEMPTS_HEADER] = attempts
+        return pika.BasicProperties(
+            content_type=properties.content_type,
+            content_encoding=properties.content_encoding,
+            headers=headers,
+            delivery_mode=2,
+            correlation_id=properties.correlation_id,
+            message_id=properties.message_id,
+            timestamp=properties.timestamp,
+            type=properties.type,
+            app_id=properties.app_id,
+        )
+
+    def _retry(self, channel, delivery):
+        """Park a failed delivery in its delay queue, or dead-letter it after the last attempt."""
+        attempts = int((delivery.properties.headers or {}).get(ATTEMPTS_HEADER, 0)) + 1
+        if attempts >= self.max_attempts or self.retry_delay_ms <= 0:
+            self._dead_letter(channel, delivery, f"failed after {attempts} attempt(s)")
+            return
+        LOGGER.info(
+            "Retrying message %s in %d ms (attempt %d/%d)",
+            delivery.method.delivery_tag, self.retry_delay(attempts), attempts + 1,
+            self.max_attempts,
+        )
+        channel.basic_publish(
+            exchange="",
+            routing_key=self.retry_queue(attempts),
+            body=delivery.body,
+            properties=self._republish_properties(delivery.properties, attempts),
+        )
+        channel.basic_ack(delivery.method.delivery_tag)
+
+    def _dead_letter(self, channel, delivery, reason):
+        """Route a delivery to the dead-letter exchange, or reject it without requeue."""
+        LOGGER.warning("Dead-lettering message %s: %s", delivery.method.delivery_tag, reason)
+        if not self.dead_letter_exchange:
+            # Falls through to the queue's own dead-letter policy, if any
+            channel.basic_nack(delivery.method.delivery_tag, requeue=False)
+            return
+        attempts = int((delivery.properties.headers or {}).get(ATTEMPTS_HEADER, 0)) + 1
+        channel.basic_publish(
+            exchange=self.dead_letter_exchange,
+            routing_key=self.dead_letter_routing_key or self._queue,
+            body=delivery.body,
+            properties=self._republish_properties(delivery.properties, attempts),
+        )
+        channel.basic_ack(delivery.method.delivery_tag)
+
+    def _maybe_pause(self):
+        """Stop deliveries while the in-flight window is full."""
+        if (
+            self.max_in_flight
+            and not self._paused
+            and self._in_flight >= self.max_in_flight
+            and self._channel
+            and self._consumer_tag
+        ):
+            LOGGER.info("In-flight window full (%d), pausing consumption", self._in_flight)
+            self._channel.basic_cancel(self._consumer_tag)
+            self._paused = True
+
+    def _on_settled(self, count):
+        """Release settled deliveries from the window, resuming at the low watermark."""
+        self._in_flight = max(self._in_flight - count, 0)
+        if self._paused and self._in_flight <= self.max_in_flight // 2:
+            self._paused = False
+            if self._consuming and self._channel:
+                LOGGER.info("In-flight window drained (%d), resuming consumption", self._in_flight)
+                self._consumer_tag = self._channel.basic_consume(
+                    queue=self._queue, on_message_callback=self.on_message
+                )
+
+    def _buffer_delivery(self, channel, delivery):
+        """Collect a delivery, flushing when the batch is full or has lingered long enough."""
+        self._batch_channel = channel
+        self._batch.append(delivery)
+        if len(self._batch) >= self.batch_size:
+            self.flush_batch()
+        elif self._linger_handle is None and self._loop is not None:
+            self._linger_handle = self._loop.call_later(
+                self.batch_linger_ms / 1000.0, self.flush_batch
+            )
+
+    def flush_batch(self):
+        """Hand the buffered deliveries to the batch callback and ack them at once."""
+        if self._linger_handle is not None:
+            self._linger_handle.cancel()
+            self._linger_handle = None
+        batch, self._batch = self._batch, []
+        if not batch:
+            return
+        self._dispatch(self._batch_channel, batch)
+
+    def _drop_batch(self):
+        """Forget unacked buffered deliveries; the broker redelivers them."""
+        if self._linger_handle is not None:
+            self._linger_handle.cancel()
+            self._linger_handle = None
+        self._batch = []
+        self._in_flight = 0
+        self._paused = False
 
     def stop(self):
         """Stop the consumer."""
         if not self._closing:
             self._closing = True
             LOGGER.info("Stopping")
+            if self._manager:
+                # The shared loop closes the channel; the connection stays up
+                self._manager.unregister(self)
+                self._shutdown_lanes()
+                LOGGER.info("Stopped")
+                return
             self.stop_consuming()
+            self._shutdown_lanes()
             if self._connection:
                 self._connection.ioloop.stop()
             LOGGER.info("Stopped")
 
+    def _shutdown_lanes(self):
+        """Let every worker lane run the finalizer, then shut the lanes down."""
+        for lane in self._lanes:
+            if self._worker_finalizer:
+                lane.submit(self._worker_finalizer)
+            lane.shutdown(wait=False)
+
     def start(self):
-        """Start the consumer."""
+        """Start the consumer.
+
+        With a connection manager this only registers the consumer and returns;
+        otherwise it runs its own connection and event loop until stopped.
+        """
         self._closing = False
         self.should_reconnect = False
         self.was_consuming = False
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
+        self._consuming = False
+        self.consuming_since = None
+        if self._manager:
+            # A manager closing after its last consumer left hands over to a new one
+            self._manager = self._manager.register(self)
+            return
+        # A reconnect runs on the loop of the previous connection
+        if self._loop is None or self._loop.is_closed():
+            self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
         self._connection = self.connect()
-        loop.run_forever()
+        self._loop.run_forever()
+
+    def close_loop(self):
+        """Close the event loop of a stopped consumer with its own connection."""
+        if self._manager or self._loop is None or self._loop.is_running() or self._loop.is_closed():
+            return
+        self._loop.close()
 
 
 class ReconnectingAsyncAttendanceConsumer:
-    """Reconnecting Asyncio Consumer for RabbitMQ"""
-    def __init__(self, exchange_name, exchange_type, queue_name, message_callback=None):
-        self._reconnect_delay = 0
+    """Reconnecting Asyncio Consumer for RabbitMQ
+
+    The same consumer reconnects on its event loop after each failure, waiting
+    an exponential backoff with decorrelated jitter. After ``failure_threshold``
+    failed connections in a row the circuit breaker opens: reconnects are then
+    spaced by ``reconnect_max_delay`` and the consumer reports degraded through
+    ``health_callback(consumer, health)`` until a connection is stable again.
+    """
+    def __init__(
+        self,
+        exchange_name,
+        exchange_type,
+        queue_name,
+        message_callback=None,
+        reconnect_base_delay=DEFAULT_BASE_DELAY,
+        reconnect_max_delay=DEFAULT_MAX_DELAY,
+        failure_threshold=DEFAULT_FAILURE_THRESHOLD,
+        health_callback=None,
+        **options,
+    ):
+        self._backoff = Backoff(reconnect_base_delay, reconnect_max_delay)
+        self._breaker = CircuitBreaker(
+            failure_threshold, reconnect_max_delay, on_change=self._on_health_change
+        )
+        self.health_callback = health_callback
         self._consumer = AsyncAttendanceConsumer(
-            exchange_name, exchange_type, queue_name, message_callback
+            exchange_name, exchange_type, queue_name, message_callback, **options
         )
+        self._consumer.on_consuming = self._on_consuming
         self._running = False
-
-    def run(self):
-        """Run the consumer in a loop, reconnecting on failure."""
+        self._stop_requested = threading.Event()
+        self.slot = None
+
+    @property
+    def in_flight(self):
+        """Deliveries received by the current connection and not yet settled."""
+        return self._consumer.in_flight
+
+    @property
+    def health(self):
+        """HEALTHY, or DEGRADED while the circuit breaker is open."""
+        return self._breaker.health
+
+    def run(self, start_delay=0):
+        """Run the consumer in a loop, reconnecting on failure.
+
+        With ``start_delay`` (seconds), the first connection waits that long
+        unless the consumer is stopped in the meantime.
+        """
+        if start_delay and self._stop_requested.wait(start_delay):
+            return
         self._running = True
-        while self._running:
+        while self._running and not self._stop_requested.is_set():
             try:
                 self._consumer.start()
             except (AMQPConnectionError, ChannelClosedByBroker, AMQPChannelError) as e:
                 LOGGER.error("Pika exception: %s", e)
                 self._consumer.should_reconnect = True
             self._maybe_reconnect()
+        self._consumer.close_loop()
 
     def stop(self):
         """Stop the consumer."""
+        self._stop_requested.set()
         self._running = False
         self._consumer.stop()
 
@@ -205,24 +670,43 @@ class ReconnectingAsyncAttendanceConsumer:
         self._consumer.stop_consuming()
 
     def _maybe_reconnect(self):
-        """Reconnect if the consumer indicates it should."""
+        """Wait for the backoff delay if the consumer indicates it should reconnect."""
         if self._consumer.should_reconnect:
-            self._consumer.stop()
             reconnect_delay = self._get_reconnect_delay()
-            LOGGER.info("Reconnecting after %d seconds", reconnect_delay)
-            time.sleep(reconnect_delay)
-            self._consumer = AsyncAttendanceConsumer(
-                exchange_name=self._consumer._exchange_name, # pylint: disable=protected-access
-                exchange_type=self._consumer._exchange_type, # pylint: disable=protected-access
-                queue_name=self._consumer._queue, # pylint: disable=protected-access
-                message_callback=self._consumer.message_callback,
-            )
+            LOGGER.info("Reconnecting after %.1f seconds", reconnect_delay)
+            self._stop_requested.wait(reconnect_delay)
 
     def _get_reconnect_delay(self):
-        """Calculate the delay before the next reconnection attempt."""
-        if self._consumer.was_consuming:
-            self._reconnect_delay = 0
+        """Count the failed connection and return the delay before the next attempt."""
+        self._breaker.record_failure()
+        if self._breaker.is_open:
+            return self._breaker.cooldown
+        return self._backoff.next_delay()
+
+    def _on_consuming(self):
+        """Schedule the recovery check of a connection that started consuming."""
+        since = self._consumer.consuming_since
+        self._consumer._loop.call_later(  # pylint: disable=protected-access
+            STABLE_CONNECTION_SECONDS, self._on_stable, since
+        )
+
+    def _on_stable(self, since):
+        """Reset the backoff and close the breaker once a connection kept consuming.
+
+        A broker that drops connections right after accepting them keeps
+        backing off instead of reconnecting in a tight loop.
+        """
+        if self._consumer.consuming_since == since and self._consumer.was_consuming:
+            self._backoff.reset()
+            self._breaker.record_success()
+
+    def _on_health_change(self, health):
+        if self._breaker.is_open:
+            LOGGER.warning(
+                "Queue %s: %d connection failures in a row, reconnecting every %.0f seconds",
+                self._consumer._queue, self._breaker.failures, self._breaker.cooldown,  # pylint: disable=protected-access
+            )
         else:
-            self._reconnect_delay += 1
-        self._reconnect_delay = min(self._reconnect_delay, 30)
-        return self._reconnect_delay
+            LOGGER.info("Queue %s: connection recovered", self._consumer._queue)  # pylint: disable=protected-access
+        if self.health_callback:
+            self.health_callback(self, health)
@@ -0,0 +1,115 @@
+"""Reconnect backoff, host failover and circuit breaker for the RabbitMQ connections.
+
+``Backoff`` implements exponential backoff with decorrelated jitter: each
+delay is drawn between the base and three times the previous delay, capped.
+Connections of many queues failing together thus spread their reconnects
+instead of retrying in lockstep. ``CircuitBreaker`` counts consecutive
+connection failures and opens after a threshold; while open, reconnects are
+single probes spaced by the cooldown and the consumer reports degraded.
+``HostRotation`` walks the hosts of a clustered broker, so a node that is
+down is skipped at once and only a round of failures calls for a backoff.
+"""
+import random
+import threading
+
+DEFAULT_BASE_DELAY = 1.0
+DEFAULT_MAX_DELAY = 60.0
+DEFAULT_FAILURE_THRESHOLD = 5
+
+HEALTHY = "healthy"
+DEGRADED = "degraded"
+
+
+class Backoff:
+    """Exponential backoff with decorrelated jitter."""
+
+    def __init__(self, base=DEFAULT_BASE_DELAY, cap=DEFAULT_MAX_DELAY):
+        self.base = max(base, 0.001)
+        self.cap = max(cap, self.base)
+        self._delay = self.base
+
+    def next_delay(self):
+        """Return the seconds to wait before the next attempt."""
+        self._delay = min(self.cap, random.uniform(self.base, self._delay * 3))
+        return self._delay
+
+    def reset(self):
+        """Start over from the base delay after a successful attempt."""
+        self._delay = self.base
+
+
+class CircuitBreaker:
+    """Opens after ``threshold`` consecutive failures and closes on the next success.
+
+    ``on_change(health)`` is called with HEALTHY or DEGRADED on every transition.
+    """
+
+    def __init__(
+        self, threshold=DEFAULT_FAILURE_THRESHOLD, cooldown=DEFAULT_MAX_DELAY, on_change=None
+    ):
+        self.threshold = max(threshold, 1)
+        self.cooldown = cooldown
+        self.on_change = on_change
+        self.failures = 0
+        self._lock = threading.Lock()
+
+    @property
+    def is_open(self):
+        """Whether the breaker tripped: attempts are only probes spaced by the cooldown."""
+        return self.failures >= self.threshold
+
+    @property
+    def health(self):
+        """HEALTHY while closed, DEGRADED while open."""
+        return DEGRADED if self.is_open else HEALTHY
+
+    def record_failure(self):
+        """Count a failed attempt, opening the breaker at the threshold."""
+        with self._lock:
+            self.failures += 1
+            tripped = self.failures == self.threshold
+        if tripped:
+            self._notify(DEGRADED)
+
+    def record_success(self):
+        """Reset the failure count, closing an open breaker."""
+        with self._lock:
+            was_open = self.is_open
+            self.failures = 0
+        if was_open:
+            self._notify(HEALTHY)
+
+    def _notify(self, health):
+        if self.on_change:
+            self.on_change(health)
+
+
+class HostRotation:
+    """Cycles through the connection parameters of a broker's hosts."""
+
+    def __init__(self, parameters):
+        self.parameters = tuple(parameters)
+        self._index = 0
+        self._untried = len(self.parameters) - 1
+
+    @property
+    def current(self):
+        """Connection parameters of the host to connect to next."""
+        return self.parameters[self._index]
+
+    def connected(self):
+        """Start a new failover round after a successful connection."""
+        self._untried = len(self.parameters) - 1
+
+    def fail_over(self):
+        """Move to the next host.
+
+        Returns True while some host of the current round is untried, so it can
+        be connected to at once, and False once every host failed in a row.
+        """
+        self._index = (self._index + 1) % len(self.parameters)
+        if self._untried > 0:
+            self._untried -= 1
+            return True
+        self._untried = len(self.parameters) - 1
+        return False
@@ -0,0 +1,191 @@
+#pylint:disable=import-error,relative-beyond-top-level,too-many-instance-attributes
+"""Shared RabbitMQ connections.
+
+One ``AsyncioConnection`` per broker/vhost runs on a single I/O thread, and
+every consumer registered on it gets its own channel. Reconnecting is handled
+here for all channels at once instead of per consumer, failing over through
+the hosts of a clustered broker before backing off.
+"""
+import asyncio
+import hashlib
+import logging
+import threading
+
+from pika.adapters.asyncio_connection import AsyncioConnection
+
+from .backoff import Backoff, HostRotation
+
+LOGGER = logging.getLogger(__name__)
+
+CHANNEL_REOPEN_DELAY = 5
+
+
+class ConnectionManager:
+    """Owns one connection and its I/O thread, multiplexing consumer channels."""
+    MANAGERS = {}
+    _MANAGERS_LOCK = threading.Lock()
+
+    def __init__(self, key, parameters):
+        self.key = key
+        self._parameters = tuple(parameters)
+        self._hosts = HostRotation(parameters)
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(
+            target=self._run, daemon=True, name=f"rabbitmq-connection-{key[0]}"
+        )
+        self._connection = None
+        # Consumers attached on the I/O thread, and registered ones as seen by
+        # callers; _registered and _closing are guarded by _MANAGERS_LOCK
+        self._consumers = set()
+        self._registered = set()
+        self._closing = False
+        self._backoff = Backoff()
+
+    @staticmethod
+    def key_for(parameters):
+        """Identify the hosts, vhost, credentials and tuning of a sequence of connection parameters.
+
+        Any change to a broker, including its password or heartbeat, yields a
+        new key, so consumers started afterwards get a connection built from
+        the new settings rather than sharing one opened with the old ones.
+        """
+        first = parameters[0]
+        password = getattr(first.credentials, "password", None)
+        return (
+            ",".join(f"{params.host}:{params.port}" for params in parameters),
+            first.virtual_host,
+            getattr(first.credentials, "username", None),
+            # Only a digest of the password is kept in the key
+            hashlib.sha256(password.encode()).hexdigest() if isinstance(password, str) else None,
+            first.heartbeat,
+            first.frame_max,
+            first.socket_timeout,
+            first.blocked_connection_timeout,
+            tuple(sorted((first.tcp_options or {}).items())),
+        )
+
+    @classmethod
+    def get(cls, parameters):
+        """Return the running manager for the hosts of a broker, starting one if needed.
+
+        ``parameters`` holds the connection parameters of each host in failover order.
+        """
+        parameters = tuple(parameters)
+        key = cls.key_for(parameters)
+        with cls._MANAGERS_LOCK:
+            manager = cls.MANAGERS.get(key)
+            if manager is None or manager._closing:  # pylint: disable=protected-access
+                manager = cls.MANAGERS[key] = cls(key, parameters)
+                manager._thread.start()  # pylint: disable=protected-access
+        return manager
+
+    @property
+    def loop(self):
+        """The asyncio loop every channel of this connection runs on."""
+        return self._loop
+
+    def register(self, consumer):
+        """Attach a consumer; it gets a channel as soon as the connection is open.
+
+        Returns the manager the consumer was registered on: once its last
+        consumer left, a manager is closing and hands new consumers to a
+        fresh manager for the same broker.
+        """
+        with self._MANAGERS_LOCK:
+            if not self._closing:
+                self._registered.add(consumer)
+                self._loop.call_soon_threadsafe(self._attach, consumer)
+                return self
+        return self.get(self._parameters).register(consumer)
+
+    def unregister(self, consumer):
+        """Detach a consumer and close its channel, closing the connection after the last one.
+
+        The manager is marked closing at once, so ``get`` and ``register``
+        no longer hand it out while its I/O thread shuts down.
+        """
+        with self._MANAGERS_LOCK:
+            self._registered.discard(consumer)
+            if not self._registered:
+                self._closing = True
+                if self.MANAGERS.get(self.key) is self:
+                    del self.MANAGERS[self.key]
+        self._loop.call_soon_threadsafe(self._detach, consumer)
+
+    def reopen_channel(self, consumer):
+        """Reopen the channel of a registered consumer after the broker closed it."""
+        self._loop.call_later(CHANNEL_REOPEN_DELAY, self._reattach, consumer)
+
+    def _run(self):
+        """I/O thread: connect and run the shared loop until the last consumer leaves."""
+        asyncio.set_event_loop(self._loop)
+        self._loop.call_soon(self._connect)
+        self._loop.run_forever()
+        self._loop.close()
+        LOGGER.info("Shared RabbitMQ connection to %s stopped", self.key[0])
+
+    def _connect(self):
+        parameters = self._hosts.current
+        LOGGER.info(
+            "Opening shared RabbitMQ connection to %s:%s...", parameters.host, parameters.port
+        )
+        self._connection = AsyncioConnection(
+            parameters=parameters,
+            on_open_callback=self._on_connection_open,
+            on_open_error_callback=self._on_connection_open_error,
+            on_close_callback=self._on_connection_closed,
+            custom_ioloop=self._loop,
+        )
+
+    def _on_connection_open(self, connection):
+        LOGGER.info("Shared connection opened, attaching %d consumer(s)", len(self._consumers))
+        self._backoff.reset()
+        self._hosts.connected()
+        for consumer in self._consumers:
+            consumer.attach(connection)
+
+    def _on_connection_open_error(self, _, error):
+        LOGGER.error("Shared connection open failed: %s", error)
+        if self._hosts.fail_over():
+            # Another host of the cluster is untried: connect to it without backing off
+            self._loop.call_soon(self._connect)
+            return
+        self._schedule_reconnect()
+
+    def _on_connection_closed(self, _, reason):
+        LOGGER.warning("Shared connection closed: %s", reason)
+        self._connection = None
+        for consumer in self._consumers:
+            consumer.detach()
+        if self._closing:
+            self._loop.stop()
+        else:
+            self._hosts.fail_over()
+            self._schedule_reconnect()
+
+    def _schedule_reconnect(self):
+        delay = self._backoff.next_delay()
+        LOGGER.info("Reconnecting shared connection after %.1f seconds", delay)
+        self._loop.call_later(delay, self._connect)
+
+    def _is_open(self):
+        return self._connection is not None and self._connection.is_open
+
+    def _attach(self, consumer):
+        self._consumers.add(consumer)
+        if self._is_open():
+            consumer.attach(self._connection)
+
+    def _reattach(self, consumer):
+        if consumer in self._consumers and self._is_open():
+            consumer.attach(self._connection)
+
+    def _detach(self, consumer):
+        self._consumers.discard(consumer)
+        consumer.stop_consuming()
+        if self._consumers or not self._closing:
+            return
+        if self._is_open():
+            self._connection.close()
+        else:
+            self._loop.stop()
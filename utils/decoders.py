@@ -0,0 +1,83 @@
+#pylint:disable=import-error,too-few-public-methods
+"""Message body decoders selected by content type.
+
+Bodies are parsed straight from the ``bytes`` delivered by pika, without an
+intermediate ``str``. JSON uses orjson when it is installed and the stdlib
+otherwise; msgpack bodies need the msgpack package. Unknown or missing
+content types are decoded as JSON.
+"""
+import json
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - optional speedup
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover - optional format
+    msgpack = None
+
+PREVIEW_BYTES = 256
+
+
+def decode_json(body):
+    """Decode a JSON body from bytes or str."""
+    if orjson is not None:
+        return orjson.loads(body)
+    return json.loads(body)
+
+
+def decode_msgpack(body):
+    """Decode a msgpack body."""
+    if msgpack is None:
+        raise ValueError("Received a msgpack message but the msgpack package is not installed.")
+    return msgpack.unpackb(body, raw=False)
+
+
+DECODERS = {
+    "application/json": decode_json,
+    "text/json": decode_json,
+    "application/msgpack": decode_msgpack,
+    "application/x-msgpack": decode_msgpack,
+    "application/vnd.msgpack": decode_msgpack,
+}
+
+
+def register_decoder(content_type, decoder):
+    """Decode bodies of ``content_type`` with ``decoder(body)``.
+
+    The decoder raises ValueError on bad input.
+    """
+    DECODERS[content_type.lower()] = decoder
+
+
+def decode_body(body, content_type=None):
+    """Decode a message body according to its content type.
+
+    Raises ValueError when the body cannot be decoded.
+    """
+    decoder = decode_json
+    if isinstance(content_type, str) and content_type:
+        decoder = DECODERS.get(content_type.split(";", 1)[0].strip().lower(), decode_json)
+    try:
+        return decoder(body)
+    except TypeError as e:
+        raise ValueError(str(e)) from e
+
+
+class BodyPreview:
+    """Truncated view of a message body, only rendered if the log line is emitted."""
+    __slots__ = ("body",)
+
+    def __init__(self, body):
+        self.body = body
+
+    def __str__(self):
+        body = self.body
+        if isinstance(body, str):
+            body = body.encode()
+        preview = bytes(body[:PREVIEW_BYTES]).decode("utf-8", "replace")
+        if len(body) > PREVIEW_BYTES:
+            return f"{preview}... ({len(body)} bytes)"
+        return preview
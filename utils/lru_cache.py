@@ -0,0 +1,69 @@
+"""Small thread-safe LRU cache shared by the message processing threads."""
+import threading
+import time
+from collections import OrderedDict
+
+_MISSING = object()
+
+
+class LRUCache:
+    """Bounded mapping that evicts the least recently used entries.
+
+    With ``ttl`` (seconds), entries also expire that long after they were set.
+    """
+
+    def __init__(self, maxsize=10000, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _live(self, key):
+        """Return the value of ``key``, dropping it if expired. Call with the lock held."""
+        entry = self._data.get(key, _MISSING)
+        if entry is _MISSING:
+            return _MISSING
+        value, expires_at = entry
+        if expires_at is not None and expires_at <= time.monotonic():
+            del self._data[key]
+            return _MISSING
+        return value
+
+    def get(self, key, default=None):
+        """Return the value of ``key`` and mark it as recently used."""
+        with self._lock:
+            value = self._live(key)
+            if value is _MISSING:
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        """Store ``value`` under ``key``, evicting the oldest entries beyond ``maxsize``."""
+        expires_at = time.monotonic() + self.ttl if self.ttl else None
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        """Remove ``key`` and return its value."""
+        with self._lock:
+            value = self._live(key)
+            if value is _MISSING:
+                return default
+            del self._data[key]
+            return value
+
+    def clear(self):
+        """Remove every entry."""
+        with self._lock:
+            self._data.clear()
+
+    def __contains__(self, key):
+        with self._lock:
+            return self._live(key) is not _MISSING
+
+    def __len__(self):
+        return len(self._data)
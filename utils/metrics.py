@@ -0,0 +1,178 @@
+#pylint:disable=too-many-instance-attributes
+"""In-process throughput and latency metrics of the RabbitMQ consumers.
+
+Every consumer controller gets a ``QueueMetrics`` holding message counters, a one-minute
+throughput window and fixed-bucket latency histograms. Recording is a few
+integer updates under a lock, cheap enough for the message path; reading
+takes a snapshot. Metrics live in the process that runs the consumers, which
+publishes its snapshots on its slot leases; ``merge_snapshots`` adds up the
+snapshots of several processes.
+"""
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+# Upper bounds (ms) of the latency histogram buckets; the last one is open
+LATENCY_BUCKETS_MS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+RATE_WINDOW_SECONDS = 60
+STAGES = ("decode", "db", "commit")
+# Keys of the bucket counts in a histogram snapshot
+BUCKET_LABELS = (*map(str, LATENCY_BUCKETS_MS), "inf")
+COUNTERS = ("received", "acked", "retried", "rejected")
+
+
+class LatencyHistogram:
+    """Fixed-bucket histogram of durations in milliseconds."""
+
+    def __init__(self):
+        self.counts = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+        self.count = 0
+        self.total_ms = 0.0
+
+    def observe(self, duration_ms):
+        """Record one duration."""
+        self.counts[bisect_left(LATENCY_BUCKETS_MS, duration_ms)] += 1
+        self.count += 1
+        self.total_ms += duration_ms
+
+    def merge(self, snapshot):
+        """Add the samples of another histogram, given as its snapshot."""
+        buckets = snapshot.get("buckets") or {}
+        for index, label in enumerate(BUCKET_LABELS):
+            self.counts[index] += buckets.get(label, 0)
+        self.count += snapshot.get("count", 0)
+        self.total_ms += snapshot.get("mean_ms", 0.0) * snapshot.get("count", 0)
+
+    def percentile(self, fraction):
+        """Return the upper bound of the bucket holding the given fraction of samples."""
+        if not self.count:
+            return 0.0
+        rank, seen = fraction * self.count, 0
+        for index, bucket_count in enumerate(self.counts):
+            seen += bucket_count
+            if seen >= rank:
+                break
+        return float(LATENCY_BUCKETS_MS[min(index, len(LATENCY_BUCKETS_MS) - 1)])
+
+    def snapshot(self):
+        """Return count, mean, p50/p95/p99 and the bucket counts."""
+        return {
+            "count": self.count,
+            "mean_ms": self.total_ms / self.count if self.count else 0.0,
+            "p50_ms": self.percentile(0.5),
+            "p95_ms": self.percentile(0.95),
+            "p99_ms": self.percentile(0.99),
+            "buckets": dict(zip(BUCKET_LABELS, self.counts)),
+        }
+
+
+class QueueMetrics:
+    """Counters, throughput and latencies of the consumers of one queue."""
+    REGISTRY = {}
+    _REGISTRY_LOCK = threading.Lock()
+
+    def __init__(self, queue):
+        self.queue = queue
+        self.received = 0
+        self.acked = 0
+        self.retried = 0
+        self.rejected = 0
+        self.latencies = {stage: LatencyHistogram() for stage in STAGES}
+        # Acked messages per second over the last RATE_WINDOW_SECONDS
+        self._rate_slots = [0] * RATE_WINDOW_SECONDS
+        self._rate_seconds = [0] * RATE_WINDOW_SECONDS
+        self._lock = threading.Lock()
+
+    @classmethod
+    def get(cls, key, queue):
+        """Return the metrics registered under ``key``, creating them for ``queue`` on first use.
+
+        Controllers key their metrics by database and id, since one process
+        may serve several databases whose queues share a name.
+        """
+        metrics = cls.REGISTRY.get(key)
+        if metrics is None:
+            with cls._REGISTRY_LOCK:
+                metrics = cls.REGISTRY.setdefault(key, cls(queue))
+        return metrics
+
+    def record_received(self, count=1):
+        """Count deliveries handed to the consumer."""
+        with self._lock:
+            self.received += count
+
+    def record_outcomes(self, acked=0, retried=0, rejected=0):
+        """Count settled deliveries by outcome."""
+        second = int(time.monotonic())
+        slot = second % RATE_WINDOW_SECONDS
+        with self._lock:
+            self.acked += acked
+            self.retried += retried
+            self.rejected += rejected
+            if self._rate_seconds[slot] != second:
+                self._rate_seconds[slot] = second
+                self._rate_slots[slot] = 0
+            self._rate_slots[slot] += acked
+
+    def observe(self, stage, duration_ms):
+        """Record the duration of a processing stage."""
+        with self._lock:
+            self.latencies[stage].observe(duration_ms)
+
+    @contextmanager
+    def timed(self, stage):
+        """Time the enclosed block as ``stage``."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, (time.perf_counter() - started) * 1000)
+
+    def throughput(self):
+        """Return acked messages per second over the last minute."""
+        oldest = int(time.monotonic()) - RATE_WINDOW_SECONDS
+        with self._lock:
+            acked = sum(
+                count for count, second in zip(self._rate_slots, self._rate_seconds)
+                if second > oldest
+            )
+        return acked / RATE_WINDOW_SECONDS
+
+    def snapshot(self):
+        """Return every metric as a JSON-serializable dict."""
+        throughput = self.throughput()
+        with self._lock:
+            return {
+                "queue": self.queue,
+                "received": self.received,
+                "acked": self.acked,
+                "retried": self.retried,
+                "rejected": self.rejected,
+                "throughput_per_s": throughput,
+                "latency": {stage: hist.snapshot() for stage, hist in self.latencies.items()},
+            }
+
+
+def merge_snapshots(queue, snapshots):
+    """Return the sum of the metrics snapshots of one queue taken in several processes.
+
+    Counters and throughputs are added up; latency percentiles are computed
+    again from the summed histogram buckets.
+    """
+    totals = dict.fromkeys(COUNTERS, 0)
+    throughput = 0.0
+    latencies = {stage: LatencyHistogram() for stage in STAGES}
+    for snapshot in snapshots:
+        for name in COUNTERS:
+            totals[name] += snapshot.get(name, 0)
+        throughput += snapshot.get("throughput_per_s", 0.0)
+        for stage, latency in (snapshot.get("latency") or {}).items():
+            if stage in latencies:
+                latencies[stage].merge(latency)
+    return {
+        "queue": queue,
+        **totals,
+        "throughput_per_s": throughput,
+        "latency": {stage: hist.snapshot() for stage, hist in latencies.items()},
+    }
@@ -0,0 +1,174 @@
+#pylint:disable=import-error,protected-access,relative-beyond-top-level
+"""Background coordinator keeping this process's consumer slots in line with its leases.
+
+One daemon thread per database and process heartbeats the leases every third
+of the lease timeout, then starts the consumers of newly claimed slots, stops
+the ones whose lease was released or lost, and publishes their state and
+metrics on the leases. When no heartbeat succeeds
+for a whole lease timeout (e.g. the database is unreachable), other processes
+may already have taken the slots over, so the local consumers are stopped.
+
+When the ``rabbitmq_dedicated_runner`` server option is set, the HTTP server
+processes leave consumers to the ``rabbitmq_consumers`` command, whose
+workers run a coordinator scoped to the controllers they are assigned.
+"""
+import atexit
+import logging
+import os
+import threading
+import time
+
+from odoo import SUPERUSER_ID, api
+from odoo.modules.registry import Registry
+from odoo.tools import config, str2bool
+
+from .registry_handle import RegistryHandle
+
+_logger = logging.getLogger(__name__)
+
+# Set by the rabbitmq_consumers command in its supervisor and worker processes
+RUNNER_PROCESS = False
+# Seconds start_when_ready waits for a registry before leaving it to the cron
+READY_TIMEOUT = 600
+
+
+def dedicated_runner():
+    """Return whether consumers are run by the rabbitmq_consumers command rather than the server."""
+    return RUNNER_PROCESS or str2bool(str(config.get("rabbitmq_dedicated_runner") or False))
+
+
+class OwnershipCoordinator:
+    """Periodic ownership sync for one database in this process."""
+    COORDINATORS = {}
+    _COORDINATORS_LOCK = threading.Lock()
+
+    def __init__(self, db_name, controller_ids=None):
+        self.db_name = db_name
+        # Controllers assigned by the consumer runner; None takes a fair share of all
+        self.controller_ids = controller_ids
+        self._stop = threading.Event()
+        # (db_name, controller_id) run from the last successful heartbeat, and when it happened
+        self._controller_keys = set()
+        self._last_heartbeat = time.monotonic()
+        self._lease_timeout = None
+        self._thread = threading.Thread(
+            target=self._run, daemon=True, name=f"rabbitmq-ownership-{db_name}"
+        )
+
+    @classmethod
+    def ensure(cls, db_name):
+        """Start the coordinator of ``db_name`` in this process unless it is running."""
+        key = (db_name, os.getpid())
+        with cls._COORDINATORS_LOCK:
+            coordinator = cls.COORDINATORS.get(key)
+            if coordinator is None or not coordinator._thread.is_alive():
+                coordinator = cls.COORDINATORS[key] = cls(db_name)
+                coordinator._thread.start()
+        return coordinator
+
+    def _env(self, cr):
+        return api.Environment(cr, SUPERUSER_ID, {})
+
+    def _run(self):
+        interval = None
+        while interval is None or not self._stop.wait(interval):
+            try:
+                interval = self.tick()
+            except Exception:  # pylint: disable=broad-except
+                _logger.exception("RabbitMQ consumer ownership sync failed for '%s'", self.db_name)
+                interval = interval or 10
+                self._stop_if_lapsed()
+        self.release()
+
+    def tick(self):
+        """Sync leases and apply them to the local consumers.
+
+        Returns the seconds until the next tick.
+        """
+        with RegistryHandle.get(self.db_name).registry.cursor() as cr:
+            env = self._env(cr)
+            leases = env["rabbitmq.consumer.lease"]
+            lease_timeout = leases._lease_timeout()
+            owned = leases._sync_ownership(controller_ids=self.controller_ids)
+            cr.commit()
+            self._last_heartbeat, self._lease_timeout = time.monotonic(), lease_timeout
+            env["rabbitmq.consumer.controller"]._apply_ownership(owned, jitter=True)
+            self._controller_keys = {
+                (self.db_name, controller_id) for controller_id, _slot in owned
+            }
+            # Committed when the cursor closes; a failure only delays the metrics
+            try:
+                with cr.savepoint():
+                    leases._publish_local_state()
+            except Exception:  # pylint: disable=broad-except
+                _logger.warning("Could not publish RabbitMQ consumer state of '%s'", self.db_name)
+            return max(lease_timeout / 3, 1)
+
+    def _stop_if_lapsed(self):
+        """Stop the local consumers once no heartbeat succeeded for a lease timeout.
+
+        The leases have expired by then and other processes may be consuming
+        the same slots. Only the in-memory registry is used, so this works
+        while the database is unreachable; the next successful tick claims
+        and restarts the slots.
+        """
+        if not self._controller_keys or self._lease_timeout is None:
+            return
+        if time.monotonic() - self._last_heartbeat < self._lease_timeout:
+            return
+        registry = Registry.registries.get(self.db_name)
+        if registry is None:
+            return
+        _logger.warning(
+            "No RabbitMQ lease heartbeat for '%s' in %ss: stopping the consumers of controllers %s",
+            self.db_name, self._lease_timeout,
+            ", ".join(str(controller_id) for _db, controller_id in sorted(self._controller_keys)),
+        )
+        registry["rabbitmq.consumer.controller"]._stop_local_consumers(self._controller_keys)
+        self._controller_keys = set()
+
+    def stop(self):
+        """Stop heartbeating; the leases are released so other nodes take over immediately."""
+        self._stop.set()
+
+    def release(self):
+        """Stop the local consumers and delete this process's leases and node row."""
+        try:
+            with RegistryHandle.get(self.db_name).registry.cursor() as cr:
+                env = self._env(cr)
+                env["rabbitmq.consumer.controller"]._apply_ownership(set())
+                env["rabbitmq.consumer.lease"]._release_ownership()
+        except Exception:  # pylint: disable=broad-except
+            _logger.warning("Could not release RabbitMQ consumer leases of '%s'", self.db_name)
+
+
+def start_when_ready(db_names, timeout=READY_TIMEOUT, poll_interval=1.0):
+    """Start the coordinator of each database once the server has loaded its registry.
+
+    Only registries loaded by the server are considered: nothing is loaded
+    here, so startup never competes with module loading or upgrades. Prefork
+    servers do not call this: the consumers would start in the master.
+    """
+    pending = list(db_names)
+    deadline = time.monotonic() + timeout
+    while pending and time.monotonic() < deadline:
+        for db_name in list(pending):
+            registry = Registry.registries.get(db_name)
+            if registry is not None and registry.ready and "rabbitmq.consumer.lease" in registry:
+                OwnershipCoordinator.ensure(db_name)
+                pending.remove(db_name)
+        if pending:
+            time.sleep(poll_interval)
+    if pending:
+        _logger.info(
+            "Registry of %s not ready; their consumers start with the ensure-consumers cron",
+            ", ".join(pending),
+        )
+
+
+@atexit.register
+def _release_all():
+    """Hand the slots of this process over on a clean shutdown."""
+    for (_db_name, pid), coordinator in list(OwnershipCoordinator.COORDINATORS.items()):
+        if pid == os.getpid():
+            coordinator.release()
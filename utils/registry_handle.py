@@ -0,0 +1,141 @@
+#pylint:disable=import-error,too-many-instance-attributes
+"""Per-database registry handle for RabbitMQ consumer threads.
+
+The handle resolves the Odoo registry once, re-checks database signaling on a
+fixed interval instead of on every message, and leases one cursor per
+consumer thread that is reused across messages until it is worn out.
+"""
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+from odoo import SUPERUSER_ID, api, modules
+
+_logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_USES = 500
+DEFAULT_MAX_AGE = 60.0
+DEFAULT_SIGNAL_INTERVAL = 5.0
+
+
+class _CursorLease:
+    """A cursor leased to a single thread, with usage bookkeeping."""
+
+    def __init__(self, cr, generation):
+        self.cr = cr
+        self.generation = generation
+        self.uses = 0
+        self.created_at = time.monotonic()
+
+    def is_worn(self, max_uses, max_age, generation):
+        """Return True when the lease must be closed instead of reused."""
+        return (
+            self.cr.closed
+            or self.generation != generation
+            or self.uses >= max_uses
+            or time.monotonic() - self.created_at >= max_age
+        )
+
+    def close(self):
+        """Close the underlying cursor, ignoring an already closed one."""
+        if not self.cr.closed:
+            self.cr.close()
+
+
+class RegistryHandle:
+    """Cached registry and cursor leases for one database."""
+    HANDLES = {}
+    _HANDLES_LOCK = threading.Lock()
+
+    def __init__(
+        self,
+        db_name,
+        max_uses=DEFAULT_MAX_USES,
+        max_age=DEFAULT_MAX_AGE,
+        signal_interval=DEFAULT_SIGNAL_INTERVAL,
+    ):
+        self.db_name = db_name
+        self.max_uses = max_uses
+        self.max_age = max_age
+        self.signal_interval = signal_interval
+        self._registry = None
+        self._generation = 0
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    @classmethod
+    def get(cls, db_name):
+        """Return the shared handle for ``db_name``, creating it on first use."""
+        handle = cls.HANDLES.get(db_name)
+        if handle is None:
+            with cls._HANDLES_LOCK:
+                handle = cls.HANDLES.get(db_name)
+                if handle is None:
+                    handle = cls.HANDLES[db_name] = cls(db_name)
+        return handle
+
+    @property
+    def registry(self):
+        """Return an up-to-date registry, checking signaling at most every interval."""
+        now = time.monotonic()
+        if self._registry is not None and now - self._checked_at < self.signal_interval:
+            return self._registry
+        with self._lock:
+            if self._registry is None or now - self._checked_at >= self.signal_interval:
+                registry = modules.registry.Registry(self.db_name).check_signaling()
+                if registry is not self._registry:
+                    if self._registry is not None:
+                        _logger.info(
+                            "Registry of database '%s' reloaded, dropping cursor leases.",
+                            self.db_name,
+                        )
+                    self._registry = registry
+                    self._generation += 1
+                self._checked_at = now
+        return self._registry
+
+    def invalidate(self):
+        """Force the next lease to resolve the registry and open a fresh cursor."""
+        with self._lock:
+            self._registry = None
+            self._generation += 1
+            self._checked_at = 0.0
+
+    @contextmanager
+    def lease(self):
+        """Yield a superuser environment bound to this thread's leased cursor.
+
+        The caller is responsible for committing. On error the transaction is
+        rolled back and the cursor is discarded so the next message starts clean.
+        """
+        registry = self.registry
+        lease = getattr(self._local, "lease", None)
+        if lease is not None and lease.is_worn(self.max_uses, self.max_age, self._generation):
+            lease.close()
+            lease = None
+        if lease is None:
+            lease = self._local.lease = _CursorLease(registry.cursor(), self._generation)
+        lease.uses += 1
+        try:
+            yield api.Environment(lease.cr, SUPERUSER_ID, {})
+        except Exception:
+            self._discard(lease)
+            raise
+
+    def _discard(self, lease):
+        """Roll back and close a lease after a failure."""
+        self._local.lease = None
+        try:
+            if not lease.cr.closed:
+                lease.cr.rollback()
+        finally:
+            lease.close()
+
+    def release(self):
+        """Close the cursor leased to the calling thread, if any."""
+        lease = getattr(self._local, "lease", None)
+        self._local.lease = None
+        if lease is not None:
+            lease.close()